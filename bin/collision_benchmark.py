@@ -0,0 +1,87 @@
+"""Compare the collision managers with maps of 10k to 100k colliders. Most
+colliders are 32px wall tiles, the rest are moving entities."""
+
+from nightcaste.collision import QTreeCollisionManager
+from nightcaste.collision import SpatialHashCollisionManager
+from pygame import Rect
+from time import perf_counter
+import argparse
+import random
+
+TILE_SIZE = 32
+MOVING_SHARE = 0.1
+
+
+def create_colliders(count, rng):
+    """Creates wall tiles on a map with 50% blocked cells and moving
+    entities."""
+    movers = int(count * MOVING_SHARE)
+    walls = count - movers
+    cells = int((walls * 2) ** 0.5) + 1
+    size = cells * TILE_SIZE
+    colliders = {}
+    for index, cell in enumerate(rng.sample(range(cells * cells), walls)):
+        colliders[('tile', index)] = Rect((cell % cells) * TILE_SIZE,
+                                          (cell // cells) * TILE_SIZE,
+                                          TILE_SIZE, TILE_SIZE)
+    for entity in range(movers):
+        colliders[entity] = Rect(rng.randrange(size), rng.randrange(size),
+                                 24, 24)
+    return Rect(0, 0, size, size), colliders, movers
+
+
+def measure(manager, bounds, colliders, movers, operations, rng):
+    start = perf_counter()
+    manager.fill(bounds, colliders)
+    fill = perf_counter() - start
+
+    entities = [rng.randrange(movers) for _ in range(operations)]
+    steps = [(rng.randint(-4, 4), rng.randint(-4, 4))
+             for _ in range(operations)]
+    start = perf_counter()
+    for entity, (dx, dy) in zip(entities, steps):
+        colliders[entity].move_ip(dx, dy)
+        manager.move(entity)
+    move = perf_counter() - start
+
+    start = perf_counter()
+    for entity in entities:
+        manager.collide_rect(entity, colliders[entity])
+    query = perf_counter() - start
+
+    start = perf_counter()
+    manager.collide_pairs()
+    pairs = perf_counter() - start
+    return fill, move, query, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('counts', nargs='*', type=int,
+                        default=[10000, 30000, 100000])
+    parser.add_argument('--operations', type=int, default=10000,
+                        help='number of moves and queries')
+    parser.add_argument('--cell-size', type=int, default=64)
+    args = parser.parse_args()
+
+    managers = [
+        ('quadtree', QTreeCollisionManager),
+        ('spatial hash', lambda: SpatialHashCollisionManager(args.cell_size))]
+    print('%-12s %8s %10s %12s %12s %12s' % (
+        'backend', 'objects', 'fill [ms]', 'move [us]', 'query [us]',
+        'pairs [ms]'))
+    for count in args.counts:
+        for name, create_manager in managers:
+            rng = random.Random(count)
+            bounds, colliders, movers = create_colliders(count, rng)
+            fill, move, query, pairs = measure(
+                create_manager(), bounds, colliders, movers,
+                args.operations, rng)
+            print('%-12s %8d %10.1f %12.2f %12.2f %12.1f' % (
+                name, count, fill * 1000,
+                move / args.operations * 1000000,
+                query / args.operations * 1000000, pairs * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""Replay a recorded Nightcaste session headless"""
+
+from nightcaste import replay
+import sys
+
+if __name__ == "__main__":
+    sys.exit(replay.main())
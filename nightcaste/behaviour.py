@@ -76,11 +76,10 @@ class TurnBehaviourManager(BehaviourManager):
 
         # TODO: Make the method prettier ^^
         for component_type, behaviour in self.behaviours.items():
-            components = self.entity_manager.get_all(component_type)
+            rows = self.entity_manager.query(component_type, 'Turn')
 
-            for entity, component in components.items():
+            for entity, component, turn in rows:
                 s = self.locked_entities
-                turn = self.entity_manager.get(entity, "Turn")
                 if (turn.ticks == 0 and turn.delta >= turn.min_turn_time):
                     # It's the entity's Turn!
                     if (turn.locking and entity not in s):
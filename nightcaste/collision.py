@@ -1,14 +1,430 @@
+"""Broad phase collision detection. A collision manager indexes the rects of
+collidable objects (entities or tiles) and finds the objects overlapping a
+given rect. The backend of a system can be selected in its configuration, see
+create_collision_manager.
+
+The static tiles of a map are not indexed as objects, a TileCollisionMap
+answers collisions with them from a grid of blocked cells."""
+from operator import itemgetter
 from pygame import Rect
 import logging
+import math
+import numpy
+import utils
+
+
+def sweep_and_prune(collidables):
+    """Finds all overlapping pairs of rects. The rects are sorted by their
+    left edge and swept from left to right, so every rect is only compared
+    with the following rects starting before its right edge.
+    O(n * log n + k) for k pairs of rects overlapping on the x axis.
+
+    Args:
+        collidables: Iterable of (key, Rect).
+
+    Returns:
+        A list of (key, other_key) pairs, every pair is returned once.
+
+    """
+    # Empty rects do not collide
+    boxes = sorted(((rect.left, rect.right, rect.top, rect.bottom, key)
+                    for key, rect in collidables
+                    if rect.width > 0 and rect.height > 0),
+                   key=itemgetter(0))
+    pairs = []
+    count = len(boxes)
+    for index in range(count):
+        _, right, top, bottom, key = boxes[index]
+        for other in range(index + 1, count):
+            other_left, _, other_top, other_bottom, other_key = boxes[other]
+            if other_left >= right:
+                break
+            if other_top < bottom and top < other_bottom:
+                pairs.append((key, other_key))
+    return pairs
+
+
+def sweep_rect(rect, dx, dy, other):
+    """Sweeps the rect by dx, dy against the static rect other. Rects which
+    only touch do not collide and rects already overlapping at the start are
+    ignored, so an entity can always move out of an overlap.
+
+    Returns:
+        None if the rects do not collide during the movement, otherwise the
+        time of impact (0 <= time < 1, the fraction of dx, dy before the
+        contact) and the contact normal (normal_x, normal_y) of the other
+        rect.
+
+    """
+    if dx > 0:
+        entry_x = (other.left - rect.right) / dx
+        exit_x = (other.right - rect.left) / dx
+    elif dx < 0:
+        entry_x = (other.right - rect.left) / dx
+        exit_x = (other.left - rect.right) / dx
+    elif rect.right <= other.left or other.right <= rect.left:
+        return None
+    else:
+        entry_x, exit_x = -math.inf, math.inf
+    if dy > 0:
+        entry_y = (other.top - rect.bottom) / dy
+        exit_y = (other.bottom - rect.top) / dy
+    elif dy < 0:
+        entry_y = (other.bottom - rect.top) / dy
+        exit_y = (other.top - rect.bottom) / dy
+    elif rect.bottom <= other.top or other.bottom <= rect.top:
+        return None
+    else:
+        entry_y, exit_y = -math.inf, math.inf
+    entry = max(entry_x, entry_y)
+    if entry < 0 or entry >= 1 or entry >= min(exit_x, exit_y):
+        return None
+    if entry_x > entry_y:
+        return entry, (-1 if dx > 0 else 1, 0)
+    return entry, (0, -1 if dy > 0 else 1)
+
+
+def swept_bounds(rect, dx, dy):
+    """Get the rect covering the rect at the start and the end of the
+    movement by dx, dy."""
+    left = rect.left + min(math.floor(dx), 0)
+    top = rect.top + min(math.floor(dy), 0)
+    return Rect(left, top,
+                rect.right + max(math.ceil(dx), 0) - left,
+                rect.bottom + max(math.ceil(dy), 0) - top)
+
+
+def create_collision_manager(config=None):
+    """Creates the collision manager described by the configuration.
+
+    Args:
+        config (dict): (Optionally) {
+                'impl': ['nightcaste.collision', 'SpatialHashCollisionManager'],
+                'config': {'cell_size': 64}
+            }
+            Without configuration a QTreeCollisionManager is created.
+
+    """
+    if config is None:
+        return QTreeCollisionManager()
+    impl = config['impl']
+    manager_class = utils.class_for_name(impl[0], impl[1])
+    return manager_class(**config.get('config', {}))
+
+
+class CollisionManager:
+    """Interface of all collision managers. The rects are referenced, not
+    copied, so an object is moved by moving its rect in place and notifying
+    the manager with move. The tiles of the current map are set separately
+    with set_tiles."""
+    # The TileCollisionMap of the current map
+    tiles = None
+
+    def set_tiles(self, tiles):
+        """Sets the TileCollisionMap of the current map."""
+        self.tiles = tiles
+
+    def sweep(self, entity, rect, dx, dy):
+        """Finds the first blocking object or tile hit by the rect of the
+        entity when it moves by dx, dy (see sweep_rect). Objects with a false
+        blocking attribute (like Colliding stairs) are passed through.
+
+        Returns:
+            None if nothing is hit, otherwise (time, normal, key) of the
+            first contact. The key of a tile is its cell (x, y).
+
+        """
+        hit = None
+        for key in self.collide_rect(entity, swept_bounds(rect, dx, dy)):
+            other = self.get_rect(key)
+            if not getattr(other, 'blocking', True):
+                continue
+            contact = sweep_rect(rect, dx, dy, other)
+            if contact is not None and (hit is None or contact[0] < hit[0]):
+                hit = contact + (key,)
+        if self.tiles is not None:
+            contact = self.tiles.sweep(rect, dx, dy)
+            if contact is not None and (hit is None or contact[0] < hit[0]):
+                hit = contact
+        return hit
+
+    def get_rect(self, entity):
+        """Get the rect of an object."""
+        raise NotImplementedError()
+
+    def raycast(self, x0, y0, x1, y1):
+        """Finds the first blocking tile on the ray from the pixel x0, y0 to
+        x1, y1 (see TileCollisionMap.raycast). Objects do not block rays."""
+        if self.tiles is None:
+            return None
+        return self.tiles.raycast(x0, y0, x1, y1)
+
+    def line_of_sight(self, x0, y0, x1, y1):
+        """Returns True if no blocking tile is between the pixels x0, y0 and
+        x1, y1."""
+        return self.tiles is None or self.tiles.line_of_sight(x0, y0, x1, y1)
+
+    def visible_from(self, x, y, targets):
+        """Batched line of sight from the pixel x, y to the target pixels
+        (see TileCollisionMap.visible_from)."""
+        if self.tiles is None:
+            return numpy.ones(len(targets), dtype=bool)
+        return self.tiles.visible_from(x, y, targets)
 
+    def fill(self, bounds, collidables):
+        """Replaces all objects with the given collidables.
+
+        Args:
+            bounds (Rect): The area containing all objects.
+            collidables (dict): {key: Rect} of all objects.
+
+        """
+        raise NotImplementedError()
+
+    def insert(self, entity, rect):
+        """Adds a single object."""
+        raise NotImplementedError()
+
+    def remove(self, entity):
+        """Removes an object, returns False if it is unknown."""
+        raise NotImplementedError()
 
-class QTreeCollisionManager:
+    def move(self, entity):
+        """Notifies the collision manager that an entits rect was moved.
+
+        NOTE: The methods assumes the entites rect was moved in place!"""
+        raise NotImplementedError()
+
+    def collide_rect(self, entity, rect):
+        """Get the keys of all objects overlapping the rect, except the
+        entity itself."""
+        raise NotImplementedError()
+
+    def collide_pairs(self):
+        """Get all pairs (key, other_key) of overlapping objects in a single
+        call. Every pair is returned once, in no particular order."""
+        raise NotImplementedError()
+
+
+class TileCollisionMap:
+    """The blocking cells of a map. The grid of blocked cells is derived from
+    the tile types with a single array lookup, so a collision check only
+    reads the cells covered by a rect. Streamed maps (ChunkedTiles) are not
+    converted as a whole, their cells are looked up in the tile window of
+    every query. Cells outside of the map are not blocked.
+
+    Args:
+        tiles (numpy.ndarray): Grid of tile ids indexed by [x, y] or
+            ChunkedTiles.
+        tile_types (TileTypes): The table describing the tile ids.
+        tile_size (int): The size of a tile in pixels.
+
+    """
+
+    def __init__(self, tiles, tile_types, tile_size):
+        self.tile_types = tile_types
+        self.tile_size = tile_size
+        self.shape = tiles.shape
+        if isinstance(tiles, numpy.ndarray):
+            # The blocked cells [x, y]
+            self.grid = tile_types.blocking[tiles]
+            self.tiles = None
+        else:
+            self.grid = None
+            self.tiles = tiles
+
+    @classmethod
+    def from_map(cls, map):
+        """Creates the collision map of a Map component."""
+        return cls(map.tiles, map.tile_types, map.tilesetsize)
+
+    def is_blocked(self, x, y):
+        """Returns True if the cell x, y is blocked."""
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            return False
+        if self.grid is not None:
+            return bool(self.grid[x, y])
+        tile = self.tiles[x, y]
+        return bool(self.tile_types.blocking[tile])
+
+    def window(self, x0, y0, x1, y1):
+        """Get the blocked cells of the window [x0:x1, y0:y1] (clipped to the
+        map) as boolean array. The array is empty if the window lies outside
+        of the map."""
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.shape[0]), min(y1, self.shape[1])
+        if x1 <= x0 or y1 <= y0:
+            return numpy.zeros((max(x1 - x0, 0), max(y1 - y0, 0)), dtype=bool)
+        if self.grid is not None:
+            return self.grid[x0:x1, y0:y1]
+        cells = self.tiles[x0:x1, y0:y1]
+        # Read the blocking flags after the window, since creating chunks
+        # can register new tile types
+        return self.tile_types.blocking[cells]
+
+    def cell_range(self, rect):
+        """Get the cells x0, y0, x1, y1 (exclusive) covered by the rect."""
+        size = self.tile_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size + 1, (rect.bottom - 1) // size + 1)
+
+    def collides(self, rect):
+        """Returns True if the rect overlaps a blocked cell."""
+        x0, y0, x1, y1 = self.cell_range(rect)
+        if x1 <= max(x0, 0) or y1 <= max(y0, 0):
+            return False
+        return bool(self.window(x0, y0, x1, y1).any())
+
+    def sweep(self, rect, dx, dy):
+        """Finds the first blocked cell hit by the rect when it moves by dx,
+        dy (see sweep_rect).
+
+        Returns:
+            None if no cell is hit, otherwise (time, normal, (x, y)).
+
+        """
+        x0, y0, x1, y1 = self.cell_range(swept_bounds(rect, dx, dy))
+        x0, y0 = max(x0, 0), max(y0, 0)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        size = self.tile_size
+        hit = None
+        cell_rect = Rect(0, 0, size, size)
+        for x, y in numpy.argwhere(self.window(x0, y0, x1, y1)).tolist():
+            cell_rect.topleft = ((x0 + x) * size, (y0 + y) * size)
+            contact = sweep_rect(rect, dx, dy, cell_rect)
+            if contact is not None and (hit is None or contact[0] < hit[0]):
+                hit = contact + ((x0 + x, y0 + y),)
+        return hit
+
+    def raycast(self, x0, y0, x1, y1):
+        """Traces the ray from the pixel x0, y0 to x1, y1 cell by cell through
+        the grid (DDA), starting with the cell of the origin.
+
+        Returns:
+            None if the ray hits no blocked cell, otherwise (time, normal,
+            (x, y)) of the first blocked cell, where time is the fraction of
+            the ray before the cell and normal the side of the cell which is
+            hit ((0, 0) for the cell of the origin).
+
+        """
+        size = self.tile_size
+        dx, dy = x1 - x0, y1 - y0
+        x, y = int(x0 // size), int(y0 // size)
+        end_x, end_y = int(x1 // size), int(y1 // size)
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # The time of the next vertical and horizontal cell border and the
+        # time between two borders
+        next_x = ((x + (dx > 0)) * size - x0) / dx if dx else math.inf
+        next_y = ((y + (dy > 0)) * size - y0) / dy if dy else math.inf
+        delta_x = size / abs(dx) if dx else math.inf
+        delta_y = size / abs(dy) if dy else math.inf
+        # Read the cells of the ray with a single window
+        left, top = max(min(x, end_x), 0), max(min(y, end_y), 0)
+        window = self.window(left, top, max(x, end_x) + 1,
+                             max(y, end_y) + 1)
+        width, height = window.shape
+        time, normal = 0, (0, 0)
+        for _ in range(abs(end_x - x) + abs(end_y - y) + 1):
+            if 0 <= x - left < width and 0 <= y - top < height and \
+                    window[x - left, y - top]:
+                return time, normal, (x, y)
+            if next_x < next_y:
+                time, normal = next_x, (-step_x, 0)
+                next_x += delta_x
+                x += step_x
+            else:
+                time, normal = next_y, (0, -step_y)
+                next_y += delta_y
+                y += step_y
+        return None
+
+    def line_of_sight(self, x0, y0, x1, y1):
+        """Returns True if no blocked cell is on the ray from the pixel x0, y0
+        to x1, y1. The cell of the target does not hide the target."""
+        hit = self.raycast(x0, y0, x1, y1)
+        size = self.tile_size
+        return hit is None or hit[2] == (int(x1 // size), int(y1 // size))
+
+    def visible_from(self, x, y, targets):
+        """Batched line of sight from the pixel x, y to every target. The rays
+        to all targets are traced together with the same DDA as raycast, one
+        cell per step and vectorized over the rays, in a single window of the
+        grid.
+
+        Args:
+            x (float): Horizontal pixel of the origin.
+            y (float): Vertical pixel of the origin.
+            targets ([(x, y)]): The target pixels.
+
+        Returns:
+            A boolean array, True if the target is visible (see
+            line_of_sight).
+
+        """
+        targets = numpy.asarray(targets, dtype=float).reshape(-1, 2)
+        visible = numpy.ones(len(targets), dtype=bool)
+        if len(targets) == 0:
+            return visible
+        size = self.tile_size
+        dx, dy = targets[:, 0] - x, targets[:, 1] - y
+        start_x, start_y = int(x // size), int(y // size)
+        end_x = (targets[:, 0] // size).astype(int)
+        end_y = (targets[:, 1] // size).astype(int)
+        # Copy the window into the bounds of all rays, cells outside of the
+        # map stay free
+        left = min(start_x, int(end_x.min()))
+        top = min(start_y, int(end_y.min()))
+        right = max(start_x, int(end_x.max())) + 1
+        bottom = max(start_y, int(end_y.max())) + 1
+        blocked = numpy.zeros((right - left, bottom - top), dtype=bool)
+        window = self.window(left, top, right, bottom)
+        offset_x, offset_y = max(left, 0) - left, max(top, 0) - top
+        blocked[offset_x:offset_x + window.shape[0],
+                offset_y:offset_y + window.shape[1]] = window
+
+        step_x = numpy.where(dx > 0, 1, -1)
+        step_y = numpy.where(dy > 0, 1, -1)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            next_x = numpy.where(
+                dx != 0, ((start_x + (dx > 0)) * size - x) / dx, math.inf)
+            next_y = numpy.where(
+                dy != 0, ((start_y + (dy > 0)) * size - y) / dy, math.inf)
+            delta_x = numpy.where(dx != 0, size / numpy.abs(dx), math.inf)
+            delta_y = numpy.where(dy != 0, size / numpy.abs(dy), math.inf)
+        # The number of cells before the cell of the target
+        steps = numpy.abs(end_x - start_x) + numpy.abs(end_y - start_y)
+        cells_x = numpy.full(len(targets), start_x - left)
+        cells_y = numpy.full(len(targets), start_y - top)
+        for step in range(int(steps.max())):
+            active = visible & (steps > step)
+            if not active.any():
+                break
+            visible &= ~(active & blocked[cells_x, cells_y])
+            along_x = active & (next_x < next_y)
+            along_y = active & ~along_x
+            cells_x += numpy.where(along_x, step_x, 0)
+            cells_y += numpy.where(along_y, step_y, 0)
+            next_x = numpy.where(along_x, next_x + delta_x, next_x)
+            next_y = numpy.where(along_y, next_y + delta_y, next_y)
+        return visible
+
+
+class QTreeCollisionManager(CollisionManager):
 
     def fill(self, bounds, collidables):
-        """Add all collidable objects to a quad tree. O(n * log n)"""
-        self.qtree = QuadTree(bounds)
-        for entity, collidable in collidables.items():
-            self.qtree.insert(entity, collidable)
+        """Bulk load all collidable objects into a quad tree. O(n * log n)"""
+        self.qtree = QuadTree.bulk_load(bounds, collidables)
+
+    def insert(self, entity, rect):
+        self.qtree.insert(entity, rect)
+
+    def remove(self, entity):
+        return self.qtree.remove(entity)
+
+    def get_rect(self, entity):
+        return self.qtree.entites[entity].rect
 
     def move(self, entity):
         """Notifies the collision manager that an entits rect was moved. The
@@ -25,6 +441,140 @@ class QTreeCollisionManager:
             pass
         return collisions
 
+    def collide_pairs(self):
+        return sweep_and_prune((entity, item.rect) for entity, item
+                               in self.qtree.entites.items())
+
+
+class SpatialHashCollisionManager(CollisionManager):
+    """Sorts the objects into the cells of a uniform grid. Inserting and
+    moving an object only touches the cells it overlaps (O(1) for objects not
+    larger than a cell) and a query only checks the objects in the cells
+    overlapped by the query rect. The grid is unbounded, the bounds passed to
+    fill are ignored.
+
+    Works best if the cell size is about the size of the common objects, e.g.
+    the tiles of a map.
+
+    Args:
+        cell_size (int): The width and height of a cell in pixels.
+
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        # The objects in every non empty cell {(cell_x, cell_y): {key: Rect}}
+        self.cells = {}
+        # The rect and its covered cells of every object
+        # {key: (Rect, (cell_x0, cell_y0, cell_x1, cell_y1))}
+        self.objects = {}
+
+    def fill(self, bounds, collidables):
+        self.cells = {}
+        self.objects = {}
+        for entity, rect in collidables.items():
+            self.insert(entity, rect)
+
+    def insert(self, entity, rect):
+        cell_range = self._cell_range(rect)
+        self.objects[entity] = (rect, cell_range)
+        self._add(entity, rect, cell_range)
+
+    def remove(self, entity):
+        item = self.objects.pop(entity, None)
+        if item is None:
+            return False
+        self._discard(entity, item[1])
+        return True
+
+    def get_rect(self, entity):
+        return self.objects[entity][0]
+
+    def move(self, entity):
+        item = self.objects.get(entity)
+        if item is None:
+            return
+        rect, old_range = item
+        cell_range = self._cell_range(rect)
+        if cell_range != old_range:
+            self._discard(entity, old_range)
+            self._add(entity, rect, cell_range)
+            self.objects[entity] = (rect, cell_range)
+
+    def collide_rect(self, entity, rect):
+        collisions = []
+        cells = self.cells
+        x0, y0, x1, y1 = self._cell_range(rect)
+        if x0 == x1 and y0 == y1:
+            # Objects are unique within a single cell
+            cell = cells.get((x0, y0))
+            if cell is not None:
+                for key, other in cell.items():
+                    if key != entity and rect.colliderect(other):
+                        collisions.append(key)
+            return collisions
+        seen = set()
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                cell = cells.get((cell_x, cell_y))
+                if cell is None:
+                    continue
+                for key, other in cell.items():
+                    if key not in seen and key != entity and \
+                            rect.colliderect(other):
+                        seen.add(key)
+                        collisions.append(key)
+        return collisions
+
+    def collide_pairs(self):
+        """Get all pairs of overlapping objects by comparing the objects
+        within each cell. O(n + k) for k pairs of objects sharing a cell."""
+        pairs = []
+        # Objects covering several cells may meet in more than one of them
+        seen = set()
+        for cell in self.cells.values():
+            if len(cell) < 2:
+                continue
+            items = list(cell.items())
+            for index, (key, rect) in enumerate(items):
+                for other_key, other in items[index + 1:]:
+                    if rect.colliderect(other):
+                        pair = (key, other_key)
+                        if pair not in seen and (other_key, key) not in seen:
+                            seen.add(pair)
+                            pairs.append(pair)
+        return pairs
+
+    def count(self):
+        return len(self.objects)
+
+    def _cell_range(self, rect):
+        size = self.cell_size
+        return (rect.x // size, rect.y // size,
+                (rect.x + max(rect.w, 1) - 1) // size,
+                (rect.y + max(rect.h, 1) - 1) // size)
+
+    def _add(self, entity, rect, cell_range):
+        cells = self.cells
+        x0, y0, x1, y1 = cell_range
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                cell = cells.get((cell_x, cell_y))
+                if cell is None:
+                    cells[(cell_x, cell_y)] = {entity: rect}
+                else:
+                    cell[entity] = rect
+
+    def _discard(self, entity, cell_range):
+        cells = self.cells
+        x0, y0, x1, y1 = cell_range
+        for cell_x in range(x0, x1 + 1):
+            for cell_y in range(y0, y1 + 1):
+                cell = cells[(cell_x, cell_y)]
+                del cell[entity]
+                if not cell:
+                    del cells[(cell_x, cell_y)]
+
 
 class QuadTreeObject:
 
@@ -40,6 +590,26 @@ class QuadTree:
         self.q_tree_root = QuadTreeNode(
             None, 0, bounds, max_entites, max_level)
 
+    @classmethod
+    def bulk_load(cls, bounds, collidables, max_entites=2, max_level=8):
+        """Creates a quad tree containing the collidables {entity: Rect}.
+        The rects are partitioned top down in a single pass per level,
+        instead of splitting and redistributing nodes on every insert."""
+        qtree = cls(bounds, max_entites, max_level)
+        items = []
+        for entity, rect in collidables.items():
+            q_tree_object = QuadTreeObject(rect)
+            qtree.entites[entity] = q_tree_object
+            items.append((entity, q_tree_object))
+        # The rect columns x, y, right, bottom for the vectorized partitioning
+        rects = numpy.array([tuple(item.rect) for _, item in items],
+                            dtype=numpy.float64).reshape(-1, 4)
+        rects[:, 2] += rects[:, 0]
+        rects[:, 3] += rects[:, 1]
+        qtree.q_tree_root.load(items, rects,
+                               numpy.arange(len(items), dtype=numpy.intp))
+        return qtree
+
     def bounds(self):
         return self.q_tree_root.bounds
 
@@ -76,7 +646,7 @@ class QuadTree:
 
     def __str__(self):
         return 'QuadTree(bounds: %s, entities: %d, max_keys: %d, max_level: %d)' % (
-            self.bounds,
+            self.bounds(),
             self.count(),
             self.q_tree_root.max_entities,
             self.q_tree_root.max_level)
@@ -86,9 +656,11 @@ class QuadTreeNode:
     """Implements a static QuadTree for collision detection."""
 
     logger = logging.getLogger('collision.QuadTreeNode')
+    # Below this number of items the bulk load partitions without numpy
+    vectorize_threshold = 64
 
     def __init__(self, parent, level, bounds, max_entites=5, max_level=5):
-        self.parent = None
+        self.parent = parent
         self.level = level
         self.bounds = bounds
         self.max_entities = max_entites
@@ -98,6 +670,10 @@ class QuadTreeNode:
 
     def split(self):
         """Splits the node into 4 subnodes."""
+        self._create_nodes()
+        self._distribute()
+
+    def _create_nodes(self):
         sub_w = int(self.bounds.w / 2)
         sub_h = int(self.bounds.h / 2)
         x = self.bounds.x
@@ -128,7 +704,6 @@ class QuadTreeNode:
                 Rect(x + sub_w, y + sub_h, sub_w, sub_h),
                 self.max_entities,
                 self.max_level)]
-        self._distribute()
 
     def _get_index(self, rect):
         """Determine which node the object belongs to. -1 means object cannot
@@ -176,6 +751,68 @@ class QuadTreeNode:
             else:
                 self.logger.debug('Node overflow: %d', len(self.entites))
 
+    def load(self, items, rects, selection):
+        """Bulk inserts items into this empty node. If they exceed the
+        capacity and the node is above the maximum level, the node is split
+        and the items are partitioned into the subnodes like _get_index does,
+        but for all items at once. Items which fit into no subnode are kept
+        in this node, which results in the same tree as inserting the items
+        one by one.
+
+        Args:
+            items ([(entity, QuadTreeObject)]): All items of the tree.
+            rects (numpy.ndarray): The x, y, right, bottom of every item.
+            selection (numpy.ndarray): The indices of the items to insert.
+
+        """
+        if len(selection) < self.vectorize_threshold or \
+                len(selection) <= self.max_entities or \
+                self.level >= self.max_level:
+            self._load_items([items[index] for index in selection.tolist()])
+            return
+        self._create_nodes()
+        vertical_mid = self.bounds.x + (self.bounds.w / 2)
+        horizontal_mid = self.bounds.y + (self.bounds.h / 2)
+        selected = rects[selection]
+        top = selected[:, 3] < horizontal_mid
+        bottom = selected[:, 1] > horizontal_mid
+        left = selected[:, 2] < vertical_mid
+        right = selected[:, 0] > vertical_mid
+        for node, mask in zip(self.nodes, (right & top, left & top,
+                                           left & bottom, right & bottom)):
+            partition = selection[mask]
+            if len(partition):
+                node.load(items, rects, partition)
+        self._store(items, selection[~((left | right) & (top | bottom))])
+
+    def _store(self, items, selection):
+        for index in selection.tolist():
+            entity, item = items[index]
+            self.entites[entity] = item
+            item.owner = self
+
+    def _load_items(self, items):
+        """Bulk inserts the items [(entity, QuadTreeObject)] one by one."""
+        if len(items) <= self.max_entities or self.level >= self.max_level:
+            for entity, item in items:
+                self.entites[entity] = item
+                item.owner = self
+            if len(items) > self.max_entities:
+                self.logger.debug('Node overflow: %d', len(items))
+            return
+        self._create_nodes()
+        partitions = ([], [], [], [])
+        for entity, item in items:
+            index = self._get_index(item.rect)
+            if index == -1:
+                self.entites[entity] = item
+                item.owner = self
+            else:
+                partitions[index].append((entity, item))
+        for node, partition in zip(self.nodes, partitions):
+            if partition:
+                node._load_items(partition)
+
     def _distribute(self):
         """Checks of the entites in this node fits into a subnode and inserts
         it."""
@@ -194,6 +831,20 @@ class QuadTreeNode:
             index = self._get_index(rect)
             if index != -1:
                 self.nodes[index].retrieve(rect, result)
+            else:
+                # The rect overlaps several nodes, which can only contain
+                # objects on the same side of the middle as a part of the rect
+                vertical_mid = self.bounds.x + (self.bounds.w / 2)
+                horizontal_mid = self.bounds.y + (self.bounds.h / 2)
+                left = rect.x < vertical_mid
+                right = rect.x + rect.w > vertical_mid
+                top = rect.y < horizontal_mid
+                bottom = rect.y + rect.h > horizontal_mid
+                for node, overlaps in zip(self.nodes, (
+                        right and top, left and top, left and bottom,
+                        right and bottom)):
+                    if overlaps:
+                        node.retrieve(rect, result)
         for entity, item in self.entites.items():
             if rect.colliderect(item.rect):
                 result.append(entity)
@@ -203,10 +854,11 @@ class QuadTreeNode:
         if item.owner is not None:
             if item.owner == self:
                 del self.entites[entity]
+                item.owner = None
                 if clean:
                     self._clean_upwards()
             else:
-                item.owner.delete(entity, item)
+                item.owner.delete(entity, item, clean)
 
     def move(self, entity, item):
         """Calls _relacote on the items current node."""
@@ -215,24 +867,26 @@ class QuadTreeNode:
 
     def _relocate(self, entity, item):
         """Moves an item with the tree. If the item doesn't fit into this leaf
-        anymore, the call will be delegated to the parent."""
+        anymore, the call will be delegated to the parent. Items leaving the
+        bounds of the tree are kept in the root."""
         # do we fit into this node
-        if (self.bounds.contains(item.rect)):
+        if self.bounds.contains(item.rect) or self.parent is None:
             # do we fit into our childs
+            dest = self
             if self.nodes is not None:
                 index = self._get_index(item.rect)
                 if index != -1:
                     dest = self.nodes[index]
-                    if item.owner != dest:
-                        # remove from old node and add to our child
-                        former_owner = item.owner
-                        # delay cleanup since it could delete our destination
-                        self.delete(entity, item, False)
-                        dest.insert(entity, item)
-                        # delyed cleanup
-                        former_owner._clean_upwards()
-        elif self.parent is not None:
-            self.parent._relocate(item)
+            if item.owner != dest:
+                # remove from old node and add to the destination
+                former_owner = item.owner
+                # delay cleanup since it could delete our destination
+                self.delete(entity, item, False)
+                dest.insert(entity, item)
+                # delyed cleanup
+                former_owner._clean_upwards()
+        else:
+            self.parent._relocate(entity, item)
 
     def _clean_upwards(self):
         """Checks if the childs are empty and deletes them. If this Node is
@@ -243,8 +897,8 @@ class QuadTreeNode:
                 all_empty &= node.is_empty()
             if all_empty:
                 self.nodes = None
-        if self.parent is not None and self.is_empty:
-            self.parent._clean_upward()
+        if self.parent is not None and self.is_empty():
+            self.parent._clean_upwards()
 
     def height(self):
         """Calculate the height of the tree. The height is the maximum height of
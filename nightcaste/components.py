@@ -4,10 +4,38 @@ property of an entity. The entity itself is only a composition of its
 components."""
 from pygame.sprite import DirtySprite
 from pygame import Rect
+import inspect
+
+
+def slot_names(component_class):
+    """Returns the names of all slots of the class and its bases."""
+    names = []
+    for cls in reversed(component_class.__mro__):
+        for name in cls.__dict__.get('__slots__', ()):
+            if not name.startswith('_') and name not in names:
+                names.append(name)
+    return names
+
+
+def is_attribute(component_class, name):
+    """Returns True if the name is a slot of the class or its bases or a
+    settable property, like Position.x or the attributes of Rect. Methods and
+    class constants are no attributes."""
+    if name in slot_names(component_class):
+        return True
+    for cls in component_class.__mro__:
+        if name in cls.__dict__:
+            descriptor = cls.__dict__[name]
+            if isinstance(descriptor, property):
+                return descriptor.fset is not None
+            return inspect.isgetsetdescriptor(descriptor)
+    return False
 
 
 class Component:
-    """The base class of every component."""
+    """The base class of every component. Components declare their attributes
+    as __slots__, so they do not carry an instance dictionary."""
+    __slots__ = ()
 
     def type(self):
         """Returns the class name of the component."""
@@ -15,8 +43,8 @@ class Component:
 
     def __str__(self):
         result = self.type() + " ("
-        for prop, val in self.__dict__.items():
-            result += str(prop) + ": " + str(val) + ", "
+        for prop in slot_names(self.__class__):
+            result += prop + ": " + str(getattr(self, prop, None)) + ", "
         return result[:-2] + ")"
 
 
@@ -27,18 +55,35 @@ class Position(Component):
         x (int): Horizontal position.
         y (int): Vertical position.
     """
+    __slots__ = ('x_frac', 'y_frac')
+    # Layout used if the component is stored columnar (name, dtype). The
+    # pixel position x, y is derived from the fractional position, so bulk
+    # updates of the columns cannot leave it stale.
+    columns = (('x_frac', 'float64'), ('y_frac', 'float64'))
 
     def __init__(self, x=0, y=0):
-        self.x = x
-        self.y = y
         self.x_frac = x
         self.y_frac = y
 
+    @property
+    def x(self):
+        return int(self.x_frac)
+
+    @x.setter
+    def x(self, x):
+        self.x_frac = x
+
+    @property
+    def y(self):
+        return int(self.y_frac)
+
+    @y.setter
+    def y(self, y):
+        self.y_frac = y
+
     def move(self, dx, dy):
         self.x_frac += dx
         self.y_frac += dy
-        self.x = int(self.x_frac)
-        self.y = int(self.y_frac)
 
 
 class Movement(Component):
@@ -46,6 +91,8 @@ class Movement(Component):
     Args:
         speed (int): Movement Speed
     """
+    __slots__ = ('speed',)
+    columns = (('speed', 'float64'),)
 
     def __init__(self, speed=8):
         # TODO: Scale correctly to have m/s
@@ -53,6 +100,7 @@ class Movement(Component):
 
 
 class Direction():
+    __slots__ = ('direction',)
 
     D_UP = 1
     D_DOWN = 2
@@ -98,6 +146,7 @@ class Renderable(Component):
         visible (boolean): Specifies wether this entity should be ignored from
         the renderer
     """
+    __slots__ = ('name', 'z_index', 'visible')
 
     def __init__(self, name=None, z_index=0, visible=True):
         self.name = name
@@ -106,12 +155,17 @@ class Renderable(Component):
 
 
 class Sprite(Renderable, DirtySprite):
-    """Represents sprite in a 2D game.
+    """Represents sprite in a 2D game. The DirtySprite base keeps its instance
+    dictionary, so only the Renderable attributes are slots.
+
     Args:
         x_offset/y_offset (float): Additional offset position, where the
             sprite should be rendered (to make animations between tiles
             possible
     """
+    # The visible slot of Renderable would hide the property of DirtySprite,
+    # which marks the sprite dirty for LayeredDirty
+    visible = DirtySprite.visible
 
     def __init__(self, sprite_name=None, anchor=(0, 0),
                  z_index=0, visible=True):
@@ -166,6 +220,7 @@ class Turn(Component):
                            behaviour can act again
             delta: real time that has passed before the last action
                    used to test for min_turn_time"""
+    __slots__ = ('ticks', 'locking', 'min_turn_time', 'delta')
 
     def __init__(self, ticks=0, locking=False, min_turn_time=0):
         self.ticks = ticks
@@ -181,6 +236,7 @@ class Tile(Renderable):
                 Negative values mean a multiple of the tilesetSize
                 so -1 is good for walls etc.
     """
+    __slots__ = ('variant', 'offset')
 
     def __init__(self, name=None, z_index=0, visible=True, variant=False,
                  offset=0):
@@ -191,6 +247,7 @@ class Tile(Renderable):
 
 class Colliding(Component, Rect):
     """ Anything that can collide with each other """
+    __slots__ = ('blocking', 'offset')
 
     def __init__(self, blocking=True, offset=(0, 0)):
         self.blocking = blocking
@@ -210,6 +267,7 @@ class Color(Component):
         b (int): Blue fraction of the color.
 
     """
+    __slots__ = ('r', 'g', 'b')
 
     def __init__(self, r=0, g=0, b=0):
         self.r = r
@@ -219,42 +277,54 @@ class Color(Component):
 
 class Input(Component):
     """Entity which are receiving input."""
+    __slots__ = ('direction',)
 
     def __init__(self, direction=Direction()):
         self.direction = direction
 
 
 class Map(Component):
-    """A contains a 2 dimensional array referancing the tile entities. A map can
-    reference one parent and many childs for map navigation.
+    """A map contains a 2 dimensional grid of tile type ids. The shared
+    properties of the tiles are stored in the tile type table, only special
+    tiles (e.g. stairs) are entities. A map can reference one parent and many
+    childs for map navigation.
 
     Args:
         name (str): The name of the map.
         level (int): How deep in the map tree.
         parent (object): The parent entity.
-        tiles ([[object]]): 2-dimensional array with tile entities.
+        tiles (numpy.ndarray): 2-dimensional grid of tile ids, indexed by
+            [x, y].
+        tile_types (TileTypes): The table describing the tile ids.
+        entities ([object]): List with the special tile entities.
         children ([object]): List with child entities.
+        tilesetsize (int): The size of a tile in pixels.
 
     """
+    __slots__ = ('name', 'level', 'parent', 'tiles', 'tile_types', 'entities',
+                 'entry', 'children', 'tilesetsize')
 
     def __init__(self, name=None, level=0, parent=None, tiles=None,
-                 children=[], entry=None):
+                 tile_types=None, entities=None, children=[], entry=None,
+                 tilesetsize=32):
         self.name = name
         self.level = level
         self.parent = parent
         self.tiles = tiles
+        self.tile_types = tile_types
+        self.entities = entities if entities is not None else []
         self.entry = entry
         self.children = children
+        self.tilesetsize = tilesetsize
 
     def width(self):
-        return len(self.tiles) * self.tilesetsize
+        return self.tiles.shape[0] * self.tilesetsize
 
     def height(self):
-        return len(self.tiles[0]) * self.tilesetsize
+        return self.tiles.shape[1] * self.tilesetsize
 
-    def get_entites_in_frame(self, x, y, width, height):
-        return [map_column[y:y + height]
-                for map_column in self.tiles[x:x + width]]
+    def get_tiles_in_frame(self, x, y, width, height):
+        return self.tiles[x:x + width, y:y + height]
 
     def add_child(self, child):
         """Added a child to the list of know child maps.
@@ -273,6 +343,7 @@ class MapTransition(Component):
         target_map: The map the transition leads to
         target_level: The level numver the transition leads to
     """
+    __slots__ = ('target_map', 'target_level')
 
     def __init__(self, target_map=None, target_level=None):
         self.target_map = target_map
@@ -286,6 +357,7 @@ class Useable(Component):
     Args:
         useEvent (str): Identifier for the event that will be thrown on use
     """
+    __slots__ = ('useEvent',)
 
     def __init__(self, useEvent=None):
         self.useEvent = useEvent
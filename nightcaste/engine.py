@@ -17,6 +17,11 @@ import utils
 logger = logging.getLogger('engine')
 
 
+def sec_per_update(game_config):
+    """Get the simulated time of every update in seconds."""
+    return game_config.get('engine', {}).get('sec_per_update', 0.01)
+
+
 def main():
     logger.info('Nightcaste v%s', __version__)
 
@@ -24,8 +29,8 @@ def main():
 
     realtime = True
     pygame.init()
-    event_manager = EventManager()
-    entity_manager = EntityManager()
+    event_manager = EventManager(game_config.get('events'))
+    entity_manager = EntityManager(game_config.get('entities'))
     behaviour_manager = TurnBehaviourManager(
         event_manager,
         entity_manager,
@@ -43,8 +48,11 @@ def main():
     lag = 0.0
     # fps_time = 0.0
     # fps_frames = 0
-    SEC_PER_UPDATE = 0.01
+    # Swept collisions allow coarser fixed updates (see MovementSystem.apply)
+    SEC_PER_UPDATE = sec_per_update(game_config)
     MIN_FRAME_TIME = 1.0 / 60
+    # Drop updates which cannot be caught up instead of falling further behind
+    MAX_LAG = 0.25
 
     # TODO do not throw an event here, instead configure a default view and
     # throw ViewChnaged when the engine is initialized
@@ -53,20 +61,13 @@ def main():
         current_time = time.time()
         time_delta = current_time - prev_time
         prev_time = current_time
-        lag += time_delta
+        lag = min(lag + time_delta, MAX_LAG)
 
         while (lag >= SEC_PER_UPDATE):
-            request_close = input_controller.update(round, SEC_PER_UPDATE)
-            if game.status != game.G_PAUSED:
-                behaviour_manager.update(round, SEC_PER_UPDATE)
-                event_manager.process_events()
-
-            system_manager.update(round, SEC_PER_UPDATE)
-            event_manager.process_events()
-
-            process_manager.update(SEC_PER_UPDATE)
-            event_manager.process_events()
-
+            request_close = update(event_manager, input_controller,
+                                   behaviour_manager, system_manager,
+                                   process_manager, SEC_PER_UPDATE,
+                                   SEC_PER_UPDATE)
             lag -= SEC_PER_UPDATE
 
         window.render()
@@ -79,10 +80,42 @@ def main():
             print 'FPS: %d' % (fps_frames)
             fps_time, fps_frames = (0.0, 0)
         """
+    if event_manager.profiler is not None and \
+            event_manager.profiler.trace_file is not None:
+        event_manager.profiler.write_trace()
+    if event_manager.recorder is not None:
+        event_manager.stop_recording().close()
     pygame.quit()
     return 0
 
 
+def update(event_manager, input_controller, behaviour_manager,
+           system_manager, process_manager, delta_time, budget):
+    """Runs a single tick of the game logic.
+
+    Args:
+        delta_time (float): The simulated time of the tick in seconds.
+        budget (float): The real time in seconds for low priority events or
+            None to process all events.
+
+    Returns:
+        True if the user has requested to close the game.
+
+    """
+    event_manager.begin_tick(budget)
+    request_close = input_controller.update(round, delta_time)
+    if game.status != game.G_PAUSED:
+        behaviour_manager.update(round, delta_time)
+        event_manager.process_events()
+
+    system_manager.update(round, delta_time)
+    event_manager.process_events()
+
+    process_manager.update(delta_time)
+    event_manager.process_events()
+    return request_close
+
+
 def create_window(event_manager, entity_manager, system_manager):
     gui_config = utils.load_config('config/gui.json')
     mngr_config = gui_config['window_manager']
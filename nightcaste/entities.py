@@ -1,20 +1,45 @@
 """The model represents backing storage for entities."""
+from collections import deque
+from collections.abc import MutableMapping
+from operator import itemgetter
 import components
 import logging
+import numpy
 import os
 import utils
 
+# An entity identifier stores the index of the entity in the lower bits and the
+# generation of the index in the upper bits. Indices of destroyed entities are
+# reused with an increased generation.
+INDEX_BITS = 24
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+
+def entity_index(entity):
+    """Returns the index part of the entity identifier."""
+    return entity & INDEX_MASK
+
+
+def entity_generation(entity):
+    """Returns the generation part of the entity identifier."""
+    return entity >> INDEX_BITS
+
 
 class EntityManager:
     """The EntityManager is the interface for all systems to create and retrieve
     entites e.g their components"""
 
-    def __init__(self):
-        self.last_id = -1
+    def __init__(self, config=None):
+        # The current generation of every used index
+        self.generations = []
+        # Indices of destroyed entities, reused in FIFO order
+        self.free_indices = deque()
         self.component_manager = ComponentManager()
         self.blueprint_manager = BlueprintManager()
         self.current_map = None
         self.player = None
+        if config is not None:
+            self.configure(config)
 
         # TODO: Pass path from engine? Or pass someting similar like
         # EntityConfiguration but more general
@@ -26,15 +51,40 @@ class EntityManager:
                 'blueprints'))
         self.blueprint_manager.initialize(BP_DIR)
 
+    def configure(self, config):
+        """Configure the entity storage.
+
+        Args:
+            config (dict):
+                {
+                    'columnar': ['Position', 'Movement']
+                }
+        """
+        for component_type in config.get('columnar', []):
+            self.component_manager.store_columnar(component_type)
+
     def create_entity(self):
-        """Creates a new empty entity woth no components associated.
+        """Creates a new empty entity woth no components associated. The
+        index of a destroyed entity is reused if available.
 
             Returns:
                 The new entity identifier.
 
         """
-        self.last_id += 1
-        return self.last_id
+        if self.free_indices:
+            index = self.free_indices.popleft()
+        else:
+            index = len(self.generations)
+            self.generations.append(0)
+        return (self.generations[index] << INDEX_BITS) | index
+
+    def is_alive(self, entity):
+        """Checks if the entity identifier references an existing entity. The
+        identifiers of destroyed entities are stale, even if their index has
+        been reused."""
+        index = entity & INDEX_MASK
+        return (index < len(self.generations) and
+                self.generations[index] == entity >> INDEX_BITS)
 
     def new_from_config(self, configuration):
         """Constructs a new entity with the components and properties specified
@@ -62,9 +112,10 @@ class EntityManager:
                 The new entity identifier.
 
         """
-        configuration = self.blueprint_manager.get_entity_configuration(
-            blueprint)
-        return self.new_from_config(configuration)
+        entity = self.create_entity()
+        self.component_manager.add_component_list(
+            entity, self.blueprint_manager.get_factory(blueprint).create())
+        return entity
 
     def new_from_blueprint_and_config(self, blueprint, entity_config):
         """Constructs a new entity by creating a configuration from a blueprint
@@ -79,19 +130,26 @@ class EntityManager:
                 The new entity identifier.
 
         """
-        blueprint_config = self.blueprint_manager.get_entity_configuration(
-            blueprint)
-        blueprint_config.update(entity_config)
-        return self.new_from_config(blueprint_config)
+        factory = self.blueprint_manager.get_factory(blueprint)
+        entity = self.create_entity()
+        self.component_manager.add_component_list(
+            entity, factory.create(entity_config.components))
+        return entity
 
     def destroy_entity(self, entity):
-        """Removes all components which belong to the given entity.
+        """Removes all components which belong to the given entity and frees
+        its index for reuse.
 
             Args:
                 entity (object): The entity to destroy.
 
         """
+        if not self.is_alive(entity):
+            return
         self.component_manager.remove_components(entity)
+        index = entity & INDEX_MASK
+        self.generations[index] += 1
+        self.free_indices.append(index)
 
     def get(self, entity, component_type):
         """Searches the specified component type for the given entity.
@@ -112,7 +170,7 @@ class EntityManager:
 
         component = self.get(entity_id, component)
         if component is not None:
-            component.attribute = value
+            setattr(component, attribute, value)
 
     def get_all(self, component_type):
         """Get all components of the specified type.
@@ -126,6 +184,19 @@ class EntityManager:
         """
         return self.component_manager.get_all_of_type(component_type)
 
+    def query(self, *component_types):
+        """Get all entities which have all of the specified components.
+
+            Args:
+                component_types (str): The component types to join.
+
+            Returns:
+                A ComponentQuery which iterates over tuples in the form of
+                (entity, component1, component2, ...).
+
+        """
+        return self.component_manager.query(*component_types)
+
     def get_components_for_entities(self, entity_list, component_type):
         """Get the components of the specified type and for the specified entity
         list.
@@ -138,37 +209,44 @@ class EntityManager:
                 A dictionary in the form of {entity: component}.
 
         """
-        out = dict()
-        for entity in entity_list:
-            out[entity] = self.get(entity, component_type)
-        return out
+        component_dict = self.get_all(component_type)
+        return {entity: component_dict.get(entity) for entity in entity_list}
 
     def get_current_map(self):
-        """ Returns the tiles array of the current map """
+        """ Returns the tile id grid of the current map """
         return self.get(self.current_map, "Map").tiles
 
 
 class ComponentManager:
     """ The Component manager stores the components for all entities, which are
-    only represented through an internal entitiy identifier."""
+    only represented through an internal entitiy identifier.
+
+    Additionally every entity is filed into the archetype of its component
+    signature. Entities with the same set of components share one archetype
+    table, which allows to destroy entities and iterate signatures without
+    looking at unrelated component types."""
 
     def __init__(self):
         # Two-dimensional dictionary holding the components of all entities
         # {component_type: {entity_id: Component}}
         self.components = {}
+        # Archetype tables {frozenset(component_types): Archetype}
+        self.archetypes = {}
+        # The archetype of each entity {entity_id: Archetype}
+        self.entity_archetypes = {}
+        # Cached query results {(component_type, ...): ComponentQuery}
+        self.queries = {}
 
     def add_component(self, entity_id, component):
         """Adds the specified component for the given entity the the component
         database."""
-        component_type = component.type()
-        component_dict = self.components.get(component_type)
-        if (component_dict is None):
-            component_dict = {}
-            self.components[component_type] = component_dict
-        component_dict[entity_id] = component
+        self._store_component(entity_id, component)
+        self._file_entity(entity_id, self._signature(entity_id).union(
+            (component.type(),)))
 
     def add_components(self, entity_id, configuration):
         """Create and add components based on the given configuration."""
+        component_list = []
         for component_name, attributes in configuration.components.items():
             component = getattr(components, component_name)()
 
@@ -176,7 +254,26 @@ class ComponentManager:
             for attr_name, attr_value in attributes.items():
                 setattr(component, attr_name, attr_value)
 
-            self.add_component(entity_id, component)
+            component_list.append(component)
+        self.add_component_list(entity_id, component_list)
+
+    def add_component_list(self, entity_id, component_list):
+        """Adds all components for the given entity and moves the entity into
+        its new archetype only once."""
+        component_types = set()
+        for component in component_list:
+            self._store_component(entity_id, component)
+            component_types.add(component.type())
+        self._file_entity(
+            entity_id, self._signature(entity_id).union(component_types))
+
+    def _store_component(self, entity_id, component):
+        component_type = component.type()
+        component_dict = self.components.get(component_type)
+        if (component_dict is None):
+            component_dict = {}
+            self.components[component_type] = component_dict
+        component_dict[entity_id] = component
 
     def remove_component(self, entity_id, component_type):
         """Removes a specific entity component from the component database.
@@ -194,13 +291,21 @@ class ComponentManager:
         component_entities = self.components.get(component_type)
         if component_entities is None:
             return None
-        return component_entities.pop(entity_id, None)
+        component = component_entities.pop(entity_id, None)
+        if component is not None:
+            self._file_entity(entity_id, self._signature(entity_id).difference(
+                (component_type,)))
+        return component
 
     def remove_components(self, entity_id):
-        """Calls remove component with the specified entity_id for each known
-        component type"""
-        for component_type in self.components:
-            self.remove_component(entity_id, component_type)
+        """Removes all components of the entity. Only the component types of
+        the entity's archetype are touched."""
+        archetype = self.entity_archetypes.pop(entity_id, None)
+        if archetype is None:
+            return
+        del archetype.rows[entity_id]
+        for component_type in archetype.component_types:
+            self.components[component_type].pop(entity_id, None)
 
     def get_component(self, entity_id, component_type):
         """Get an entity component.
@@ -227,6 +332,271 @@ class ComponentManager:
             component_dict = {}
         return component_dict
 
+    def get_archetype(self, entity_id):
+        """Get the archetype table of the entity or None if the entity has no
+        components."""
+        return self.entity_archetypes.get(entity_id)
+
+    def store_columnar(self, component_type):
+        """Stores all components of the given type in ComponentColumns instead
+        of a dictionary. The component class has to define its columns.
+        Already added components are moved into the new storage."""
+        component_class = getattr(components, component_type)
+        columns = ComponentColumns(component_class)
+        for entity_id, component in self.get_all_of_type(
+                component_type).items():
+            columns[entity_id] = component
+        self.components[component_type] = columns
+        for signature, archetype in self.archetypes.items():
+            if component_type in signature:
+                for entity_id in list(archetype.rows):
+                    archetype.rows[entity_id] = archetype.create_row(
+                        entity_id, self.components)
+
+    def query(self, *component_types):
+        """Get the cached query for the given component types. A new query
+        will be created on first use and is kept up to date as archetypes are
+        created."""
+        query = self.queries.get(component_types)
+        if query is None:
+            query = ComponentQuery(self, component_types)
+            self.queries[component_types] = query
+            for archetype in self.archetypes.values():
+                query.match(archetype)
+        return query
+
+    def _signature(self, entity_id):
+        archetype = self.entity_archetypes.get(entity_id)
+        if archetype is None:
+            return frozenset()
+        return archetype.signature
+
+    def _file_entity(self, entity_id, signature):
+        """Moves the entity into the archetype of the given signature."""
+        archetype = self.entity_archetypes.get(entity_id)
+        if archetype is not None:
+            del archetype.rows[entity_id]
+        if len(signature) == 0:
+            self.entity_archetypes.pop(entity_id, None)
+            return
+        archetype = self.archetypes.get(signature)
+        if archetype is None:
+            archetype = Archetype(signature)
+            self.archetypes[signature] = archetype
+            for query in self.queries.values():
+                query.match(archetype)
+        archetype.rows[entity_id] = archetype.create_row(
+            entity_id, self.components)
+        self.entity_archetypes[entity_id] = archetype
+
+
+class Archetype:
+    """A table of all entities sharing the same set of component types. Each
+    row is a tuple of the entity and its components in the order of
+    component_types.
+
+    Args:
+        signature (frozenset): The component types of the archetype.
+
+    """
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.component_types = tuple(sorted(signature))
+        # {entity_id: (entity_id, component1, component2, ...)}
+        self.rows = {}
+
+    def create_row(self, entity_id, components):
+        return (entity_id,) + tuple(components[component_type][entity_id]
+                                    for component_type in self.component_types)
+
+    def row_getter(self, component_types):
+        """Creates a function which picks the entity and the given component
+        types (in this order) from a row."""
+        indices = [self.component_types.index(component_type) + 1
+                   for component_type in component_types]
+        return itemgetter(0, *indices)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __str__(self):
+        return 'Archetype(%s, entities: %d)' % (
+            ', '.join(self.component_types), len(self.rows))
+
+
+class ComponentQuery:
+    """The result of a query for all entities with a set of components. The
+    query references all archetypes containing the component types, so
+    iterating only costs as much as there are matching entities.
+
+    Args:
+        component_manager (ComponentManager): The manager owning the
+            archetypes.
+        component_types (tuple): The component types an entity must have.
+
+    """
+
+    def __init__(self, component_manager, component_types):
+        self.component_manager = component_manager
+        self.component_types = component_types
+        self.signature = frozenset(component_types)
+        # {Archetype: row_getter}
+        self.archetypes = {}
+
+    def match(self, archetype):
+        """Adds the archetype to the query if it contains all component
+        types."""
+        if self.signature <= archetype.signature:
+            self.archetypes[archetype] = archetype.row_getter(
+                self.component_types)
+
+    def __contains__(self, entity_id):
+        return self.component_manager.get_archetype(
+            entity_id) in self.archetypes
+
+    def __iter__(self):
+        # Iterate over a snapshot, so systems may add or remove components
+        return iter([row_getter(row)
+                     for archetype, row_getter in self.archetypes.items()
+                     for row in archetype.rows.values()])
+
+    def __len__(self):
+        return sum(len(archetype) for archetype in self.archetypes)
+
+
+class ComponentColumns(MutableMapping):
+    """Stores all components of one type in contiguous numpy arrays, one array
+    per attribute. The rows are densly packed, removing a component moves the
+    last row into the free slot.
+
+    The columns behave like the {entity_id: Component} dictionaries of the
+    ComponentManager. Reading a component returns a light proxy which reads and
+    writes its attributes directly from and to the arrays, so existing systems
+    keep working while bulk updates can operate on whole columns.
+
+    Args:
+        component_class (class): The component class, which must define its
+            layout as columns = ((attribute, dtype), ...).
+        capacity (int): The initial number of rows.
+
+    """
+
+    def __init__(self, component_class, capacity=64):
+        self.component_class = component_class
+        self.component_type = component_class.__name__
+        self.proxy_class = _create_column_proxy_class(component_class)
+        self.size = 0
+        self.slots = {}
+        self.entities = numpy.zeros(capacity, dtype=numpy.int64)
+        self.arrays = {name: numpy.zeros(capacity, dtype=dtype)
+                       for name, dtype in component_class.columns}
+
+    def column(self, name):
+        """Returns a view on the used rows of the specified attribute."""
+        return self.arrays[name][:self.size]
+
+    def entity_ids(self):
+        """Returns a view on the entities in the order of their rows."""
+        return self.entities[:self.size]
+
+    def pop(self, entity_id, default=None):
+        """Removes the component of the entity and returns a detached copy of
+        it or the default if the entity has no component."""
+        slot = self.slots.pop(entity_id, None)
+        if slot is None:
+            return default
+        component = self.component_class()
+        for name, array in self.arrays.items():
+            setattr(component, name, array.item(slot))
+        last = self.size - 1
+        if slot != last:
+            moved_entity = self.entities.item(last)
+            for array in self.arrays.values():
+                array[slot] = array[last]
+            self.entities[slot] = moved_entity
+            self.slots[moved_entity] = slot
+        self.size = last
+        return component
+
+    def _grow(self):
+        capacity = len(self.entities) * 2
+        self.entities = numpy.resize(self.entities, capacity)
+        for name, array in self.arrays.items():
+            self.arrays[name] = numpy.resize(array, capacity)
+
+    def __setitem__(self, entity_id, component):
+        slot = self.slots.get(entity_id)
+        if slot is None:
+            if self.size == len(self.entities):
+                self._grow()
+            slot = self.size
+            self.size += 1
+            self.slots[entity_id] = slot
+            self.entities[slot] = entity_id
+        for name, array in self.arrays.items():
+            array[slot] = getattr(component, name)
+
+    def __getitem__(self, entity_id):
+        if entity_id not in self.slots:
+            raise KeyError(entity_id)
+        return self.proxy_class(self, entity_id)
+
+    def __delitem__(self, entity_id):
+        if entity_id not in self.slots:
+            raise KeyError(entity_id)
+        self.pop(entity_id)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return self.size
+
+
+class ColumnProxy(object):
+    """Base class of the proxies returned by ComponentColumns. The attribute
+    properties and the slots are generated per component class."""
+    __slots__ = ()
+
+    def __init__(self, columns, entity_id):
+        self._columns = columns
+        self._entity = entity_id
+
+    def type(self):
+        return self._columns.component_type
+
+    def __str__(self):
+        result = self.type() + " ("
+        for name, dtype in self._columns.component_class.columns:
+            result += name + ": " + str(getattr(self, name)) + ", "
+        return result[:-2] + ")"
+
+
+def _create_column_proxy_class(component_class):
+    """Creates a proxy subclass of the component class, which redirects all
+    column attributes to the arrays of a ComponentColumns instance."""
+    attributes = {'__slots__': ('_columns', '_entity')}
+    for name, dtype in component_class.columns:
+        attributes[name] = _column_property(name)
+    return type(component_class.__name__ + 'Proxy',
+                (ColumnProxy, component_class), attributes)
+
+
+def _column_property(name):
+    def get_value(proxy):
+        columns = proxy._columns
+        return columns.arrays[name].item(columns.slots[proxy._entity])
+
+    def set_value(proxy, value):
+        columns = proxy._columns
+        columns.arrays[name][columns.slots[proxy._entity]] = value
+
+    return property(get_value, set_value)
+
 
 class BlueprintManager:
     """Stores blueprints which can be used as templates for entity creation. The
@@ -235,12 +605,17 @@ class BlueprintManager:
 
     def __init__(self):
         self.blue_prints = {}
+        self.factories = {}
 
     def get_entity_configuration(self, blueprint):
         """Get the entity configuration for the specified blueprint
         """
         return self.blue_prints.get(blueprint)
 
+    def get_factory(self, blueprint):
+        """Get the compiled BlueprintFactory for the specified blueprint."""
+        return self.factories[blueprint]
+
     def initialize(self, blueprint_base_path):
         """Loads all blueprints from the specified directory (not recursive).
         The blueprint name is constructed as file.json_object. For example a
@@ -269,6 +644,7 @@ class BlueprintManager:
             blue_print_name = basename + '.' + name
             entity_config = self._create_entity_config(blueprint)
             self.blue_prints.update({blue_print_name: entity_config})
+            self.factories[blue_print_name] = BlueprintFactory(entity_config)
 
     def _create_entity_config(self, blueprint):
         entity_config = EntityConfiguration()
@@ -276,8 +652,22 @@ class BlueprintManager:
             self.logger.debug('Adding blueprint component %s', component)
             entity_config.add_component(component)
         self._configure_entity_attributes(blueprint, entity_config)
+        self._validate_entity_config(entity_config)
         return entity_config
 
+    def _validate_entity_config(self, entity_config):
+        """Checks if every configured attribute is an attribute of its
+        component (see components.is_attribute). Since components are
+        slotted, unknown attributes would otherwise fail on entity creation
+        and names of methods or constants would silently replace them."""
+        for component, attributes in entity_config.components.items():
+            component_class = getattr(components, component)
+            for name in attributes:
+                if not components.is_attribute(component_class, name):
+                    raise AttributeError(
+                        'Blueprint component %s has no attribute %s' % (
+                            component, name))
+
     def _configure_entity_attributes(self, blueprint, entity_config):
         for attribute, value in blueprint['attributes'].items():
             component_attribute = attribute.split('.')
@@ -285,6 +675,54 @@ class BlueprintManager:
                 component_attribute[0], component_attribute[1], value)
 
 
+class BlueprintFactory:
+    """Creates the components of a blueprint. The component classes and the
+    attribute values of the blueprint are resolved once, so creating an
+    entity does not need to merge configurations.
+
+    Args:
+        entity_config (EntityConfiguration): The blueprint configuration.
+
+    """
+
+    def __init__(self, entity_config):
+        # ((component_name, component_class, ((attribute, value), ...)), ...)
+        self.components = tuple(
+            (name, getattr(components, name), tuple(attributes.items()))
+            for name, attributes in entity_config.components.items())
+        self.component_names = frozenset(entity_config.components)
+
+    def create(self, overrides=None):
+        """Creates new components with the blueprint values.
+
+            Args:
+                overrides (dict): Attribute values which replace the blueprint
+                    values in the form of {component: {attribute: value}}.
+                    Components which are not part of the blueprint are added.
+
+            Returns:
+                A list of the new components.
+
+        """
+        component_list = []
+        for name, component_class, attributes in self.components:
+            component = component_class()
+            for attribute, value in attributes:
+                setattr(component, attribute, value)
+            if overrides is not None and name in overrides:
+                for attribute, value in overrides[name].items():
+                    setattr(component, attribute, value)
+            component_list.append(component)
+        if overrides is not None:
+            for name, attributes in overrides.items():
+                if name not in self.component_names:
+                    component = getattr(components, name)()
+                    for attribute, value in attributes.items():
+                        setattr(component, attribute, value)
+                    component_list.append(component)
+        return component_list
+
+
 class EntityConfiguration:
     """Stores the necessary information the construct an entity
 
@@ -7,9 +7,14 @@
             - events with two target entitys (src and target)
 
 """
+from collections import deque
 from enum import Enum, auto
+from profiling import EventProfiler
+from recording import EventRecorder
 import logging
+from queue import Empty
 from queue import Queue
+from time import perf_counter
 
 
 class FrameworkEvent(Enum):
@@ -42,63 +47,316 @@ class GUIEvent(Enum):
 
 class InputEvent(Enum):
     KeyPressed = auto()
+    KeyReleased = auto()
+
+
+# Event priorities, higher priority events are processed first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL,
+              'low': PRIORITY_LOW}
+
+# All event types by name
+EVENT_GROUPS = dict((group.__name__, group) for group in (
+    FrameworkEvent, GameAction, GameEvent, GUIAction, GUIEvent, InputEvent))
 
 
 class EventManager:
-    """The central event manager which stores all events to be executed."""
+    """The central event manager which stores all events to be executed.
+
+    Events are recycled: after an event has been processed by all listeners
+    it is put back into a pool and reused by create.
+
+    The game loop is single-threaded, so the events are stored in a deque
+    without any locking. Producers running in other threads have to be
+    registered (or enabled through the config) and enqueue their events with
+    throw_threadsafe into a synchronized inbox, which is moved into the queue
+    by process_events.
+
+    High-frequency events can be coalesced: while an event is queued, later
+    events of the same type are combined with it according to a
+    CoalescingPolicy, so listeners only run once per entity and tick.
+
+    Every event type has a priority. Low priority events (e.g. cosmetic ones)
+    are only processed until the deadline of the current tick has passed and
+    are deferred to the next tick otherwise.
+
+    Listeners can be scoped to the subject entity of an event, either to a
+    single entity or to all entities matching a query (e.g. all entities with
+    a Sprite), so they are not called for events of other entities at all.
+    Scoped listeners are called after the unscoped listeners of a type.
+
+    The dispatch can be measured by an EventProfiler and all thrown events can
+    be logged by an EventRecorder for a later replay.
+
+    Args:
+        config (dict): (Optionally) {
+                'threadsafe': bool,
+                'coalesce': {'GameEvent.EntityMoved': 'keep_last', ...},
+                'priorities': {'InputEvent.KeyPressed': 'high', ...},
+                'profile': {'trace_file': str} (see EventProfiler),
+                'record': {'log_file': str} (see EventRecorder)
+            }
+
+    """
     logger = logging.getLogger('events.EventManager')
 
-    def __init__(self):
-        # Event queue, which is continuuously processed by process_events
-        self.events = Queue()
-        # self.queue = Queue.PriorityQueue()    If priority is needed
-        # self.deque = collections.deque()      Super fast unbounded queue
-        #                                       without locking
+    def __init__(self, config=None):
+        # Event queues of every priority, which are continuuously processed
+        # by process_events
+        self.queues = (deque(), deque(), deque())
+        # Priorities of the event types, default is PRIORITY_NORMAL
+        # {event_type: priority}
+        self.priorities = {}
+        # Low priority events are deferred to the next tick after this
+        # perf_counter time, see begin_tick
+        self.deadline = None
+        # The number of the current tick, 0 before the first tick
+        self.tick = 0
+        # The number of process_events calls in the current tick
+        self.process_calls = 0
+        # The number of low priority events processed by the process_events
+        # calls which deferred events in a recorded session
+        # {(tick, call): processed}. Replaces the deadline during a replay,
+        # so the events are deferred like in the recorded session.
+        self.deferrals = None
+        # Installed EventProfiler or None if profiling is disabled
+        self.profiler = None
+        # Installed EventRecorder or None if recording is disabled
+        self.recorder = None
+        # Synchronized queue for events of other threads, None as long as no
+        # producer is registered
+        self.inbox = None
 
         # Dictionary of processors listening for events of different types
         # {'event_type': EventProcessor}
         self.listeners = {}
+        # Listeners for the events of a single entity
+        # {event_type: {entity: [process_function]}}
+        self.entity_listeners = {}
+        # Listeners for the events of entities matching a query
+        # {event_type: [(query, process_function)]}
+        self.query_listeners = {}
+        # Processed events for reuse {event_class: [Event]}. Listeners must
+        # not keep references to events after processing them.
+        self.pools = dict((cls, []) for cls in
+                          set(EVENT_CLASSES.values()).union((Event,)))
+        self.pool_size = 256
+        # Cache of the event class of each type {event_type: event_class}
+        self.event_classes = {}
+        # Coalescing policies {event_type: CoalescingPolicy}
+        self.policies = {}
+        # Queued events which can absorb new events {coalescing_key: Event}
+        self.coalesced = {}
+        if config is not None:
+            self.configure(config)
+
+    def configure(self, config):
+        if config.get('threadsafe', False):
+            self.register_producer()
+        for name, policy in config.get('coalesce', {}).items():
+            self.set_coalescing(event_type_for_name(name),
+                                COALESCING_POLICIES[policy]())
+        for name, priority in config.get('priorities', {}).items():
+            self.set_priority(event_type_for_name(name), PRIORITIES[priority])
+        if 'profile' in config:
+            self.enable_profiling(EventProfiler(**config['profile']))
+        if 'record' in config:
+            self.start_recording(EventRecorder(**config['record']))
+
+    def enable_profiling(self, profiler=None):
+        """Measures the event dispatch with the given or a new EventProfiler
+        and returns the profiler."""
+        self.disable_profiling()
+        if profiler is None:
+            profiler = EventProfiler()
+        profiler.install(self)
+        self.profiler = profiler
+        return profiler
+
+    def disable_profiling(self):
+        """Removes the profiler and returns it."""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.uninstall(self)
+            self.profiler = None
+        return profiler
+
+    def start_recording(self, recorder):
+        """Logs all events thrown from now on with the EventRecorder."""
+        self.stop_recording()
+        recorder.install(self)
+        self.recorder = recorder
+        return recorder
+
+    def stop_recording(self):
+        """Removes the recorder and returns it. The recorder is not
+        closed."""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.uninstall(self)
+            self.recorder = None
+        return recorder
+
+    def set_priority(self, event_type, priority):
+        """Sets the priority (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW) of
+        the event type."""
+        self.priorities[event_type] = priority
+
+    def begin_tick(self, budget):
+        """Starts a new tick, in which low priority events are only processed
+        for the given time budget in seconds. The remaining low priority
+        events are deferred to the next tick. Without budget no events are
+        deferred."""
+        self.tick += 1
+        self.process_calls = 0
+        self.deadline = None if budget is None else perf_counter() + budget
+        if self.profiler is not None:
+            self.profiler.on_tick(self.pending())
+
+    def set_coalescing(self, event_type, policy):
+        """Coalesce events of the given type according to the policy, while
+        they are waiting in the queue. None disables coalescing."""
+        if policy is None:
+            self.policies.pop(event_type, None)
+        else:
+            self.policies[event_type] = policy
 
-    def register_listener(self, event_type, process_function):
+    def register_producer(self):
+        """Enables the synchronized inbox for producers running in other
+        threads. Must be called before the producer starts throwing events
+        with throw_threadsafe."""
+        if self.inbox is None:
+            self.inbox = Queue()
+
+    def register_listener(self, event_type, process_function, entity=None,
+                          query=None):
         """Register a processor to delegate the processing of a certain event
-        type."""
+        type.
+
+        Args:
+            event_type (Enum): The type of the events.
+            process_function (function): Called with every event.
+            entity (int): (Optionally) Only events with this subject entity
+                are processed.
+            query (ComponentQuery): (Optionally) Only events with a subject
+                entity contained in the query are processed.
+
+        """
         self.logger.debug(
             'Register processor function %s for event type %s',
             process_function,
             event_type)
-        if event_type in self.listeners:
+        if entity is not None:
+            self.entity_listeners.setdefault(event_type, {}).setdefault(
+                entity, []).append(process_function)
+        elif query is not None:
+            self.query_listeners.setdefault(event_type, []).append(
+                (query, process_function))
+        elif event_type in self.listeners:
             self.listeners[event_type].append(process_function)
         else:
             self.listeners.update({event_type: [process_function]})
 
-    def remove_listener(self, event_type, process_function):
-        """Unregisters the processor for events of the specified type."""
+    def remove_listener(self, event_type, process_function, entity=None,
+                        query=None):
+        """Unregisters the processor for events of the specified type. Scoped
+        listeners have to be removed with the same scope."""
         self.logger.debug(
             'Unregister processor function %s for event type %s',
             process_function,
             event_type)
-        if event_type in self.listeners:
-            try:
-                self.listeners[event_type].remove(process_function)
-            except ValueError:
-                self.logger.debug(
-                    '%s is already unregistered from %s!',
-                    process_function,
-                    event_type)
+        if entity is not None:
+            listeners = self.entity_listeners.get(event_type, {})
+            self._remove(listeners.get(entity, []), process_function,
+                         event_type)
+            if not listeners.get(entity, True):
+                del listeners[entity]
+        elif query is not None:
+            self._remove(self.query_listeners.get(event_type, []),
+                         (query, process_function), event_type)
+        elif event_type in self.listeners:
+            self._remove(self.listeners[event_type], process_function,
+                         event_type)
+
+    def _remove(self, listeners, listener, event_type):
+        try:
+            listeners.remove(listener)
+        except ValueError:
+            self.logger.debug(
+                '%s is already unregistered from %s!',
+                listener,
+                event_type)
 
     def create(self, event_type, data=None):
-        return Event(event_type, data)
+        """Creates a new event of the given type. Events of the game types are
+        taken from a pool of already processed events if possible."""
+        cls = self.event_classes.get(event_type)
+        if cls is None:
+            cls = self.event_classes[event_type] = event_class(event_type)
+        pool = self.pools.get(cls)
+        if not pool:
+            return cls(event_type, data)
+        try:
+            event = pool.pop()
+        except IndexError:
+            # Emptied by another thread
+            return cls(event_type, data)
+        event.identifier = event_type
+        if data is not None:
+            for prop, val in data.items():
+                setattr(event, prop, val)
+        return event
+
+    def release(self, event):
+        """Returns a processed event to its pool."""
+        pool = self.pools.get(type(event))
+        if pool is not None and len(pool) < self.pool_size:
+            event.clear()
+            pool.append(event)
 
     def throw_new(self, event_type, data=None):
         """ Enqueues an event from an identifier String"""
         self.throw(self.create(event_type, data))
 
     def throw(self, event):
-        """Enqueues an existing event."""
-        self.events.put(event)
+        """Enqueues an existing event. Must only be called from the game loop
+        thread. If the type of the event is coalesced and an equivalent event
+        is already queued, the event is combined with the queued one."""
+        if self.policies and event.identifier in self.policies and \
+                self._coalesce(self.policies[event.identifier], event):
+            return
+        self.queues[self.priorities.get(event.identifier, PRIORITY_NORMAL)]\
+            .append(event)
+
+    def _coalesce(self, policy, event):
+        key = policy.key(event)
+        queued = self.coalesced.get(key)
+        if queued is None:
+            self.coalesced[key] = event
+            return False
+        policy.combine(queued, event)
+        self.release(event)
+        return True
+
+    def throw_threadsafe(self, event):
+        """Enqueues an existing event from another thread. The producer has to
+        be registered with register_producer."""
+        self.inbox.put(event)
+
+    def pending(self):
+        """Returns the number of events waiting to be processed."""
+        pending = sum(len(queue) for queue in self.queues)
+        if self.inbox is not None:
+            pending += self.inbox.qsize()
+        return pending
 
     def process_events(self):
-        """Process all events in the queue.
+        """Process all events in the queue. Events are processed in order of
+        their priority, so high priority events thrown by listeners are
+        processed before queued events with lower priority. Low priority
+        events are left in the queue if the deadline of the tick has passed.
 
             Args:
                 round (long): The current round in the game.
@@ -107,12 +365,54 @@ class EventManager:
                 The number of process events in this round.
 
         """
+        if self.inbox is not None:
+            self._drain_inbox()
+        high, normal, low = self.queues
+        deadline = self.deadline
+        self.process_calls += 1
+        low_limit = None
+        if self.deferrals is not None:
+            deadline = None
+            low_limit = self.deferrals.get((self.tick, self.process_calls))
+        processed_low = 0
         processed_events = 0
-        while not self.events.empty():
-            self.process_event(self.events.get_nowait(), round)
+        release = self.release
+        policies = self.policies
+        coalesced = self.coalesced
+        while True:
+            if high:
+                event = high.popleft()
+            elif normal:
+                event = normal.popleft()
+            elif low and (deadline is None or perf_counter() < deadline) \
+                    and (low_limit is None or processed_low < low_limit):
+                event = low.popleft()
+                processed_low += 1
+            else:
+                break
+            if coalesced and event.identifier in policies:
+                # Later events must not be combined with a processed one
+                key = policies[event.identifier].key(event)
+                if coalesced.get(key) is event:
+                    del coalesced[key]
+            self.process_event(event, round)
+            release(event)
             processed_events += 1
+        if low:
+            self.logger.debug('Deferred %d low priority events', len(low))
+            if self.recorder is not None:
+                self.recorder.record_deferral(self.tick, self.process_calls,
+                                              processed_low)
         return processed_events
 
+    def _drain_inbox(self):
+        """Moves the events of other threads into the queue."""
+        try:
+            while True:
+                self.throw(self.inbox.get_nowait())
+        except Empty:
+            pass
+
     def process_event(self, event, round):
         """Process a single event by delegating it to all registered processors.
 
@@ -122,23 +422,194 @@ class EventManager:
 
         """
         self.logger.debug('Process event %s', event)
-        if event.identifier in self.listeners:
-            for process_function in self.listeners[event.identifier]:
-                process_function(event)
+        for process_function in self.listeners_of(event):
+            process_function(event)
+
+    def listeners_of(self, event):
+        """Get the functions processing the event: all unscoped listeners of
+        its type and the listeners scoped to its subject entity."""
+        identifier = event.identifier
+        listeners = self.listeners.get(identifier, ())
+        entity_listeners = self.entity_listeners.get(identifier)
+        query_listeners = self.query_listeners.get(identifier)
+        if not entity_listeners and not query_listeners:
+            return listeners
+        entity = event.subject()
+        if entity is None:
+            return listeners
+        listeners = list(listeners)
+        if entity_listeners:
+            listeners.extend(entity_listeners.get(entity, ()))
+        if query_listeners:
+            listeners.extend(process_function
+                             for query, process_function in query_listeners
+                             if entity in query)
+        return listeners
 
 
-class Event:
+class Event(object):
     """Base class for all events. An Event contains the necessary information
-    for a System to react accordingly."""
+    for a System to react accordingly. Subclasses declare their payload as
+    __slots__, so events of the game types have a fixed set of attributes,
+    which are None if not set."""
+    __slots__ = ('identifier',)
+    payload = ()
+    # The payload attribute containing the entity the event is about
+    subject_attribute = None
 
     def __init__(self, identifier, data=None):
         self.identifier = identifier
+        self.clear()
         if data is not None:
             for prop, val in data.items():
                 setattr(self, prop, val)
 
+    def clear(self):
+        """Resets all payload attributes to None."""
+        for prop in self.payload:
+            setattr(self, prop, None)
+
     def get(self, attr, default=None):
-        return vars(self).get(attr, default)
+        value = getattr(self, attr, None)
+        return default if value is None else value
+
+    def subject(self):
+        """Get the entity the event is about or None."""
+        if self.subject_attribute is None:
+            return None
+        return getattr(self, self.subject_attribute, None)
 
     def __str__(self):
         return 'Event(%s)' % self.identifier
+
+
+class GenericEvent(Event):
+    """Event of a type without payload class, which accepts any attribute."""
+    subject_attribute = 'entity'
+
+    def clear(self):
+        self.__dict__.clear()
+
+
+class EntityEvent(Event):
+    __slots__ = payload = ('entity',)
+    subject_attribute = 'entity'
+
+
+class KeyPressedEvent(Event):
+    __slots__ = payload = ('keycode',)
+
+
+class KeyReleasedEvent(KeyPressedEvent):
+    __slots__ = ()
+
+
+class MapChangeEvent(Event):
+    __slots__ = payload = ('name', 'level', 'type')
+
+
+class MoveEvent(Event):
+    __slots__ = payload = ('entity', 'dx', 'dy', 'absolute')
+    subject_attribute = 'entity'
+
+
+class UseEntityEvent(Event):
+    __slots__ = payload = ('user',)
+    subject_attribute = 'user'
+
+
+class UsedEntityEvent(Event):
+    """Thrown as the useEvent of a Useable entity."""
+    __slots__ = payload = ('usedEntity',)
+    subject_attribute = 'usedEntity'
+
+
+class ViewChangedEvent(Event):
+    __slots__ = payload = ('active_view',)
+
+
+class CoalescingPolicy(object):
+    """Decides which queued events of the same type are combined. Events with
+    the same key are combined into the first queued event."""
+
+    def key(self, event):
+        return event.identifier
+
+    def combine(self, queued, event):
+        """Combines the new event into the queued event."""
+        pass
+
+
+class DropDuplicates(CoalescingPolicy):
+    """Drops events with the same payload as a queued event."""
+
+    def key(self, event):
+        return (event.identifier,) + tuple(
+            getattr(event, prop) for prop in event.payload)
+
+
+class KeepLastPerEntity(CoalescingPolicy):
+    """Keeps one queued event per entity with the payload of the last
+    event."""
+
+    def key(self, event):
+        return (event.identifier, event.entity)
+
+    def combine(self, queued, event):
+        for prop in event.payload:
+            setattr(queued, prop, getattr(event, prop))
+
+
+class MergePerEntity(KeepLastPerEntity):
+    """Keeps one queued event per entity. The given fields are summed up
+    (e.g. relative movement), all other attributes are taken from the last
+    event."""
+
+    def __init__(self, fields=('dx', 'dy')):
+        self.fields = fields
+
+    def combine(self, queued, event):
+        for prop in event.payload:
+            value = getattr(event, prop)
+            if prop in self.fields and getattr(queued, prop) is not None:
+                value += getattr(queued, prop)
+            setattr(queued, prop, value)
+
+
+# The policies which can be used in the configuration
+COALESCING_POLICIES = {
+    'drop_duplicates': DropDuplicates,
+    'keep_last': KeepLastPerEntity,
+    'merge': MergePerEntity,
+}
+
+
+def event_type_for_name(name):
+    """Get the event type for a name like 'GameEvent.EntityMoved'."""
+    group, member = name.split('.')
+    return getattr(EVENT_GROUPS[group], member)
+
+
+# The event class of every event type with payload. Other game events have no
+# payload, events of unknown types are GenericEvents.
+EVENT_CLASSES = {
+    FrameworkEvent.EntityCreated: EntityEvent,
+    FrameworkEvent.EntityDestroyed: EntityEvent,
+    FrameworkEvent.EntityInitialized: EntityEvent,
+    GameAction.MapChange: MapChangeEvent,
+    GameAction.MapTransition: UsedEntityEvent,
+    GameAction.MoveAction: MoveEvent,
+    GameAction.UseEntityAction: UseEntityEvent,
+    GameEvent.EntityMoved: EntityEvent,
+    GUIEvent.ViewChanged: ViewChangedEvent,
+    InputEvent.KeyPressed: KeyPressedEvent,
+    InputEvent.KeyReleased: KeyReleasedEvent,
+}
+
+
+def event_class(event_type):
+    """Get the class of events of the given type."""
+    event_class = EVENT_CLASSES.get(event_type)
+    if event_class is None:
+        event_class = Event if isinstance(event_type, Enum) else GenericEvent
+    return event_class
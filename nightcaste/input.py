@@ -22,9 +22,13 @@ K_KP7 = pygame.K_KP7
 K_KP8 = pygame.K_KP8
 K_KP9 = pygame.K_KP9
 
+# The keys which are currently held down, tracked by the InputController from
+# the key events, so a replayed session sees the same keys as the original
+pressed_keys = set()
+
 
 def is_pressed(code):
-    return pygame.key.get_pressed()[code]
+    return code in pressed_keys
 
 
 class InputController:
@@ -59,9 +63,23 @@ class InputController:
             elif event.type == pygame.KEYDOWN:
                 if event.key == K_ESCAPE:
                     self.request_close = True
-                key_pressed = self.event_manager.create(InputEvent.KeyPressed)
-                key_pressed.keycode = event.key
-                self.event_manager.throw(key_pressed)
+                self.press(event.key)
+            elif event.type == pygame.KEYUP:
+                self.release(event.key)
+
+    def press(self, keycode):
+        """Marks the key as pressed and throws a KeyPressed event."""
+        pressed_keys.add(keycode)
+        key_pressed = self.event_manager.create(InputEvent.KeyPressed)
+        key_pressed.keycode = keycode
+        self.event_manager.throw(key_pressed)
+
+    def release(self, keycode):
+        """Marks the key as released and throws a KeyReleased event."""
+        pressed_keys.discard(keycode)
+        key_released = self.event_manager.create(InputEvent.KeyReleased)
+        key_released.keycode = keycode
+        self.event_manager.throw(key_released)
 
     def wait_for_input(self, flush):
         """This function waits for the user to press a key. It returns the code
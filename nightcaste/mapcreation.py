@@ -1,64 +1,359 @@
 """ Map generation tool for creating random maps, based on BSP-Trees """
 
+from concurrent.futures import ProcessPoolExecutor
 from entities import EntityConfiguration
+from functools import partial
+from tiles import ChunkedTiles
+from tiles import TileTypes
+from tiles import TILE_DTYPE
+import hashlib
+import json
 import random
 import math
 import logging
+import os
+import numpy
 import tcod as libtcod
 
 
 class MapManager():
     """ The Map Manager stores and administrates all maps
-    It holds generators for different types of maps """
+    It holds generators for different types of maps.
 
-    def __init__(self, entity_manager):
+    Every map is generated from a seed derived from its name, level and the
+    world seed, so a world seed always results in the same maps. Generated
+    layouts can be stored in a MapCache, which replaces the generation with
+    loading the layout from disk.
+
+    Optionally the maps adjacent to the current map are generated in
+    background worker processes, so changing the map does not stall the game
+    loop. The workers only create the MapLayout, the entities are created when
+    the map is requested.
+
+    Args:
+        entity_manager (EntityManager): Creates the map entities.
+        config (dict): (Optionally) {
+                'pregenerate': bool,
+                'workers': int,
+                'world_seed': int (random if not set, the seed stored in the
+                    cache directory if a cache is configured),
+                'cache_dir': str (no cache if not set),
+                'world': {'size': [w, h], 'chunk_size': int,
+                          'resident_chunks': int}
+            }
+
+    """
+    logger = logging.getLogger('mapcreation.MapManager')
+
+    def __init__(self, entity_manager, config=None):
         self.entity_manager = entity_manager
+        # {map_name: {level: map_entity}}
         self.maps = {}
-        self.generators = {'dungeon': DungeonGenerator(self.entity_manager),
-                           'world': WorldspaceGenerator(self.entity_manager)}
+        # The generator type of every known map {map_name: type}
+        self.map_types = {}
+        # Layouts generated in the background {(map_name, level): Future}
+        self.pending = {}
+        self.pregenerate = False
+        self.workers = 1
+        self.executor = None
+        self.world_seed = random.getrandbits(32)
+        self.cache = None
+        self.tile_types = TileTypes(entity_manager.blueprint_manager)
+        self.generators = dict(
+            (type, generator_class(self.entity_manager, self.tile_types))
+            for type, generator_class in GENERATORS.items())
+        if config is not None:
+            self.configure(config)
+
+    def configure(self, config):
+        self.pregenerate = config.get('pregenerate', self.pregenerate)
+        self.workers = config.get('workers', self.workers)
+        if config.get('world_seed') is not None:
+            self.world_seed = config['world_seed']
+        if config.get('cache_dir') is not None:
+            self.cache = MapCache(config['cache_dir'])
+            # The cached maps are only found again with their world seed
+            if config.get('world_seed') is None:
+                self.world_seed = self.cache.world_seed(self.world_seed)
+        for type, generator in self.generators.items():
+            generator.configure(config.get(type, {}))
+
+    def map_seed(self, name, level):
+        """Derives the seed of a map from its name, level and the world
+        seed."""
+        key = '%s:%s:%s' % (name, level, self.world_seed)
+        return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16)
 
     def get_map(self, name=None, level=0, type="dungeon"):
         if name is None:
             name = self.random_name()
         collection = self.get_mapcollection(name)
-        if (len(collection) > level):
-            return collection[level]
-        else:
-            return self.generators[type].generate_map(name, level)
+        map_entity = collection.get(level)
+        if map_entity is None:
+            type = self.map_types.setdefault(name, type)
+            seed = self.map_seed(name, level)
+            future = self.pending.pop((name, level), None)
+            layout = None
+            if future is not None:
+                layout = future.result()
+            elif self.cache is not None:
+                layout = self.cache.load(seed)
+            if layout is None:
+                layout = self.generators[type].generate_layout(
+                    name, level, seed)
+            # Streamed maps are recreated from their seed chunk by chunk
+            if self.cache is not None and seed not in self.cache and \
+                    isinstance(layout.tiles, numpy.ndarray):
+                self.cache.save(seed, layout, layout.tile_keys or
+                                self.tile_types.keys())
+            map_entity = self.generators[type].materialize(layout)
+            collection[level] = map_entity
+        return map_entity
 
     def get_mapcollection(self, name):
         if self.maps.get(name, None) is None:
-            self.maps[name] = []
+            self.maps[name] = {}
         return self.maps[name]
 
     def random_name(self):
         # TODO: Implement random dungeon name generation
         return "Random Dungeon"
 
+    def pregenerate_adjacent(self, map_entity):
+        """Starts the background generation of the maps which can be reached
+        from the given map: the next level of a dungeon and the targets of
+        all map transitions. Does nothing if pregeneration is disabled."""
+        if not self.pregenerate:
+            return
+        map_component = self.entity_manager.get(map_entity, 'Map')
+        if self.map_types.get(map_component.name) == 'dungeon':
+            self.submit(map_component.name, map_component.level + 1)
+        for entity in map_component.entities:
+            transition = self.entity_manager.get(entity, 'MapTransition')
+            if transition is not None:
+                self.submit(transition.target_map,
+                            transition.target_level or 0)
+
+    def submit(self, name=None, level=0, type="dungeon"):
+        """Generates the layout of the specified map in a worker process,
+        unless the map exists, is cached or is already being generated."""
+        if name is None:
+            name = self.random_name()
+        seed = self.map_seed(name, level)
+        if level in self.get_mapcollection(name) or \
+                (name, level) in self.pending or \
+                (self.cache is not None and seed in self.cache):
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                self.workers, initializer=init_worker,
+                initargs=(self.entity_manager.blueprint_manager,))
+        type = self.map_types.setdefault(name, type)
+        self.logger.debug('Pregenerating map %s - %d', name, level)
+        self.pending[(name, level)] = self.executor.submit(
+            generate_layout, type, name, level, seed)
+
+    def shutdown(self):
+        """Stops the worker processes and drops pending layouts."""
+        if self.executor is not None:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.executor.shutdown()
+            self.executor = None
+
+
+class MapCache():
+    """Stores generated map layouts on disk, keyed by the seed of the map.
+    Every layout is a compressed numpy archive of the tile grid and the other
+    properties as json. The tile ids are stored together with their keys, so
+    they can be translated to the tile types of a later session.
+
+    Args:
+        path (str): The cache directory, created on demand.
+
+    """
+    logger = logging.getLogger('mapcreation.MapCache')
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_name(self, seed):
+        return os.path.join(self.path, '%08x.npz' % seed)
+
+    def world_seed(self, default):
+        """Get the world seed stored in the cache directory. The default is
+        stored if there is none yet, so later sessions derive the same map
+        seeds and load their maps from the cache."""
+        file_name = os.path.join(self.path, 'world.json')
+        try:
+            with open(file_name) as f:
+                return json.load(f)['world_seed']
+        except (IOError, ValueError, KeyError):
+            pass
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(file_name, 'w') as f:
+            json.dump({'world_seed': default}, f)
+        return default
+
+    def load(self, seed):
+        """Loads the layout of the seed or returns None if it is not
+        cached."""
+        if seed not in self:
+            return None
+        try:
+            with numpy.load(self.file_name(seed)) as archive:
+                tiles = archive['tiles']
+                properties = json.loads(str(archive['properties']))
+        except (IOError, ValueError, KeyError):
+            self.logger.warning('Could not load cached map %08x', seed)
+            return None
+        return MapLayout(properties['name'], properties['level'], tiles,
+                         tuple(properties['entry']),
+                         [tuple(stairs) for stairs in properties['stairs']],
+                         [tuple(key) for key in properties['tile_keys']],
+                         seed)
+
+    def save(self, seed, layout, tile_keys):
+        """Stores the layout of the seed.
+
+        Args:
+            seed (int): The seed of the map.
+            layout (MapLayout): The layout to store.
+            tile_keys ([(str, int)]): The keys of the tile ids of the layout.
+
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        properties = {'name': layout.name,
+                      'level': layout.level,
+                      'entry': [int(value) for value in layout.entry],
+                      'stairs': layout.stairs,
+                      'tile_keys': tile_keys}
+        numpy.savez_compressed(self.file_name(seed), tiles=layout.tiles,
+                               properties=numpy.array(json.dumps(properties)))
+        self.logger.debug('Cached map %s - %d as %08x', layout.name,
+                          layout.level, seed)
+
+    def __contains__(self, seed):
+        return os.path.isfile(self.file_name(seed))
+
+
+# The generators of a worker process, created by init_worker
+worker_generators = {}
+
+
+def init_worker(blueprint_manager):
+    """Initializes a map generation worker process."""
+    tile_types = TileTypes(blueprint_manager)
+    for type, generator_class in GENERATORS.items():
+        worker_generators[type] = generator_class(None, tile_types)
+
+
+def generate_layout(type, map_name, level, seed):
+    """Generates a map layout in a worker process. The tile ids are only valid
+    for the tile types of the worker, so the layout carries the tile keys to
+    translate them."""
+    generator = worker_generators[type]
+    layout = generator.generate_layout(map_name, level, seed)
+    layout.tile_keys = generator.tile_types.keys()
+    return layout
+
 
 class MapGenerator():
-    """Generates maps and returns the id of the generated map """
+    """Generates maps and returns the id of the generated map. The tiles of a
+    map are stored as a grid of tile type ids, only special tiles like stairs
+    are entities.
+
+    Args:
+        entity_manager (EntityManager): Creates the map and special tiles.
+        tile_types (TileTypes): The shared tile type table.
+
+    """
     logger = logging.getLogger('mapcreation.MapGenerator')
 
-    def __init__(self, entity_manager):
+    def __init__(self, entity_manager, tile_types=None):
         self.entity_manager = entity_manager
-        self.tiles = []
+        self.tiles = None
+        self.entities = []
         # TODO: Get tileset size from config
         self.tilesetsize = 32
+        if tile_types is None:
+            tile_types = TileTypes(entity_manager.blueprint_manager,
+                                   self.tilesetsize)
+        self.tile_types = tile_types
+        # Every generator uses its own random generators, so maps can be
+        # reproduced from their seed
+        self.random = random.Random()
+        self.numpy_random = numpy.random.RandomState()
+
+    def configure(self, config):
+        """Configure generator specific parameters."""
+        pass
+
+    def generate_map(self, map_name, level, seed=None):
+        """Generates the layout of the map and creates the map entity and its
+        special tiles from it."""
+        return self.materialize(self.generate_layout(map_name, level, seed))
+
+    def generate_layout(self, map_name, level, seed=None):
+        """Generates the MapLayout of the given map and level. Creating the
+        layout must not touch the entity manager. The same seed always
+        results in the same layout, without a seed the layout is random."""
+        raise NotImplementedError
+
+    def seed(self, seed=None):
+        """Seeds the random generators used for the next map."""
+        self.random.seed(seed)
+        self.numpy_random.seed(seed)
+
+    def materialize(self, layout):
+        """Creates the map entity and the special tile entities of the given
+        layout and returns the id of the map. Layouts created with other tile
+        types are translated to the own tile ids."""
+        self.tiles = layout.tiles
+        if layout.tile_keys is not None:
+            self.tiles = self.tile_types.translate(layout.tile_keys)[
+                layout.tiles]
+        self.entities = []
+        for x, y, target_map, target_level in layout.stairs:
+            self.create_stairs(x, y, target_map, target_level)
+        return self.create_map_entity(layout.name, layout.level, layout.entry)
 
     def create_empty_map(self, width, height, tile="stone_wall"):
-        """ Returns a new Tile array with set size filled with walls"""
+        """ Returns a new tile grid with set size filled with walls"""
 
         self.logger.debug("Map size: %sx%s", width, height)
-        return [[self.create_tile(tile, x, y)
-                 for y in range(0, height)]
-                for x in range(0, width)]
+        return self.random_variants(tile, (width, height))
+
+    def create_grid(self, floor, floor_tile="stone_floor",
+                    wall_tile="stone_wall", rng=None):
+        """Converts a boolean floor mask into a tile grid in one pass. Every
+        floor cell becomes a random variant of floor_tile, every other cell a
+        random variant of wall_tile."""
+        return numpy.where(floor,
+                           self.random_variants(floor_tile, floor.shape, rng),
+                           self.random_variants(wall_tile, floor.shape, rng))
+
+    def random_variants(self, tile, shape, rng=None):
+        """Returns a grid of the given shape filled with random variants of
+        the tile blueprint."""
+        if rng is None:
+            rng = self.numpy_random
+        ids = numpy.array(self.tile_types.get_ids(tile), dtype=TILE_DTYPE)
+        return ids[rng.randint(len(ids), size=shape)]
 
     def create_tile(self, blueprint, x, y):
-        """ Creates a tile from the specified blueprint name """
-        tile = self.get_tile(x, y)
-        if tile is not None:
-            self.entity_manager.destroy_entity(self.get_tile(x, y))
+        """ Sets the tile at the given position to a random variant of the
+        specified blueprint and returns its tile id."""
+        tile = self.random.choice(self.tile_types.get_ids(blueprint))
+        self.tiles[x, y] = tile
+        return tile
+
+    def create_tile_entity(self, blueprint, x, y):
+        """Creates a special tile which is an entity on top of the tile grid
+        from the specified blueprint name."""
         tile_config = EntityConfiguration()
         tile_config.add_attribute('Position', 'x', x * self.tilesetsize)
         tile_config.add_attribute('Position', 'y', y * self.tilesetsize)
@@ -66,7 +361,7 @@ class MapGenerator():
             "tiles." + blueprint, tile_config)
         tileComp = (self.entity_manager.get(tile, "Tile"))
         if (tileComp.variant):
-            tileComp.name += "_" + str(random.sample(tileComp.variant, 1)[0])
+            tileComp.name += "_" + str(self.random.sample(tileComp.variant, 1)[0])
         if tileComp.offset is not None and tileComp.offset < 0:
             tileComp.offset = abs(tileComp.offset * self.tilesetsize)
         colliding = self.entity_manager.get(tile, 'Colliding')
@@ -74,113 +369,147 @@ class MapGenerator():
             colliding.set_position(x * self.tilesetsize, y * self.tilesetsize)
             colliding.w = self.tilesetsize
             colliding.h = self.tilesetsize
+        self.entities.append(tile)
         return tile
 
-    def create_custom_tile(self, x, y, char, colliding):
-        """Creates a tile with the specified properties."""
-        tile_config = EntityConfiguration()
-        tile_config.add_attribute('Position', 'x', x * self.tilesetsize)
-        tile_config.add_attribute('Position', 'y', y * self.tilesetsize)
-        tile_config.add_attribute('Renderable', 'character', char)
-        tile_config.add_attribute('Colliding', 'blocking', colliding)
-        tile_config.add_attribute('Colliding', 'x', x * self.tilesetsize)
-        tile_config.add_attribute('Colliding', 'y', y * self.tilesetsize)
-        tile_config.add_attribute('Colliding', 'w', self.tilesetsize)
-        tile_config.add_attribute('Colliding', 'h', self.tilesetsize)
-        return self.entity_manager.new_from_config(tile_config)
-
     def is_blocked(self, x, y):
-        """ Returns True, if the given position on the map has an enabled
-        Colliding component """
-        colliding = self.entity_manager.get(self.get_tile(x, y), 'Colliding')
-        return (colliding is not None and colliding.blocking)
+        """ Returns True, if the tile at the given position is blocking """
+        # Streamed tiles may register new tile types on access
+        tile = self.tiles[x, y]
+        return bool(self.tile_types.blocking[tile])
 
     def get_tile(self, x, y):
-        """ Returns the bottommost entity at the given position """
-        if len(self.tiles) > x and len(self.tiles[x]) > y:
-            return self.tiles[x][y]
+        """ Returns the tile id at the given position """
+        if self.tiles is not None and self.tiles.shape[0] > x and \
+                self.tiles.shape[1] > y:
+            return self.tiles[x, y]
         return None
 
     def create_stairs(self, x, y, target_map=None, target_level=None):
         """ Creates a stair entity at the given position leading to the given
         map and level """
-        tile = self.create_tile("stairs", x, y)
+        if self.is_blocked(x, y):
+            self.create_tile("stone_floor", x, y)
+        tile = self.create_tile_entity("stairs", x, y)
         self.entity_manager.set_entity_attribute(tile, "MapTransition",
                                                  'target_map', target_map)
         self.entity_manager.set_entity_attribute(tile, "MapTransition",
                                                  'target_level', target_level)
         return tile
 
-
-class WorldspaceGenerator(MapGenerator):
-    """ Loads the worldspace or generates it from scratch """
-
-    def generate_map(self, map_name, level):
-        height = 100
-        width = 140
-
-        height = random.randrange(math.floor(height * 0.7), height)
-        width = random.randrange(math.floor(width * 0.7), width)
-
-        self.tiles = self.create_empty_map(width, height, "stone_floor")
-        # TODO: Make Spawn Routine
-        self.tiles[25][25] = self.create_stairs(25, 25)
-        for x in range(2, width):
-            self.tiles[x][0] = self.create_tile('stone_wall', x, 0)
-            self.tiles[x][height-1] = self.create_tile('stone_wall',
-                                                       x, height-1)
-        for y in range(2, height):
-            self.tiles[0][y] = self.create_tile('stone_wall', 0, y)
-            self.tiles[width-1][y] = self.create_tile('stone_wall', width-1, y)
-
+    def create_map_entity(self, map_name, level, entry):
+        """Creates the map entity from the generated tiles and entities."""
         map_config = EntityConfiguration()
         map_config.add_attribute('Map', 'name', map_name)
         map_config.add_attribute('Map', 'tiles', self.tiles)
+        map_config.add_attribute('Map', 'tile_types', self.tile_types)
+        map_config.add_attribute('Map', 'entities', self.entities)
         map_config.add_attribute('Map', 'level', level)
-        map_config.add_attribute('Map', 'entry', (20*self.tilesetsize,
-                                                  20*self.tilesetsize))
+        map_config.add_attribute('Map', 'entry', entry)
         map_config.add_attribute('Map', 'tilesetsize', self.tilesetsize)
         return self.entity_manager.new_from_config(map_config)
 
 
+class WorldspaceGenerator(MapGenerator):
+    """ Loads the worldspace or generates it from scratch. The world is
+    streamed: its tiles are ChunkedTiles, which create the chunks near the
+    player on demand, so the size of the world does not affect memory or
+    startup time. """
+
+    def __init__(self, entity_manager, tile_types=None):
+        MapGenerator.__init__(self, entity_manager, tile_types)
+        # Random size if not configured
+        self.size = None
+        self.chunk_size = 32
+        self.resident_chunks = 64
+
+    def configure(self, config):
+        self.size = config.get('size', self.size)
+        self.chunk_size = config.get('chunk_size', self.chunk_size)
+        self.resident_chunks = config.get('resident_chunks',
+                                          self.resident_chunks)
+
+    def generate_layout(self, map_name, level, seed=None):
+        self.seed(seed)
+        if self.size is None:
+            height = 100
+            width = 140
+
+            height = self.random.randrange(math.floor(height * 0.7), height)
+            width = self.random.randrange(math.floor(width * 0.7), width)
+        else:
+            width, height = self.size
+        self.logger.debug("Map size: %sx%s", width, height)
+
+        # The chunks are recreated after eviction, so they need a fixed seed
+        if seed is None:
+            seed = self.random.getrandbits(32)
+        tiles = ChunkedTiles(width, height,
+                             partial(self.generate_chunk, seed, width, height),
+                             self.chunk_size, self.resident_chunks)
+        # TODO: Make Spawn Routine
+        return MapLayout(map_name, level, tiles,
+                         (20*self.tilesetsize, 20*self.tilesetsize),
+                         stairs=[(25, 25, None, None)], seed=seed)
+
+    def generate_chunk(self, seed, map_width, map_height, x, y, width,
+                       height):
+        """Generates the tile grid of a chunk: floor surrounded by walls at
+        the borders of the map. Every chunk uses its own random generator
+        seeded from the map seed and the chunk position."""
+        xs = numpy.arange(x, x + width)[:, numpy.newaxis]
+        ys = numpy.arange(y, y + height)[numpy.newaxis, :]
+        walls = (((ys == 0) | (ys == map_height - 1)) & (xs >= 2)) | \
+            (((xs == 0) | (xs == map_width - 1)) & (ys >= 2))
+        return self.create_grid(~walls, rng=numpy.random.RandomState(
+            [seed, x, y]))
+
+
 class DungeonGenerator(MapGenerator):
     """The Map Generator can generate predefined or random maps.
 
     Args:
-        tiles [(int)]: Two-dimensional array of tiles created
+        floor (numpy.ndarray): Boolean mask of the carved floor cells
         rooms [(Room)]: Array of all rooms created during traversion
 
     """
     logger = logging.getLogger('mapcreation.DungeonGenerator')
 
-    def generate_map(self, map_name, level):
-        """Loads the map configuration based on map name and level and generates
-        the new map.
+    def generate_layout(self, map_name, level, seed=None):
+        """Loads the map configuration based on map name and level and
+        generates the layout of the new map. Rooms and corridors are carved
+        into a boolean floor mask, which is converted into the tile grid at
+        the end.
 
         Args:
             map_name (str): The name of the map to generate.
             level (int): The level of the map.
+            seed (int): (Optionally) The seed of the map.
 
         """
+        self.seed(seed)
         height = 100
         width = 140
 
-        height = random.randrange(math.floor(height * 0.7), height)
-        width = random.randrange(math.floor(width * 0.7), width)
+        height = self.random.randrange(math.floor(height * 0.7), height)
+        width = self.random.randrange(math.floor(width * 0.7), width)
+        self.logger.debug("Map size: %sx%s", width, height)
 
         self.rooms = []
-        self.tiles = self.create_empty_map(width, height)
+        self.floor = numpy.zeros((width, height), dtype=bool)
         tree = self.create_bsp_tree(width, height)
         self.traverse_tree(tree, self.process_node)
 
-        map_config = EntityConfiguration()
-        map_config.add_attribute('Map', 'name', map_name)
-        map_config.add_attribute('Map', 'tiles', self.tiles)
-        map_config.add_attribute('Map', 'level', level)
-        map_config.add_attribute('Map', 'tilesetsize', self.tilesetsize)
-        entry = random.sample(self.rooms, 1)[0].random_spot()
-        map_config.add_attribute('Map', 'entry', entry)
-        return self.entity_manager.new_from_config(map_config)
+        entry = self.random.sample(self.rooms, 1)[0].random_spot(self.random)
+        return MapLayout(map_name, level, self.create_grid(self.floor), entry,
+                         seed=seed)
+
+    def seed(self, seed=None):
+        MapGenerator.seed(self, seed)
+        # 0 is the default random generator of libtcod
+        self.bsp_random = 0
+        if seed is not None:
+            self.bsp_random = libtcod.random_new_from_seed(seed)
 
     def process_node(self, node, userData=0):
         """ Processes the given node, create room if it is a leaf
@@ -194,12 +523,11 @@ class DungeonGenerator(MapGenerator):
     def create_room(self, node):
         """ Creates a randomly-sized room inside the given node.
         appends the Room-object onto the rooms-list of the map """
-        width = random.randrange(node.w // 2, node.w)
-        height = random.randrange(node.h // 2, node.h)
+        width = self.random.randrange(node.w // 2, node.w)
+        height = self.random.randrange(node.h // 2, node.h)
         room = Room(node.x, node.y, width, height)
-        for x in range(room.x + 1, room.x + width + 1):
-            for y in range(room.y + 1, room.y + height + 1):
-                self.tiles[x][y] = self.create_tile("stone_floor", x, y)
+        self.floor[room.x + 1:room.x + width + 1,
+                   room.y + 1:room.y + height + 1] = True
         self.logger.debug(
             "Created room on %s,%s sized %sx%s",
             node.x,
@@ -209,12 +537,11 @@ class DungeonGenerator(MapGenerator):
         self.rooms.append(room)
 
     def random_spot_in_node(self, node):
-        x = random.randrange(node.x, node.x + node.w - 1)
-        y = random.randrange(node.y, node.y + node.h - 1)
-        while (self.is_blocked(x, y)):
-            x = random.randrange(node.x, node.x + node.w - 1)
-            y = random.randrange(node.y, node.y + node.h - 1)
-        return (x, y)
+        """ Returns a random floor cell inside the given node """
+        cells = numpy.argwhere(self.floor[node.x:node.x + node.w - 1,
+                                          node.y:node.y + node.h - 1])
+        x, y = cells[self.random.randrange(len(cells))]
+        return (node.x + int(x), node.y + int(y))
 
     def create_corridor(self, node):
         """ Creates a corridor between random spots in two nodes"""
@@ -222,16 +549,12 @@ class DungeonGenerator(MapGenerator):
         (x2, y2) = self.random_spot_in_node(self.right_child(node))
         self.logger.info(
             "Generating Corridor between %s and %s", (x1, y1), (x2, y2))
-        if (random.randrange(2) == 1):
-            for y in range(min(y1, y2), max(y1, y2) + 1):
-                self.tiles[x1][y] = self.create_tile("stone_floor", x1, y)
-            for x in range(min(x1, x2), max(x1, x2) + 1):
-                self.tiles[x][y2] = self.create_tile("stone_floor", x, y2)
+        if (self.random.randrange(2) == 1):
+            self.floor[x1, min(y1, y2):max(y1, y2) + 1] = True
+            self.floor[min(x1, x2):max(x1, x2) + 1, y2] = True
         else:
-            for x in range(min(x1, x2), max(x1, x2) + 1):
-                self.tiles[x][y1] = self.create_tile("stone_floor", x, y1)
-            for y in range(min(y1, y2), max(y1, y2) + 1):
-                self.tiles[x2][y] = self.create_tile("stone_floor", x2, y)
+            self.floor[min(x1, x2):max(x1, x2) + 1, y1] = True
+            self.floor[x2, min(y1, y2):max(y1, y2) + 1] = True
 
     def left_child(self, node):
         """ Returns the left child of the given node"""
@@ -248,10 +571,37 @@ class DungeonGenerator(MapGenerator):
     def create_bsp_tree(self, width, height):
         """ Returns a new BSP tree, wrapping the libtcod bsp toolkit """
         tree = libtcod.bsp_new_with_size(0, 0, width - 2, height - 2)
-        libtcod.bsp_split_recursive(tree, 0, 6, 8, 8, 1.3, 1.3)
+        libtcod.bsp_split_recursive(tree, self.bsp_random, 6, 8, 8, 1.3, 1.3)
         return tree
 
 
+class MapLayout():
+    """The result of the map generation, before any entity is created. The
+    layout only consists of plain data, so it can be created independently of
+    the entity manager.
+
+        Args:
+            name (str): The name of the map.
+            level (int): The level of the map.
+            tiles (numpy.ndarray): The grid of tile ids, indexed by [x, y].
+            entry (tuple): The entry point of the map.
+            stairs [(x, y, target_map, target_level)]: The stairs to create.
+            tile_keys [(str, int)]: The keys of the tile ids, if the tiles
+                were created with foreign tile types (see TileTypes.keys).
+            seed (int): The seed the layout was generated from.
+    """
+
+    def __init__(self, name, level, tiles, entry, stairs=None,
+                 tile_keys=None, seed=None):
+        self.name = name
+        self.level = level
+        self.tiles = tiles
+        self.entry = entry
+        self.stairs = stairs if stairs is not None else []
+        self.tile_keys = tile_keys
+        self.seed = seed
+
+
 class Room():
 
     """A room on the map, connected with each other through corridors
@@ -269,6 +619,10 @@ class Room():
         self.width = width
         self.height = height
 
-    def random_spot(self):
-        return (random.randint(self.x, self.x + self.width),
-                random.randint(self.y, self.y + self.height))
+    def random_spot(self, rng=random):
+        return (rng.randint(self.x, self.x + self.width),
+                rng.randint(self.y, self.y + self.height))
+
+
+# The generator class of every map type
+GENERATORS = {'dungeon': DungeonGenerator, 'world': WorldspaceGenerator}
@@ -1,6 +1,7 @@
 """The module contains the event processors. An event processor must register
 itself in the EventManager in order to retrieve the events to process"""
-from collision import QTreeCollisionManager
+from collision import create_collision_manager
+from collision import TileCollisionMap
 from events import FrameworkEvent
 from events import GameAction
 from events import GameEvent
@@ -14,7 +15,6 @@ import game
 import input
 import logging
 import utils
-import math
 
 
 class SystemManager:
@@ -103,11 +103,15 @@ class EventProcessor(object):
     def unregister(self):
         pass
 
-    def _register(self, event_type, process_function):
-        self.event_manager.register_listener(event_type, process_function)
+    def _register(self, event_type, process_function, entity=None,
+                  query=None):
+        self.event_manager.register_listener(event_type, process_function,
+                                             entity, query)
 
-    def _unregister(self, event_type, process_function):
-        self.event_manager.remove_listener(event_type, process_function)
+    def _unregister(self, event_type, process_function, entity=None,
+                    query=None):
+        self.event_manager.remove_listener(event_type, process_function,
+                                           entity, query)
 
     def _create_event(self, event_type):
         return self.event_manager.create(event_type)
@@ -179,41 +183,65 @@ class MovementSystem(EventProcessor):
 
     def __init__(self, event_manager, entity_manager, no_collision=False):
         EventProcessor.__init__(self, event_manager, entity_manager)
-        self.collision_manager = QTreeCollisionManager()
+        self.collision_manager = create_collision_manager()
         self.moving_entities = {}
 
+    def configure(self, config):
+        """Configure the collision backend.
+
+        Args:
+            config (dict): {'collision_manager': {'impl': [module, class],
+                'config': {}}} (see collision.create_collision_manager)
+
+        """
+        if 'collision_manager' in config:
+            self.collision_manager = create_collision_manager(
+                config['collision_manager'])
+
     def apply(self, entity, direction, distance, position, collidable):
+        """Moves the entity in the direction. A colliding entity is swept
+        along its path, so it cannot tunnel through thin objects with large
+        steps. It stops at the first contact on the axis of the contact
+        normal and slides along the obstacle with the movement on the other
+        axis."""
         dx, dy = direction.get_dx(distance), direction.get_dy(distance)
-        collides = False
+        x_frac, y_frac = position.x_frac, position.y_frac
         if collidable is not None:
-            # Convert -0.12 to -1, and 0.45 to 1
-            predicted_dx = math.copysign(math.ceil(math.fabs(dx)), dx)
-            predicted_dy = math.copysign(math.ceil(math.fabs(dy)), dy)
-            rect = collidable.move(predicted_dx, predicted_dy)
-            collisions = self.collision_manager.collide_rect(entity, rect)
-            if len(collisions) > 0:
-                # throw event for each colliding entity
-                collides = True
-                self.logger.debug('Entity %s collided', entity)
-
-        if not collides:
-            position.move(dx, dy)
+            while dx or dy:
+                # Sweep the pixels the rect would move this step
+                step_x = int(position.x_frac + dx) - position.x
+                step_y = int(position.y_frac + dy) - position.y
+                hit = self.collision_manager.sweep(
+                    entity, collidable, step_x, step_y)
+                if hit is None:
+                    break
+                time, (normal_x, normal_y), key = hit
+                self.logger.debug('Entity %s collided with %s', entity, key)
+                # Snap to the contact and continue on the other axis
+                if normal_x:
+                    position.x += round(step_x * time)
+                    dx = 0
+                else:
+                    position.y += round(step_y * time)
+                    dy = 0
+                collidable.set_position(position.x, position.y)
+        position.move(dx, dy)
+        if position.x_frac != x_frac or position.y_frac != y_frac:
             if collidable is not None:
                 collidable.set_position(position.x, position.y)
                 self.collision_manager.move(entity)
+            entity_moved = self._create_event(GameEvent.EntityMoved)
+            entity_moved.entity = entity
+            self._throw_event(entity_moved)
 
     def update(self, round, delta):
-        moving_entities = self.entity_manager.get_all('Input')
-        entity_positions = self.entity_manager.get_all('Position')
-        entity_movement = self.entity_manager.get_all('Movement')
+        moving_entities = self.entity_manager.query(
+            'Input', 'Position', 'Movement', 'Sprite')
         entity_collidables = self.entity_manager.get_all('Colliding')
-        for entity, inputcomp in moving_entities.items():
+        for entity, inputcomp, position, movement, sprite in moving_entities:
             # TODO: Make an Animation Processor or think of a more elegant
             # solution for animation handling
-            sprite = self.entity_manager.get(entity, "Sprite")
             if inputcomp.direction.direction != 0:
-                position = entity_positions[entity]
-                movement = entity_movement[entity]
                 collidable = entity_collidables.get(entity)
                 sprite.animate("walk")
                 self.apply(
@@ -226,10 +254,17 @@ class MovementSystem(EventProcessor):
                 sprite.animate("idle")
 
     def on_map_changed(self, event):
-        map = self.entity_manager.current_map
-        # TODO: Map should countain bounds
-        collidables = self.entity_manager.get_all('Colliding')
-        self.collision_manager.fill(Rect(0, 0, 3200, 4480), collidables)
+        map = self.entity_manager.get(self.entity_manager.current_map, 'Map')
+        # The static tiles are looked up in the grid of blocked cells, only
+        # the colliding entities of the current map and the player are
+        # indexed
+        self.collision_manager.set_tiles(TileCollisionMap.from_map(map))
+        colliding = self.entity_manager.get_all('Colliding')
+        entities = list(map.entities) + [self.entity_manager.player]
+        self.collision_manager.fill(
+            Rect(0, 0, map.width(), map.height()),
+            dict((entity, colliding[entity]) for entity in entities
+                 if entity in colliding))
 
 
 class WorldInitializer(EventProcessor):
@@ -262,7 +297,8 @@ class WorldInitializer(EventProcessor):
 
 class MapChangeProcessor(EventProcessor):
     """Listens on MapChange Events and uses chnages or generates the maps
-    accordingly."""
+    accordingly. After a change the adjacent maps can be pregenerated in the
+    background (see MapManager)."""
     logger = logging.getLogger('processors.MapChangeProcessor')
 
     def register(self):
@@ -270,11 +306,15 @@ class MapChangeProcessor(EventProcessor):
 
     def unregister(self):
         self._unregister(GameAction.MapChange, self.on_map_change)
+        self.map_manager.shutdown()
 
     def __init__(self, event_manager, entity_manager):
         EventProcessor.__init__(self, event_manager, entity_manager)
         self.map_manager = MapManager(entity_manager)
 
+    def configure(self, config):
+        self.map_manager.configure(config)
+
     def on_map_change(self, event):
         if event.level is None:
             event.level = 0
@@ -296,6 +336,7 @@ class MapChangeProcessor(EventProcessor):
         move_action.absolute = 1
         self._throw_event(move_action)
         self.change_map(new_map)
+        self.map_manager.pregenerate_adjacent(new_map)
 
     def change_map(self, new_map):
         """Changes the current map with the specified map."""
@@ -317,14 +358,17 @@ class SpriteProcessor(EventProcessor):
     def __init__(self, event_manager, entity_manager, sprite_manager):
         EventProcessor.__init__(self, event_manager, entity_manager)
         self.sprite_manager = sprite_manager
+        self.sprites = entity_manager.query('Sprite')
 
     def register(self):
         self._register(FrameworkEvent.EntityCreated, self.on_entity_created)
-        self._register(GameEvent.EntityMoved, self.on_entity_moved)
+        self._register(GameEvent.EntityMoved, self.on_entity_moved,
+                       query=self.sprites)
 
     def unregister(self):
         self._unregister(FrameworkEvent.EntityCreated, self.on_entity_created)
-        self._unregister(GameEvent.EntityMoved, self.on_entity_moved)
+        self._unregister(GameEvent.EntityMoved, self.on_entity_moved,
+                         query=self.sprites)
 
     def on_entity_created(self, event):
         entity = event.entity
@@ -333,11 +377,10 @@ class SpriteProcessor(EventProcessor):
             self.sprite_manager.initialize_sprite(sprite)
 
     def on_entity_moved(self, event):
-        entity = event.entity
-        sprite = self.entity_manager.get(entity, 'Sprite')
-        if sprite is not None:
-            self.logger.debug('Set sprite dirty %s', sprite)
-            sprite.dirty = 1
+        # Only called for entities with a sprite
+        sprite = self.entity_manager.get(event.entity, 'Sprite')
+        self.logger.debug('Set sprite dirty %s', sprite)
+        sprite.dirty = 1
 
     def update(self, round, delta_time):
         for entity, sprite in self.entity_manager.get_all(
@@ -347,35 +390,73 @@ class SpriteProcessor(EventProcessor):
 
 class UseEntityProcessor(EventProcessor):
     """ Listens for UseEntity Events, determines Target Entity and throws its
-    Use-Event """
+    Use-Event. The useable entities of the current map are kept in a
+    collision index, which is rebuilt on map change and updated when useable
+    entities move. Useable entities are only created with their map, so
+    entities which have been destroyed since are skipped when used."""
+    logger = logging.getLogger('processors.UseEntityProcessor')
+    # The distance in pixels in which an entity can be used
+    reach = 16
 
     def __init__(self, event_manager, entity_manager):
         EventProcessor.__init__(self, event_manager, entity_manager)
-        self.collision_manager = QTreeCollisionManager()
+        self.collision_manager = create_collision_manager()
+        self.useables = entity_manager.query('Useable', 'Position')
+        # The rects of the indexed entities {entity: Rect}
+        self.rects = {}
+
+    def configure(self, config):
+        """Configure the collision backend (see MovementSystem.configure)."""
+        if 'collision_manager' in config:
+            self.collision_manager = create_collision_manager(
+                config['collision_manager'])
 
     def register(self):
         self._register(GameAction.UseEntityAction, self.on_use_entity)
+        self._register(GameEvent.MapChanged, self.on_map_changed)
+        self._register(GameEvent.EntityMoved, self.on_entity_moved,
+                       query=self.useables)
 
     def unregister(self):
         self._unregister(GameAction.UseEntityAction, self.on_use_entity)
+        self._unregister(GameEvent.MapChanged, self.on_map_changed)
+        self._unregister(GameEvent.EntityMoved, self.on_entity_moved,
+                         query=self.useables)
+
+    def on_map_changed(self, event):
+        map = self.entity_manager.get(self.entity_manager.current_map, 'Map')
+        self.rects = {}
+        for entity in map.entities:
+            if entity in self.useables:
+                self.rects[entity] = self._use_rect(entity)
+        self.collision_manager.fill(Rect(0, 0, map.width(), map.height()),
+                                    self.rects)
+
+    def on_entity_moved(self, event):
+        rect = self.rects.get(event.entity)
+        if rect is not None:
+            position = self.entity_manager.get(event.entity, 'Position')
+            rect.topleft = (position.x - self.reach, position.y - self.reach)
+            self.collision_manager.move(event.entity)
 
     def on_use_entity(self, event):
-        user = self.entity_manager.get(event.user, 'Position')
         user_colliding = self.entity_manager.get(event.user, 'Colliding')
-        target = (user.x, user.y)
-        useables = self.entity_manager.get_all('Useable')
-        useable_rects = {}
-        for entity in useables:
-            pos = self.entity_manager.get(entity, 'Position')
-            useable_rects[entity] = Rect(pos.x-16, pos.y-16, 32, 32)
-        self.collision_manager.fill(Rect(0, 0, 3200, 4480), useable_rects)
         collisions = self.collision_manager.collide_rect(
             event.user, user_colliding)
+        # Skip entities which have been destroyed since the map change
+        collisions = [entity for entity in collisions
+                      if entity in self.useables]
 
         if (len(collisions) > 0):
-            action = getattr(GameAction, useables[collisions[0]].useEvent)
+            useable = self.entity_manager.get(collisions[0], 'Useable')
+            action = getattr(GameAction, useable.useEvent)
             self._throw_new_event(action, {'usedEntity': collisions[0]})
 
+    def _use_rect(self, entity):
+        position = self.entity_manager.get(entity, 'Position')
+        return Rect(position.x - self.reach, position.y - self.reach,
+                    2 * self.reach, 2 * self.reach)
+
 
 class TransitionProcessor(EventProcessor):
     """ Converts an Event into MapChange Events with the entity's MapTransition
@@ -402,18 +483,33 @@ class ViewProcessor(EventProcessor):
     def __init__(self, event_manager, entity_manager, window):
         EventProcessor.__init__(self, event_manager, entity_manager)
         self.window = window
+        # The entity whose movement updates the view
+        self.followed = None
 
     def register(self):
         self._register(GameAction.MapChange, self.on_map_change)
         self._register(GUIAction.MenuOpen, self.on_menu_open)
-        self._register(GameEvent.EntityMoved, self.on_entity_moved)
 
     def unregister(self):
         self._unregister(GameAction.MapChange, self.on_map_change)
         self._unregister(GUIAction.MenuOpen, self.on_menu_open)
-        self._unregister(GameEvent.EntityMoved, self.on_entity_moved)
+        self.follow(None)
+
+    def follow(self, entity):
+        """Updates the game view whenever the entity moves."""
+        if entity == self.followed:
+            return
+        if self.followed is not None:
+            self._unregister(GameEvent.EntityMoved, self.on_entity_moved,
+                             self.followed)
+        if entity is not None:
+            self._register(GameEvent.EntityMoved, self.on_entity_moved,
+                           entity)
+        self.followed = entity
 
     def on_map_change(self, event):
+        # The player is created on world enter, before the first map change
+        self.follow(self.entity_manager.player)
         # TODO: make view active on world enter and handle map updating with a
         # simple map.dirty flag
         if self.window.show('game_view'):
@@ -430,8 +526,7 @@ class ViewProcessor(EventProcessor):
 
     def on_entity_moved(self, event):
         # Update the game view (calculates viewport) if the player has moved
-        if event.entity == self.entity_manager.player:
-            self.window.update_view('game_view')
+        self.window.update_view('game_view')
 
 
 class SoundSystem(EventProcessor):
@@ -0,0 +1,119 @@
+"""Instrumentation of the event dispatch. The EventProfiler measures the time
+spent in every listener and can export the measurements as JSON summary or as
+Chrome trace (chrome://tracing or https://ui.perfetto.dev)."""
+from collections import deque
+from time import perf_counter
+import json
+import logging
+
+
+class EventProfiler:
+    """Records per event type counts, per listener call counts, cumulative
+    and maximum wall time and the queue depth at the start of every tick.
+    The profiler is installed by EventManager.enable_profiling, which replaces
+    the process_event method of the event manager, so there is no overhead as
+    long as profiling is disabled.
+
+    Args:
+        trace_file (str): (Optionally) The file written by write_trace.
+        max_trace_events (int): The number of most recent trace events kept
+            for the Chrome trace.
+
+    """
+    logger = logging.getLogger('profiling.EventProfiler')
+
+    def __init__(self, trace_file=None, max_trace_events=100000):
+        self.trace_file = trace_file
+        self.start = perf_counter()
+        # {event_type_name: count}
+        self.event_counts = {}
+        # {listener_name: [calls, total_time, max_time]}
+        self.listener_stats = {}
+        # [(time, queue_depth)] at the start of every tick
+        self.queue_depths = []
+        # Chrome trace events, only the most recent are kept
+        self.trace_events = deque(maxlen=max_trace_events)
+        # Cache of the names of listener functions {function: name}
+        self.names = {}
+
+    def install(self, event_manager):
+        """Profiles the event dispatch of the event manager."""
+        def process_event(event, round):
+            self.process_event(event_manager.listeners_of(event), event)
+        event_manager.process_event = process_event
+
+    def uninstall(self, event_manager):
+        del event_manager.process_event
+
+    def process_event(self, process_functions, event):
+        """Dispatches the event to the process functions and measures every
+        function."""
+        event_type = str(event.identifier)
+        self.event_counts[event_type] = self.event_counts.get(event_type,
+                                                              0) + 1
+        for process_function in process_functions:
+            start = perf_counter()
+            process_function(event)
+            end = perf_counter()
+            self._record(self._name(process_function), event_type, start,
+                         end - start)
+
+    def on_tick(self, queue_depth):
+        """Records the queue depth at the start of a tick."""
+        now = perf_counter()
+        self.queue_depths.append((now - self.start, queue_depth))
+        self.trace_events.append({
+            'name': 'queue depth', 'ph': 'C', 'pid': 0,
+            'ts': self._micros(now), 'args': {'pending': queue_depth}})
+
+    def summary(self):
+        """Returns the recorded statistics as dictionary, listeners are
+        sorted by their cumulative time."""
+        listeners = [{'listener': name, 'calls': calls, 'total': total,
+                      'max': max_time, 'mean': total / calls}
+                     for name, (calls, total, max_time)
+                     in self.listener_stats.items()]
+        listeners.sort(key=lambda stats: stats['total'], reverse=True)
+        depths = [depth for _, depth in self.queue_depths]
+        return {'events': self.event_counts,
+                'listeners': listeners,
+                'ticks': len(depths),
+                'max_queue_depth': max(depths) if depths else 0}
+
+    def chrome_trace(self):
+        """Returns the recorded listener calls and queue depths in the Chrome
+        trace event format."""
+        return {'traceEvents': list(self.trace_events),
+                'displayTimeUnit': 'ms',
+                'otherData': self.summary()}
+
+    def write_trace(self, trace_file=None):
+        """Writes the Chrome trace to the given or configured file."""
+        trace_file = trace_file or self.trace_file
+        with open(trace_file, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        self.logger.info('Wrote event trace to %s', trace_file)
+
+    def _record(self, name, event_type, start, duration):
+        stats = self.listener_stats.get(name)
+        if stats is None:
+            self.listener_stats[name] = [1, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]:
+                stats[2] = duration
+        self.trace_events.append({
+            'name': name, 'cat': event_type, 'ph': 'X', 'pid': 0, 'tid': 0,
+            'ts': self._micros(start), 'dur': duration * 1000000})
+
+    def _name(self, process_function):
+        name = self.names.get(process_function)
+        if name is None:
+            name = getattr(process_function, '__qualname__',
+                           repr(process_function))
+            self.names[process_function] = name
+        return name
+
+    def _micros(self, time):
+        return (time - self.start) * 1000000
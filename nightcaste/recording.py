@@ -0,0 +1,131 @@
+"""Recording of the thrown events. The EventRecorder writes every event with
+its tick into a compressed log, which can be replayed by the replay module to
+reproduce a game session."""
+from enum import Enum
+import gzip
+import logging
+import pickle
+import random
+
+# Version of the log format, stored in the header of every log
+LOG_VERSION = 2
+
+
+class EventRecorder:
+    """Logs every event thrown by the event manager. The log starts with a
+    header {'version': int, 'seed': int} followed by a record
+    (tick, event_type_name, root, payload) per event.
+
+    Sessions running with a tick budget defer low priority events depending
+    on the real time. Every process_events call which deferred events is
+    logged as (tick, None, call, processed), the number of low priority
+    events it processed, so the replay defers the same events.
+
+    Root events are the ones which are not caused by other events: input
+    events and the events thrown before the first tick. Only root events are
+    replayed, all other events are recorded to compare the replay with the
+    original session.
+
+    The recorder seeds the random module, so the managers created afterwards
+    generate the same world when the log is replayed.
+
+    Args:
+        log_file (str): The file the log is written to.
+        seed (int): (Optionally) The seed of the random module, a random seed
+            is chosen by default.
+
+    """
+    logger = logging.getLogger('recording.EventRecorder')
+
+    def __init__(self, log_file, seed=None):
+        self.log_file = log_file
+        self.seed = random.getrandbits(32) if seed is None else seed
+        random.seed(self.seed)
+        self.file = gzip.open(log_file, 'wb')
+        self._write({'version': LOG_VERSION, 'seed': self.seed})
+        self.event_manager = None
+        self.recorded = 0
+
+    def install(self, event_manager):
+        """Records all events thrown by the event manager."""
+        throw = event_manager.throw
+
+        def recording_throw(event):
+            self.record(event_manager.tick, event)
+            throw(event)
+        event_manager.throw = recording_throw
+        self.event_manager = event_manager
+
+    def uninstall(self, event_manager):
+        del event_manager.throw
+        self.event_manager = None
+
+    def record(self, tick, event):
+        """Writes the event with the current payload to the log."""
+        self._write((tick, type_name(event.identifier),
+                     is_root(tick, event.identifier), payload(event)))
+        self.recorded += 1
+
+    def record_deferral(self, tick, call, processed):
+        """Writes the number of low priority events processed by the call of
+        process_events in the tick, before the remaining were deferred."""
+        self._write((tick, None, call, processed))
+
+    def close(self):
+        self.file.close()
+        self.logger.info('Recorded %d events to %s', self.recorded,
+                         self.log_file)
+
+    def _write(self, record):
+        self.file.write(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+
+
+def read_log(log_file):
+    """Reads a log written by the EventRecorder.
+
+    Returns:
+        The header and the list of event records. The logged deferrals are
+        added to the header as 'deferrals' {(tick, call): processed} (see
+        EventManager.deferrals).
+
+    """
+    records = []
+    deferrals = {}
+    with gzip.open(log_file, 'rb') as f:
+        header = pickle.load(f)
+        if header.get('version') != LOG_VERSION:
+            raise ValueError('Unsupported event log version %s' %
+                             header.get('version'))
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                break
+            if record[1] is None:
+                deferrals[(record[0], record[2])] = record[3]
+            else:
+                records.append(record)
+    header['deferrals'] = deferrals
+    return header, records
+
+
+def is_root(tick, event_type):
+    """Events thrown before the first tick and input events are not caused by
+    other events."""
+    return tick == 0 or type(event_type).__name__ == 'InputEvent'
+
+
+def type_name(event_type):
+    """Get the name of the event type, which is understood by
+    events.event_type_for_name."""
+    if isinstance(event_type, Enum):
+        return '%s.%s' % (type(event_type).__name__, event_type.name)
+    return event_type
+
+
+def payload(event):
+    """Get the payload of the event as dictionary."""
+    if event.payload:
+        return dict((prop, getattr(event, prop)) for prop in event.payload)
+    return dict((prop, value) for prop, value in
+                getattr(event, '__dict__', {}).items())
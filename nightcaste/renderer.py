@@ -10,8 +10,10 @@ from nightcaste.processors import ViewProcessor
 from os import path
 from os import listdir
 from math import ceil, floor
+from tiles import ChunkedTiles
 import game
 import logging
+import numpy
 import pygame
 import utils
 
@@ -204,6 +206,8 @@ class ScrollablePane(ContentPane):
         super(ScrollablePane, self).__init__(window, x, y,
                                              width, height, z_index=0)
         self.image = None
+        # The position of the background image on the scrollable area
+        self.image_origin = (0, 0)
         self.viewport = ViewPort(width, height)
 
     def initialize(self):
@@ -270,7 +274,7 @@ class ScrollablePane(ContentPane):
         blitted to the unaltered destination.
         If the src_rect only overlays parts of the image, the source and
         destination will be adjusted."""
-        image_rect = self.image.get_rect()
+        image_rect = self.image.get_rect(topleft=self.image_origin)
         sub_rect = src_rect.clip(image_rect)
         if sub_rect.w == 0 and sub_rect.h == 0:
             # src does not overlap image
@@ -286,13 +290,15 @@ class ScrollablePane(ContentPane):
             # src overlaps to the top and/or buttom
             dst_rect.top = sub_rect.top - src_rect.top
             dst_rect.h = sub_rect.h
-        self.surface.blit(self.image.subsurface(sub_rect), dst_rect)
+        self.surface.blit(self.image.subsurface(sub_rect.move(
+            -self.image_origin[0], -self.image_origin[1])), dst_rect)
         self.dirty_rects.append(self.surface.get_rect())
 
     def put_bg_image(self, image, x, y):
         """Blits an image to the background. If the position is in the current
         viewport, the image will also be blitted to the current surface."""
-        self.image.blit(image, (x, y))
+        self.image.blit(image, (x - self.image_origin[0],
+                                y - self.image_origin[1]))
         if self.viewport.contains(x, y):
             x_off, y_off = self.viewport.offset(x, y)
             rects = self.surface.blit(image, (x_off, y_off))
@@ -302,8 +308,10 @@ class ScrollablePane(ContentPane):
         sprite.rect = self.viewport.apply(sprite.rect)
         super(ScrollablePane, self).put_sprite(sprite)
 
-    def create_bg(self, width, height):
+    def create_bg(self, width, height, x=0, y=0):
+        """Creates the background image covering the given area."""
         self.image = pygame.Surface((width, height))
+        self.image_origin = (x, y)
 
 
 class MapPane(ScrollablePane):
@@ -313,14 +321,23 @@ class MapPane(ScrollablePane):
         super(MapPane, self).__init__(window, x, y, width, height, z_index)
         tile_config = utils.load_config('config/tilesets/tiles.json')
         self.tileset = TileSet(window.image_manager, tile_config)
+        # Streamed maps are only rendered in a window of cells around the
+        # player (x0, y0, x1, y1), which is moved if the player is more than
+        # window_margin cells away from its center
+        self.tile_window = None
+        self.tile_window_center = None
+        self.window_margin = 8
 
     def initialize(self):
         super(MapPane, self).initialize()
         self._render_map()
 
     def update(self):
-        """Updates the view port"""
+        """Updates the view port and moves the tile window of streamed maps
+        with the player."""
         self._update_view_port()
+        if self.tile_window is not None and self._leaves_tile_window():
+            self._render_map(clear=False)
 
     def render(self):
         """Renders all entities with a visible renderable component and with a
@@ -328,23 +345,61 @@ class MapPane(ScrollablePane):
         self._render_sprites()
         return self.dirty_rects
 
-    def _render_map(self):
-        self.print_background()
+    def _render_map(self, clear=True):
+        if clear:
+            self.print_background()
         em = self.window.entity_manager
         if em.current_map is not None:
             map = em.get(em.current_map, 'Map')
-            self.create_bg(map.width(), map.height())
-            to_render = [x for y in em.get_current_map() for x in y]
-            self._render_tiles(to_render)
+            cells = (0, 0) + map.tiles.shape
+            self.tile_window = None
+            if isinstance(map.tiles, ChunkedTiles):
+                cells = self.tile_window = self._create_tile_window(map)
+            self.create_map_bg(map, cells)
+            self._render_tiles(map, cells)
+            self._render_tile_entities(map.entities)
+
+    def _create_tile_window(self, map):
+        """Returns the window of cells around the player, which covers the
+        pane and the window margin."""
+        position = self.window.entity_manager.get(
+            self.window.entity_manager.player, 'Position')
+        radius = self._covered_radius() // map.tilesetsize + \
+            self.window_margin + 1
+        x = position.x // map.tilesetsize
+        y = position.y // map.tilesetsize
+        self.tile_window_center = (x, y)
+        return (max(x - radius, 0), max(y - radius, 0),
+                min(x + radius + 1, map.tiles.shape[0]),
+                min(y + radius + 1, map.tiles.shape[1]))
+
+    def _covered_radius(self):
+        """The distance in map pixels from the center of the pane to its
+        farthest visible point in horizontal or vertical direction."""
+        return max(self.width, self.height) // 2
+
+    def _leaves_tile_window(self):
+        em = self.window.entity_manager
+        map = em.get(em.current_map, 'Map')
+        position = em.get(em.player, 'Position')
+        x, y = self.tile_window_center
+        return abs(position.x // map.tilesetsize - x) > self.window_margin or \
+            abs(position.y // map.tilesetsize - y) > self.window_margin
+
+    def create_map_bg(self, map, cells):
+        """Creates the background image for the given cells
+        (x0, y0, x1, y1) of the map."""
+        x0, y0, x1, y1 = cells
+        size = map.tilesetsize
+        self.create_bg((x1 - x0) * size, (y1 - y0) * size, x0 * size,
+                       y0 * size)
 
     def _render_sprites(self):
         # TODO: Render SpriteGroups instead of individual sprites
         em = self.window.entity_manager
-        positions = em.get_all('Position')
-        sprites = em.get_all('Sprite')
-        for entity, sprite in sorted(
-                sprites.items(), key=lambda k_v: k_v[1].z_index):
-            self._render_sprite(entity, sprite, positions[entity])
+        for entity, sprite, position in sorted(
+                em.query('Sprite', 'Position'), key=lambda row: row[1].z_index):
+            self._render_sprite(entity, sprite, position)
 
     def _render_sprite(self, entity, sprite, position):
         # restore map tile at old position
@@ -366,36 +421,56 @@ class MapPane(ScrollablePane):
                          (floor(dx), ceil(dy)),
                          (ceil(dx), floor(dy)),
                          (ceil(dx), ceil(dy))])
+        map = em.get(em.current_map, 'Map')
         for tile in intersect:
             tile = (int(tile[0]), int(tile[1]))
-            new_tile_entity = em.get_current_map()[tile[0]][tile[1]]
-            new_tile = em.get(new_tile_entity, 'Tile')
-            self.put_tile(tile[0], tile[1], new_tile.name)
-
-    def _render_tiles(self, entities):
-        """ Iterates through a list of entities and renders each """
+            tile_id = em.get_current_map()[tile[0], tile[1]]
+            self._render_tile(map.tile_types.names[tile_id],
+                              tile[0] * map.tilesetsize,
+                              tile[1] * map.tilesetsize,
+                              map.tile_types.offset[tile_id])
+
+    def _render_tiles(self, map, cells):
+        """ Renders the cells (x0, y0, x1, y1) of the tile grid ordered by the
+        z_index of the tile types """
+        x0, y0, x1, y1 = cells
+        tile_types = map.tile_types
+        grid = map.tiles[x0:x1, y0:y1]
+        order = numpy.argsort(tile_types.z_index[grid], axis=None,
+                              kind='stable')
+        xs, ys = numpy.unravel_index(order, grid.shape)
+        names = tile_types.names
+        offsets = tile_types.offset.tolist()
+        size = map.tilesetsize
+        for x, y, tile_id in zip(xs.tolist(), ys.tolist(),
+                                 grid.ravel()[order].tolist()):
+            self._render_tile(names[tile_id], (x0 + x) * size,
+                              (y0 + y) * size, offsets[tile_id])
+
+    def _render_tile_entities(self, entities):
+        """ Iterates through a list of special tile entities and renders
+        each """
         em = self.window.entity_manager
         tiles = {k: v for k, v in em.get_components_for_entities(
             entities, 'Tile').items() if v is not None and v.visible}
         positions = em.get_components_for_entities(entities, 'Position')
-        colors = em.get_components_for_entities(entities, 'Color')
         for entity, tile in sorted(
                 tiles.items(), key=lambda k_v1: k_v1[1].z_index):
-            self._render_tile(tile, positions[entity], colors[entity])
+            position = positions[entity]
+            self._render_tile(tile.name, position.x, position.y, tile.offset)
 
-    def _render_tile(self, tile, position, color):
-        """Check if the position of the given entity is in the viewport and
-        render the entety to the window with the recalculated position in the
-        pane.
+    def _render_tile(self, name, x, y, offset):
+        """Render the tile image to the background at the given map position.
 
         Args:
-            entity (object): the entity which should be rendered.
-            tile (Tile): The visible renderable component of the
-                given entity.
+            name (str): The name of the tile image.
+            x (int): The horizontal position on the map.
+            y (int): The vertical position on the map.
+            offset (int): The vertical offset of the tile image.
 
         """
-        tileImage = self.tileset.get_tile(tile.name)
-        self.put_bg_image(tileImage, position.x, position.y)
+        tileImage = self.tileset.get_tile(name)
+        self.put_bg_image(tileImage, x, y)
 
     def _update_view_port(self):
         """The viewport is the visble range of the map. The viewport is always
@@ -425,11 +500,23 @@ class IsoMapPane(MapPane):
         iso_y = (x + y) // 2
         return (iso_x + self.iso_offset, iso_y)
 
-    def create_bg(self, width, height):
-        self.iso_offset = height
-        iso_surface_width = width + height
-        iso_surface_height = iso_surface_width // 2
-        super(IsoMapPane, self).create_bg(iso_surface_width, iso_surface_height)
+    def create_map_bg(self, map, cells):
+        """Creates the background image covering the isometric projection of
+        the given cells (x0, y0, x1, y1) of the map."""
+        self.iso_offset = map.height()
+        size = map.tilesetsize
+        left, top = cells[0] * size, cells[1] * size
+        right, bottom = cells[2] * size, cells[3] * size
+        iso_left = self.cartesian_to_isometric(left, bottom)[0]
+        iso_right = self.cartesian_to_isometric(right, top)[0]
+        iso_top = self.cartesian_to_isometric(left, top)[1]
+        iso_bottom = self.cartesian_to_isometric(right, bottom)[1]
+        self.create_bg(iso_right - iso_left, iso_bottom - iso_top, iso_left,
+                       iso_top)
+
+    def _covered_radius(self):
+        # The isometric point (x, y) is y + x / 2 away on the map
+        return self.width // 4 + self.height // 2
 
     def update_viewport(self, x, y):
         iso_x, iso_y = self.cartesian_to_isometric(x, y)
@@ -444,19 +531,19 @@ class IsoMapPane(MapPane):
             sprite.rect.x, sprite.rect.y)
         super(IsoMapPane, self).put_sprite(sprite)
 
-    def _render_tile(self, tile, position, color):
-        """Check if the position of the given entity is in the viewport and
-        render the entety to the window with the recalculated position in the
-        pane.
+    def _render_tile(self, name, x, y, offset):
+        """Render the tile image to the isometric background. The offset moves
+        the image up, so high tiles like walls overlap the tiles behind them.
 
         Args:
-            entity (object): the entity which should be rendered.
-            tile (Tile): The visible renderable component of the
-                given entity.
+            name (str): The name of the tile image.
+            x (int): The horizontal position on the map.
+            y (int): The vertical position on the map.
+            offset (int): The vertical offset of the tile image.
 
         """
-        tileImage = self.tileset.get_tile(tile.name)
-        self.put_bg_image(tileImage, position.x - tile.offset, position.y - tile.offset)
+        tileImage = self.tileset.get_tile(name)
+        self.put_bg_image(tileImage, x - offset, y - offset)
 
 
 class ViewPort:
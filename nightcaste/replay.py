@@ -0,0 +1,171 @@
+"""Headless replay of event logs written by the EventRecorder. The replay
+feeds the root events of the log into a new game setup and runs the ticks as
+fast as possible without rendering, which reproduces a recorded session for
+bug reports and performance regression runs."""
+from behaviour import TurnBehaviourManager
+from entities import EntityManager
+from events import EventManager
+from events import EVENT_GROUPS
+from events import InputEvent
+from events import event_type_for_name
+from processes import ProcessManager
+from processors import SystemManager
+from recording import payload
+from recording import read_log
+from recording import type_name
+from time import perf_counter
+import argparse
+import engine
+import input
+import logging
+import os
+import pygame
+import random
+import utils
+
+
+class ReplayInputController(input.InputController):
+    """Throws the recorded root events of each tick instead of reading the
+    user input.
+
+    Args:
+        records ([tuple]): The records of the event log.
+
+    """
+
+    def __init__(self, event_manager, entity_manager, records):
+        input.InputController.__init__(self, False, event_manager,
+                                       entity_manager)
+        # The root events of every tick {tick: [(type_name, payload)]}
+        self.root_events = {}
+        self.last_tick = 0
+        for tick, name, root, data in records:
+            if root:
+                self.root_events.setdefault(tick, []).append((name, data))
+            self.last_tick = max(self.last_tick, tick)
+
+    def throw_initial_events(self):
+        """Throws the events which have been thrown before the first tick."""
+        self._throw_root_events(0)
+
+    def check_for_input(self):
+        tick = self.event_manager.tick
+        self._throw_root_events(tick)
+        if tick >= self.last_tick:
+            self.request_close = True
+
+    def _throw_root_events(self, tick):
+        for name, data in self.root_events.get(tick, ()):
+            event_type = event_type_for_name(name) \
+                if name.split('.')[0] in EVENT_GROUPS else name
+            if event_type == InputEvent.KeyPressed:
+                self.press(data['keycode'])
+            elif event_type == InputEvent.KeyReleased:
+                self.release(data['keycode'])
+            else:
+                self.event_manager.throw_new(event_type, data)
+
+
+class Replayer:
+    """Replays an event log with the game configuration.
+
+    Args:
+        log_file (str): The log written by the EventRecorder.
+        config_file (str): The game configuration.
+        delta_time (float): (Optionally) The simulated time of every tick in
+            seconds, the configured time of the engine by default.
+
+    """
+    logger = logging.getLogger('replay.Replayer')
+
+    def __init__(self, log_file, config_file='config/nightcaste.json',
+                 delta_time=None):
+        self.header, self.records = read_log(log_file)
+        self.config_file = config_file
+        self.delta_time = delta_time
+        # The events thrown during the replay [(tick, type_name, payload)]
+        self.replayed = []
+
+    def run(self):
+        """Replays the log.
+
+        Returns:
+            A dictionary with the number of replayed 'ticks' and 'events',
+            the real time in 'seconds' and the first tick in which the
+            replay 'diverged' from the log (None if it did not).
+
+        """
+        game_config = utils.load_config(self.config_file)
+        delta_time = self.delta_time or engine.sec_per_update(game_config)
+        event_config = dict(game_config.get('events', {}))
+        event_config.pop('record', None)
+        event_config.pop('profile', None)
+        event_manager = EventManager(event_config)
+        # Defer the low priority events like the recorded session
+        event_manager.deferrals = self.header['deferrals']
+        self._compare(event_manager)
+        random.seed(self.header['seed'])
+        input.pressed_keys.clear()
+        entity_manager = EntityManager(game_config.get('entities'))
+        behaviour_manager = TurnBehaviourManager(
+            event_manager, entity_manager, game_config['behaviours'])
+        system_manager = SystemManager(event_manager, entity_manager,
+                                       game_config)
+        process_manager = ProcessManager(entity_manager, event_manager)
+        input_controller = ReplayInputController(event_manager,
+                                                 entity_manager, self.records)
+        engine.create_window(event_manager, entity_manager, system_manager)
+
+        start = perf_counter()
+        input_controller.throw_initial_events()
+        request_close = False
+        while not request_close:
+            request_close = engine.update(
+                event_manager, input_controller, behaviour_manager,
+                system_manager, process_manager, delta_time, None)
+        seconds = perf_counter() - start
+        for system in system_manager.systems:
+            system.unregister()
+        return {'ticks': event_manager.tick, 'events': len(self.replayed),
+                'seconds': seconds, 'diverged': self.diverged_tick()}
+
+    def diverged_tick(self):
+        """Get the first tick in which the replayed events differ from the
+        recorded ones or None if they are equal."""
+        for index, (tick, name, root, data) in enumerate(self.records):
+            if index >= len(self.replayed) or \
+                    self.replayed[index] != (tick, name, data):
+                return tick
+        if len(self.replayed) > len(self.records):
+            return self.replayed[len(self.records)][0]
+        return None
+
+    def _compare(self, event_manager):
+        throw = event_manager.throw
+
+        def comparing_throw(event):
+            self.replayed.append((event_manager.tick,
+                                  type_name(event.identifier),
+                                  payload(event)))
+            throw(event)
+        event_manager.throw = comparing_throw
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replays a recorded Nightcaste session headless.')
+    parser.add_argument('log_file', help='event log written by the recorder')
+    parser.add_argument('--config', default='config/nightcaste.json',
+                        help='game configuration')
+    args = parser.parse_args(argv)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.init()
+    result = Replayer(args.log_file, args.config).run()
+    pygame.quit()
+    print('Replayed %(ticks)d ticks with %(events)d events in %(seconds).2fs'
+          % result)
+    if result['diverged'] is not None:
+        print('Replay diverged from the log in tick %d' % result['diverged'])
+        return 1
+    return 0
@@ -0,0 +1,8 @@
+import pytest
+from nightcaste.entities import EntityManager
+from nightcaste.tiles import TileTypes
+
+
+@pytest.fixture
+def tile_types():
+    return TileTypes(EntityManager().blueprint_manager)
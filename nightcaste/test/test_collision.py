@@ -1,5 +1,15 @@
+import numpy
+import pytest
+import random
 from pygame import Rect
 from nightcaste.collision import QuadTree
+from nightcaste.collision import SpatialHashCollisionManager
+from nightcaste.collision import TileCollisionMap
+from nightcaste.collision import create_collision_manager
+from nightcaste.collision import sweep_and_prune
+from nightcaste.collision import sweep_rect
+from nightcaste.components import Colliding
+from nightcaste.tiles import ChunkedTiles
 
 
 class TestQuadTree:
@@ -41,3 +51,249 @@ class TestQuadTree:
         collisions = {}
         qtree.retrieve(collisions, collidable)
         assert collisions == {4: Rect(35, 80, 10, 10)}
+
+
+class TestSpatialHashCollisionManager:
+
+    def test_collide_rect(self):
+        manager = SpatialHashCollisionManager(32)
+        manager.fill(Rect(0, 0, 100, 100), {
+            'wall': Rect(32, 0, 32, 32),
+            'big': Rect(0, 40, 90, 50),
+            'player': Rect(10, 10, 20, 20)})
+        assert manager.collide_rect('player', Rect(20, 10, 20, 20)) == [
+            'wall']
+        assert sorted(manager.collide_rect('player', Rect(20, 20, 40, 40))) \
+            == ['big', 'wall']
+        assert manager.collide_rect('player', Rect(0, 0, 10, 10)) == []
+
+    def test_move(self):
+        manager = SpatialHashCollisionManager(32)
+        player = Rect(10, 10, 20, 20)
+        manager.fill(None, {'wall': Rect(96, 96, 32, 32), 'player': player})
+        player.move_ip(90, 90)
+        manager.move('player')
+        assert manager.collide_rect('wall', manager.objects['wall'][0]) == [
+            'player']
+        player.move_ip(-90, -90)
+        manager.move('player')
+        assert manager.collide_rect('wall', Rect(96, 96, 32, 32)) == []
+        assert manager.remove('player')
+        assert not manager.remove('player')
+        assert list(manager.cells) == [(3, 3)]
+
+    def test_create_collision_manager(self):
+        manager = create_collision_manager({
+            'impl': ['nightcaste.collision', 'SpatialHashCollisionManager'],
+            'config': {'cell_size': 16}})
+        assert manager.cell_size == 16
+
+
+class TestTileCollisionMap:
+
+    def test_collides(self, tile_types):
+        wall = tile_types.get_id('stone_wall')
+        floor = tile_types.get_id('stone_floor')
+        tiles = numpy.full((4, 3), floor, dtype=numpy.uint8)
+        tiles[2, 1] = wall
+        tile_map = TileCollisionMap(tiles, tile_types, 32)
+        assert tile_map.is_blocked(2, 1)
+        assert not tile_map.is_blocked(1, 1)
+        assert not tile_map.is_blocked(9, 9)
+        assert tile_map.collides(Rect(60, 60, 8, 8))
+        assert not tile_map.collides(Rect(60, 10, 4, 4))
+        assert not tile_map.collides(Rect(-40, -40, 8, 8))
+
+    def test_streamed_tiles(self, tile_types):
+        wall = tile_types.get_id('stone_wall')
+        floor = tile_types.get_id('stone_floor')
+
+        def create_chunk(x, y, w, h):
+            return numpy.full((w, h), wall if x >= 32 else floor,
+                              dtype=numpy.uint8)
+        tiles = ChunkedTiles(64, 64, create_chunk, 32, 1)
+        tile_map = TileCollisionMap(tiles, tile_types, 32)
+        assert not tile_map.collides(Rect(0, 0, 32 * 32, 32))
+        assert tile_map.collides(Rect(31 * 32, 0, 64, 32))
+        assert tile_map.is_blocked(40, 40)
+
+
+def tree_structure(node):
+    """The entities of the node and its subnodes as nested tuples."""
+    return (sorted(node.entites), None if node.nodes is None else
+            [tree_structure(subnode) for subnode in node.nodes])
+
+
+class TestQTreeBulkLoad:
+
+    def assert_same_tree(self, rects, max_entites=2, max_level=8):
+        bounds = Rect(0, 0, 100, 100)
+        bulk = QuadTree.bulk_load(bounds, rects, max_entites, max_level)
+        inserted = QuadTree(bounds, max_entites, max_level)
+        for entity, rect in rects.items():
+            inserted.insert(entity, rect)
+        assert tree_structure(bulk.q_tree_root) == tree_structure(
+            inserted.q_tree_root)
+        assert bulk.q_tree_root.height() <= max_level
+
+    def test_same_tree_as_inserts(self):
+        rng = random.Random(3)
+        self.assert_same_tree(dict(
+            (index, Rect(rng.randrange(100), rng.randrange(100), 6, 6))
+            for index in range(300)))
+        # Out of bounds
+        self.assert_same_tree(dict(
+            (index, Rect(5000, -100, 1, 1)) for index in range(100)))
+        # Stacked
+        self.assert_same_tree(dict(
+            (index, Rect(20, 20, 4, 4)) for index in range(100)))
+        self.assert_same_tree(dict(
+            (index, Rect(20, 20, 4, 4)) for index in range(100)), 80, 3)
+
+    def test_bulk_load(self):
+        rects = dict((index, Rect((index % 10) * 10, (index // 10) * 10, 8, 8))
+                     for index in range(100))
+        bulk = QuadTree.bulk_load(Rect(0, 0, 100, 100), rects)
+        inserted = QuadTree(Rect(0, 0, 100, 100))
+        for entity, rect in rects.items():
+            inserted.insert(entity, rect)
+        assert bulk.count() == inserted.count() == 100
+        assert bulk.q_tree_root.count() == 100
+        query = Rect(15, 15, 20, 20)
+        assert sorted(bulk.retrieve(query)) == sorted(
+            inserted.retrieve(query)) == [11, 12, 13, 21, 22, 23, 31, 32, 33]
+
+    def test_move_between_nodes(self):
+        rects = dict((index, Rect((index % 10) * 10, (index // 10) * 10, 8, 8))
+                     for index in range(100))
+        qtree = QuadTree.bulk_load(Rect(0, 0, 100, 100), rects)
+        rects[0].topleft = (91, 91)
+        qtree.move(0)
+        assert 0 in qtree.retrieve(Rect(90, 90, 4, 4))
+        assert 0 not in qtree.retrieve(Rect(0, 0, 4, 4))
+        assert qtree.q_tree_root.count() == 100
+        rects[0].topleft = (200, 200)
+        qtree.move(0)
+        assert qtree.retrieve(Rect(199, 199, 4, 4)) == [0]
+        assert qtree.remove(0)
+        assert qtree.q_tree_root.count() == 99
+
+
+class TestSweepAndPrune:
+
+    def test_collide_pairs(self):
+        rng = random.Random(3)
+        rects = dict((index, Rect(rng.randrange(200), rng.randrange(200),
+                                  rng.randrange(1, 30), rng.randrange(1, 30)))
+                     for index in range(100))
+        expected = set((a, b) for a in rects for b in rects
+                       if a < b and rects[a].colliderect(rects[b]))
+        pairs = sweep_and_prune(rects.items())
+        assert len(pairs) == len(expected)
+        assert set(tuple(sorted(pair)) for pair in pairs) == expected
+
+        for manager in (SpatialHashCollisionManager(32),
+                        create_collision_manager()):
+            manager.fill(Rect(0, 0, 256, 256), rects)
+            assert set(tuple(sorted(pair))
+                       for pair in manager.collide_pairs()) == expected
+
+    def test_touching_rects_do_not_collide(self):
+        assert sweep_and_prune([(0, Rect(0, 0, 32, 32)),
+                                (1, Rect(32, 0, 32, 32)),
+                                (2, Rect(0, 32, 32, 32))]) == []
+
+
+class TestSweep:
+
+    def test_sweep_rect(self):
+        wall = Rect(20, 0, 10, 10)
+        assert sweep_rect(Rect(0, 0, 10, 10), 20, 0, wall) == (0.5, (-1, 0))
+        assert sweep_rect(Rect(40, 0, 10, 10), -20, 0, wall) == (0.5, (1, 0))
+        assert sweep_rect(Rect(0, 0, 10, 10), 5, 0, wall) is None
+        # Touching and overlapping rects do not block the movement
+        assert sweep_rect(Rect(0, 10, 10, 10), 30, 0, wall) is None
+        assert sweep_rect(Rect(15, 5, 10, 10), 10, 0, wall) is None
+        # Large steps do not tunnel through thin rects
+        time, normal = sweep_rect(Rect(0, -20, 4, 4), 0, 100, Rect(0, 0, 4, 1))
+        assert time == pytest.approx(0.16) and normal == (0, -1)
+
+    def test_sweep_manager_and_tiles(self, tile_types):
+        wall = tile_types.get_id('stone_wall')
+        floor = tile_types.get_id('stone_floor')
+        tiles = numpy.full((4, 4), floor, dtype=numpy.uint8)
+        tiles[3, :] = wall
+        manager = SpatialHashCollisionManager(32)
+        manager.set_tiles(TileCollisionMap(tiles, tile_types, 32))
+        mover = Rect(10, 10, 8, 8)
+        manager.fill(Rect(0, 0, 128, 128), {0: mover, 1: Rect(10, 50, 8, 8)})
+        assert manager.sweep(0, mover, 0, 64) == (0.5, (0, -1), 1)
+        assert manager.sweep(0, mover, 100, 0) == (0.78, (-1, 0), (3, 0))
+        assert manager.sweep(0, mover, 20, 0) is None
+
+    def test_sweep_non_blocking(self):
+        manager = SpatialHashCollisionManager(32)
+        mover = Rect(0, 0, 8, 8)
+        stairs = Colliding(blocking=False)
+        stairs.update(20, 0, 32, 32)
+        wall = Colliding()
+        wall.update(60, 0, 32, 32)
+        manager.fill(Rect(0, 0, 128, 128), {0: mover, 1: stairs, 2: wall})
+        assert manager.sweep(0, mover, 104, 0) == (0.5, (-1, 0), 2)
+
+
+class TestRaycast:
+
+    @pytest.fixture
+    def tile_map(self, tile_types):
+        wall = tile_types.get_id('stone_wall')
+        floor = tile_types.get_id('stone_floor')
+        tiles = numpy.full((8, 8), floor, dtype=numpy.uint8)
+        tiles[4, 0:6] = wall
+        return TileCollisionMap(tiles, tile_types, 32)
+
+    def test_raycast(self, tile_map):
+        assert tile_map.raycast(16, 16, 240, 16) == (
+            pytest.approx(112 / 224), (-1, 0), (4, 0))
+        assert tile_map.raycast(240, 80, 16, 80) == (
+            pytest.approx(80 / 224), (1, 0), (4, 2))
+        assert tile_map.raycast(16, 16, 16, 240) is None
+        # The ray passes below the wall and leaves the map
+        assert tile_map.raycast(16, 208, 400, 208) is None
+        assert tile_map.raycast(144, 16, 200, 16) == (0, (0, 0), (4, 0))
+
+    def test_line_of_sight(self, tile_map):
+        assert not tile_map.line_of_sight(16, 16, 240, 16)
+        assert tile_map.line_of_sight(16, 16, 144, 16)
+        assert tile_map.line_of_sight(16, 200, 240, 230)
+        assert not tile_map.line_of_sight(16, 16, 240, 200)
+
+    def test_visible_from(self, tile_map):
+        rng = random.Random(5)
+        targets = [(rng.uniform(-64, 320), rng.uniform(-64, 320))
+                   for _ in range(200)]
+        visible = tile_map.visible_from(48, 100, targets)
+        assert visible.tolist() == [tile_map.line_of_sight(48, 100, x, y)
+                                    for x, y in targets]
+        assert 0 < visible.sum() < len(targets)
+        assert tile_map.visible_from(48, 100, []).tolist() == []
+
+    def test_outside_of_map(self, tile_map):
+        assert tile_map.window(-9, 0, -2, 4).shape == (0, 4)
+        assert tile_map.window(2, 2, 12, 3).shape == (6, 1)
+        assert tile_map.visible_from(-200, 50, [(-100, 50)]).tolist() == [
+            True]
+        assert tile_map.visible_from(-200, 50, [(400, 50), (-100, 400),
+                                                (400, 400)]).tolist() == [
+            False, True, True]
+        assert tile_map.line_of_sight(-200, 50, 400, 50) is False
+        assert tile_map.raycast(-200, 50, -100, 500) is None
+
+    def test_collision_manager(self, tile_map):
+        manager = SpatialHashCollisionManager()
+        assert manager.line_of_sight(16, 16, 240, 16)
+        manager.set_tiles(tile_map)
+        assert manager.raycast(16, 16, 240, 16)[2] == (4, 0)
+        assert not manager.line_of_sight(16, 16, 240, 16)
+        assert manager.visible_from(16, 16, [(240, 16), (16, 240)]).tolist() \
+            == [False, True]
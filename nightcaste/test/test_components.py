@@ -1,7 +1,11 @@
 """Tests for base component functionality."""
 
+import pytest
+from nightcaste.components import Colliding
 from nightcaste.components import Component
 from nightcaste.components import Position
+from nightcaste.components import Sprite
+from nightcaste.components import is_attribute
 
 
 def test_type():
@@ -11,3 +15,32 @@ def test_type():
 
     assert component.type() == 'Component'
     assert position.type() == 'Position'
+
+
+def test_slots():
+    """Tests if components reject unknown attributes"""
+    position = Position(42, 3)
+    assert not hasattr(position, '__dict__')
+    with pytest.raises(AttributeError):
+        position.movement_speed = 4
+    assert str(position) == 'Position (x_frac: 42, y_frac: 3)'
+
+
+def test_is_attribute():
+    """Tests if only slots and settable properties are attributes"""
+    assert is_attribute(Position, 'x_frac')
+    assert is_attribute(Position, 'x')
+    assert is_attribute(Colliding, 'blocking')
+    assert is_attribute(Colliding, 'w')
+    assert not is_attribute(Position, 'move')
+    assert not is_attribute(Position, 'columns')
+    assert not is_attribute(Colliding, 'movement_speed')
+
+
+def test_hide_sprite():
+    """Tests if hiding a sprite marks it dirty"""
+    sprite = Sprite('player')
+    sprite.dirty = 0
+    sprite.visible = 0
+    assert not sprite.visible
+    assert sprite.dirty == 1
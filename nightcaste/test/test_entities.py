@@ -1,7 +1,12 @@
+import numpy
 import pytest
+from nightcaste.entities import BlueprintManager
 from nightcaste.entities import EntityManager
 from nightcaste.entities import EntityConfiguration
 from nightcaste.entities import ComponentManager
+from nightcaste.entities import ComponentColumns
+from nightcaste.entities import entity_generation
+from nightcaste.entities import entity_index
 import nightcaste.components as components
 
 
@@ -34,6 +39,20 @@ class TestEntityManager:
         assert entity2 is not None
         assert entity1 != entity2
 
+    def test_recycle_entity(self, entity_manager, simple_config):
+        entity = entity_manager.new_from_config(simple_config)
+        assert entity_manager.is_alive(entity)
+        entity_manager.destroy_entity(entity)
+        assert not entity_manager.is_alive(entity)
+
+        recycled = entity_manager.create_entity()
+        assert recycled != entity
+        assert entity_index(recycled) == entity_index(entity)
+        assert entity_generation(recycled) == entity_generation(entity) + 1
+        assert entity_manager.is_alive(recycled)
+        assert not entity_manager.is_alive(entity)
+        assert entity_manager.get(entity, 'Position') is None
+
     def test_new_from_config(
             self, entity_manager, simple_config):
         entity = entity_manager.new_from_config(simple_config)
@@ -70,6 +89,15 @@ class TestEntityManager:
         assert sprite.name == 'player'
         assert sprite.z_index == 9
 
+    def test_blueprint_is_not_changed(self, entity_manager):
+        config = EntityConfiguration()
+        config.add_attribute('Position', 'x', 42)
+        config.add_attribute('Color', 'r', 1)
+        entity_manager.new_from_blueprint_and_config('game.player', config)
+        player = entity_manager.new_from_blueprint('game.player')
+        assert entity_manager.get(player, 'Position').x == 0
+        assert entity_manager.get(player, 'Color').r == 239
+
     def test_destroy_entity(self, entity_manager, simple_config):
         entity = entity_manager.new_from_config(simple_config)
         entity_manager.destroy_entity(entity)
@@ -103,6 +131,27 @@ class TestEntityManager:
             positions, 'Sprite')
         assert renderables[entity].name == 'player'
 
+    def test_query(self, entity_manager, simple_config):
+        entity = entity_manager.new_from_config(simple_config)
+        query = entity_manager.query('Position', 'Sprite')
+        rows = [row for row in query if row[0] == entity]
+        assert len(rows) == 1
+        assert rows[0][1].x == 42
+        assert rows[0][2].name == 'player'
+        assert entity_manager.query('Position', 'Sprite') is query
+
+    def test_query_is_updated(self, entity_manager, simple_config):
+        query = entity_manager.query('Position', 'Sprite')
+        entity = entity_manager.new_from_config(simple_config)
+        assert entity in query
+        entity_manager.component_manager.remove_component(entity, 'Sprite')
+        assert entity not in query
+        entity_manager.component_manager.add_component(
+            entity, components.Sprite('player'))
+        assert entity in query
+        entity_manager.destroy_entity(entity)
+        assert entity not in query
+
 
 class TestComponentManager:
 
@@ -162,6 +211,113 @@ class TestComponentManager:
         assert component_manager.get_component(5, component1.type()) is None
         assert component_manager.get_component(5, component2.type()) is None
 
+    def test_store_columnar(self, component_manager):
+        """Tests if existing components are moved into the columns."""
+        component_manager.add_component(6, components.Position(3, 4))
+        component_manager.store_columnar('Position')
+        assert isinstance(
+            component_manager.components['Position'], ComponentColumns)
+        position = component_manager.get_component(6, 'Position')
+        assert position.type() == 'Position'
+        assert (position.x, position.y) == (3, 4)
+
+    def test_archetypes(self, component_manager):
+        """Tests if entities are moved between the archetype tables."""
+        component_manager.add_component(8, components.Position())
+        component_manager.add_component(9, components.Position())
+        component_manager.add_component(9, components.Color())
+        archetype = component_manager.get_archetype(9)
+        assert archetype.component_types == ('Color', 'Position')
+        assert component_manager.get_archetype(8) is not archetype
+
+        component_manager.remove_component(9, 'Color')
+        assert component_manager.get_archetype(9) is \
+            component_manager.get_archetype(8)
+        assert len(archetype) == 0
+
+        component_manager.remove_components(8)
+        assert component_manager.get_archetype(8) is None
+        assert component_manager.get_component(8, 'Position') is None
+        assert component_manager.get_component(9, 'Position') is not None
+
+
+class TestComponentColumns:
+
+    def test_proxy(self):
+        columns = ComponentColumns(components.Position)
+        columns[7] = components.Position(1, 2)
+        position = columns[7]
+        assert isinstance(position, components.Position)
+        position.move(1.5, -0.5)
+        assert (position.x, position.y) == (2, 1)
+        assert columns.column('x_frac')[0] == 2.5
+        assert 7 in columns and 8 not in columns
+        assert columns.get(8) is None
+
+    def test_bulk_update(self):
+        columns = ComponentColumns(components.Position, capacity=2)
+        for entity in range(5):
+            columns[entity] = components.Position(entity, 0)
+        columns.column('y_frac')[:] += 10
+        assert len(columns) == 5
+        assert [p.y for p in columns.values()] == [10] * 5
+
+    def test_bulk_update_equals_move(self):
+        """Tests if a vectorized update of the columns equals moving every
+        component on its own."""
+        columns = ComponentColumns(components.Position)
+        positions = {}
+        for entity in range(20):
+            columns[entity] = components.Position(entity * 3 - 30, -entity)
+            positions[entity] = components.Position(entity * 3 - 30, -entity)
+        dx = numpy.linspace(-2.5, 2.5, 20)
+        dy = numpy.linspace(1.75, -1.75, 20)
+        for entity, position in positions.items():
+            position.move(dx[entity], dy[entity])
+        rows = [columns.slots[entity] for entity in range(20)]
+        columns.column('x_frac')[rows] += dx
+        columns.column('y_frac')[rows] += dy
+        for entity, position in positions.items():
+            proxy = columns[entity]
+            assert (proxy.x, proxy.y) == (position.x, position.y)
+            assert (proxy.x_frac, proxy.y_frac) == (position.x_frac,
+                                                    position.y_frac)
+
+    def test_pop(self):
+        columns = ComponentColumns(components.Position)
+        columns[1] = components.Position(1, 1)
+        columns[2] = components.Position(2, 2)
+        columns[3] = components.Position(3, 3)
+        removed = columns.pop(1)
+        assert removed.x == 1
+        assert 1 not in columns
+        assert columns.pop(1) is None
+        assert columns[3].x == 3
+        assert columns[2].x == 2
+        assert list(columns.entity_ids()) == [3, 2]
+
+
+class TestBlueprintManager:
+
+    def test_reject_unknown_attribute(self):
+        blueprint_manager = BlueprintManager()
+        blueprint = {
+            'components': ['Position'],
+            'attributes': {'Position.movement_speed': 4}}
+        with pytest.raises(AttributeError):
+            blueprint_manager._create_entity_config(blueprint)
+
+    def test_reject_method(self):
+        blueprint_manager = BlueprintManager()
+        blueprint = {
+            'components': ['Position'],
+            'attributes': {'Position.move': 4}}
+        with pytest.raises(AttributeError):
+            blueprint_manager._create_entity_config(blueprint)
+        blueprint['attributes'] = {'Position.x': 4}
+        config = blueprint_manager._create_entity_config(blueprint)
+        assert config.get_attributes('Position') == {'x': 4}
+
 
 class TestEntityConfiguration:
 
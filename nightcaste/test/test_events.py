@@ -1,10 +1,22 @@
 """Tests events. Propably not mutch to do here since events are mostly simple
 data transfer objects"""
+import json
 import pytest
+from nightcaste.components import Position
 from nightcaste.entities import EntityManager
+from nightcaste.events import DropDuplicates
 from nightcaste.events import Event
 from nightcaste.events import EventManager
+from nightcaste.events import GameAction
+from nightcaste.events import GameEvent
+from nightcaste.events import InputEvent
+from nightcaste.events import KeepLastPerEntity
+from nightcaste.events import PRIORITY_LOW
 from nightcaste.processors import EventProcessor
+from nightcaste.recording import EventRecorder
+from nightcaste.recording import read_log
+from threading import Thread
+from time import sleep
 
 
 @pytest.fixture
@@ -24,15 +36,26 @@ class TestEvent:
         event = Event("Event")
         assert event.identifier == 'Event'
 
+    def test_payload(self, event_manager):
+        """Tests if game events only accept the attributes of their payload"""
+        event = event_manager.create(GameAction.MapChange, {'name': 'world'})
+        assert event.name == 'world'
+        assert event.level is None
+        assert event.get('type', 'dungeon') == 'dungeon'
+        with pytest.raises(AttributeError):
+            event.unknown = 1
+        generic = event_manager.create('Event', {'unknown': 1})
+        assert generic.get('unknown') == 1
+
 
 class TestEventManager:
     """Test the event manager functionality."""
 
     def test_enque_event(self, event_manager):
         """Check if the number of events increases if an event is enqueued."""
-        qsize_before = event_manager.events.qsize()
+        qsize_before = event_manager.pending()
         event_manager.throw_new('Event')
-        qsize_after = event_manager.events.qsize()
+        qsize_after = event_manager.pending()
 
         assert qsize_after == qsize_before + 1
 
@@ -76,4 +99,246 @@ class TestEventManager:
         event_manager.throw_new(event_type)
         event_manager.throw_new(event_type)
         assert event_manager.process_events() > 0
-        assert event_manager.events.empty()
+        assert event_manager.pending() == 0
+
+    def test_process_events_of_other_threads(self, event_manager):
+        """Checks if events of registered producers in other threads are
+        processed."""
+        event_type = 'TestProcessThreadsafe'
+        processed = []
+        event_manager.register_listener(event_type, processed.append)
+        event_manager.register_producer()
+        producer = Thread(target=lambda: [
+            event_manager.throw_threadsafe(event_manager.create(event_type))
+            for i in range(100)])
+        producer.start()
+        producer.join()
+        event_manager.throw_new(event_type)
+        assert event_manager.pending() == 101
+        assert event_manager.process_events() == 101
+        assert len(processed) == 101
+        assert event_manager.pending() == 0
+
+    def test_reuse_processed_events(self, event_manager):
+        """Checks if processed events are reused with a cleared payload."""
+        event = event_manager.create(GameEvent.EntityMoved, {'entity': 1})
+        event_manager.throw(event)
+        event_manager.process_events()
+        reused = event_manager.create(GameEvent.EntityMoved)
+        assert reused is event
+        assert reused.entity is None
+        assert event_manager.create(GameEvent.EntityMoved) is not event
+
+
+class TestCoalescing:
+
+    def test_keep_last_per_entity(self):
+        event_manager = EventManager(
+            {'coalesce': {'GameEvent.EntityMoved': 'keep_last'}})
+        processed = []
+        event_manager.register_listener(
+            GameEvent.EntityMoved, lambda event: processed.append(event.entity))
+        for entity in (1, 2, 1, 1, 2, 3):
+            event_manager.throw_new(GameEvent.EntityMoved, {'entity': entity})
+        assert event_manager.pending() == 3
+        event_manager.process_events()
+        assert processed == [1, 2, 3]
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 1})
+        assert event_manager.pending() == 1
+
+    def test_no_coalescing_with_processed_events(self):
+        event_manager = EventManager()
+        event_manager.set_coalescing(GameEvent.EntityMoved,
+                                     KeepLastPerEntity())
+        processed = []
+
+        def on_entity_moved(event):
+            processed.append(event.entity)
+            if len(processed) == 1:
+                event_manager.throw_new(GameEvent.EntityMoved, {'entity': 1})
+        event_manager.register_listener(GameEvent.EntityMoved,
+                                        on_entity_moved)
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 1})
+        event_manager.process_events()
+        assert processed == [1, 1]
+
+    def test_drop_duplicates(self):
+        event_manager = EventManager()
+        event_manager.set_coalescing(GameAction.MapChange, DropDuplicates())
+        event_manager.throw_new(GameAction.MapChange, {'name': 'a'})
+        event_manager.throw_new(GameAction.MapChange, {'name': 'a'})
+        event_manager.throw_new(GameAction.MapChange, {'name': 'b'})
+        assert event_manager.pending() == 2
+
+    def test_merge(self):
+        event_manager = EventManager(
+            {'coalesce': {'GameAction.MoveAction': 'merge'}})
+        processed = []
+        event_manager.register_listener(
+            GameAction.MoveAction,
+            lambda event: processed.append((event.entity, event.dx, event.dy)))
+        event_manager.throw_new(GameAction.MoveAction,
+                                {'entity': 1, 'dx': 1, 'dy': 2})
+        event_manager.throw_new(GameAction.MoveAction,
+                                {'entity': 1, 'dx': 3, 'dy': -1})
+        event_manager.process_events()
+        assert processed == [(1, 4, 1)]
+
+
+class TestPriorities:
+
+    def test_process_by_priority(self):
+        event_manager = EventManager({'priorities': {
+            'InputEvent.KeyPressed': 'high', 'GameEvent.EntityMoved': 'low'}})
+        processed = []
+
+        def on_event(event):
+            processed.append(event.identifier)
+            if event.identifier == GameAction.WorldEnter:
+                event_manager.throw_new(InputEvent.KeyPressed)
+        for event_type in (GameEvent.EntityMoved, GameAction.WorldEnter,
+                           InputEvent.KeyPressed, GameAction.MapChange):
+            event_manager.register_listener(event_type, on_event)
+            event_manager.throw_new(event_type)
+        event_manager.process_events()
+        assert processed == [InputEvent.KeyPressed, GameAction.WorldEnter,
+                             InputEvent.KeyPressed, GameAction.MapChange,
+                             GameEvent.EntityMoved]
+
+    def test_defer_low_priority_events(self):
+        event_manager = EventManager()
+        event_manager.set_priority(GameEvent.EntityMoved, PRIORITY_LOW)
+        event_manager.throw_new(GameEvent.EntityMoved)
+        event_manager.throw_new(GameAction.MapChange)
+        event_manager.begin_tick(-1)
+        assert event_manager.process_events() == 1
+        assert event_manager.pending() == 1
+        event_manager.begin_tick(1)
+        assert event_manager.process_events() == 1
+
+
+class TestProfiling:
+
+    def test_profile_listeners(self, event_manager, tmpdir):
+        processed = []
+        event_manager.register_listener(GameEvent.EntityMoved,
+                                        processed.append)
+        profiler = event_manager.enable_profiling()
+        event_manager.begin_tick(1)
+        event_manager.throw_new(GameEvent.EntityMoved)
+        event_manager.throw_new(GameEvent.EntityMoved)
+        event_manager.throw_new(GameAction.MapChange)
+        event_manager.process_events()
+        assert len(processed) == 2
+        summary = profiler.summary()
+        assert summary['events'] == {str(GameEvent.EntityMoved): 2,
+                                     str(GameAction.MapChange): 1}
+        assert summary['listeners'][0]['calls'] == 2
+        assert summary['ticks'] == 1
+
+        trace_file = str(tmpdir.join('trace.json'))
+        profiler.write_trace(trace_file)
+        with open(trace_file) as f:
+            trace = json.load(f)
+        assert len([e for e in trace['traceEvents'] if e['ph'] == 'X']) == 2
+
+        assert event_manager.disable_profiling() is profiler
+        event_manager.throw_new(GameEvent.EntityMoved)
+        event_manager.process_events()
+        assert len(processed) == 3
+        assert profiler.summary()['listeners'][0]['calls'] == 2
+
+
+class TestRecording:
+
+    def test_record_events(self, event_manager, tmpdir):
+        log_file = str(tmpdir.join('session.log'))
+        recorder = event_manager.start_recording(EventRecorder(log_file, 7))
+        event_manager.throw_new(GameAction.WorldEnter)
+        event_manager.begin_tick(1)
+        event_manager.throw_new(InputEvent.KeyPressed, {'keycode': 13})
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 3})
+        event_manager.process_events()
+        assert event_manager.stop_recording() is recorder
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 4})
+        recorder.close()
+
+        header, records = read_log(log_file)
+        assert header['seed'] == 7
+        assert records == [
+            (0, 'GameAction.WorldEnter', True, {}),
+            (1, 'InputEvent.KeyPressed', True, {'keycode': 13}),
+            (1, 'GameEvent.EntityMoved', False, {'entity': 3})]
+
+    def test_replay_deferrals(self, tmpdir):
+        log_file = str(tmpdir.join('session.log'))
+
+        def run(event_manager, budget):
+            processed = []
+
+            def on_entity_moved(event):
+                processed.append((event_manager.tick, event.entity))
+                if event.entity == 1 and budget is not None:
+                    # The budget of the tick runs out
+                    sleep(budget * 2)
+            event_manager.set_priority(GameEvent.EntityMoved, PRIORITY_LOW)
+            event_manager.register_listener(GameEvent.EntityMoved,
+                                            on_entity_moved)
+            for tick in range(2):
+                event_manager.begin_tick(budget)
+                for entity in range(tick * 3, tick * 3 + 3):
+                    event_manager.throw_new(GameEvent.EntityMoved,
+                                            {'entity': entity})
+                event_manager.process_events()
+            return processed
+
+        recorded_manager = EventManager()
+        recorded_manager.start_recording(EventRecorder(log_file, 7))
+        recorded = run(recorded_manager, 0.02)
+        recorded_manager.stop_recording().close()
+        assert recorded[:3] == [(1, 0), (1, 1), (2, 2)]
+
+        header, records = read_log(log_file)
+        assert header['deferrals'] == {(1, 1): 2}
+        assert len(records) == 6
+        replay_manager = EventManager()
+        replay_manager.deferrals = header['deferrals']
+        assert run(replay_manager, None) == recorded
+
+
+class TestScopedListeners:
+
+    def test_entity_listener(self, event_manager):
+        processed = []
+        event_manager.register_listener(GameEvent.EntityMoved,
+                                        processed.append, entity=1)
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 1})
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 2})
+        event_manager.throw_new(GameEvent.EntityMoved)
+        event_manager.process_events()
+        assert len(processed) == 1
+        event_manager.remove_listener(GameEvent.EntityMoved,
+                                      processed.append, entity=1)
+        assert event_manager.entity_listeners[GameEvent.EntityMoved] == {}
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': 1})
+        event_manager.process_events()
+        assert len(processed) == 1
+
+    def test_query_listener(self, event_manager, entity_manager):
+        processed = []
+
+        def on_entity_moved(event):
+            processed.append(event.entity)
+        positioned = entity_manager.query('Position')
+        entity = entity_manager.create_entity()
+        entity_manager.component_manager.add_component(entity, Position())
+        event_manager.register_listener(GameEvent.EntityMoved,
+                                        on_entity_moved, query=positioned)
+        event_manager.throw_new(GameEvent.EntityMoved, {'entity': entity})
+        event_manager.throw_new(GameEvent.EntityMoved,
+                                {'entity': entity_manager.create_entity()})
+        event_manager.process_events()
+        assert processed == [entity]
+        event_manager.remove_listener(GameEvent.EntityMoved,
+                                      on_entity_moved, query=positioned)
+        assert event_manager.query_listeners[GameEvent.EntityMoved] == []
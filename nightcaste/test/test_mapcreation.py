@@ -0,0 +1,168 @@
+import numpy
+import pytest
+from nightcaste.entities import EntityManager
+from nightcaste.mapcreation import DungeonGenerator
+from nightcaste.mapcreation import MapCache
+from nightcaste.mapcreation import MapManager
+from nightcaste.mapcreation import WorldspaceGenerator
+
+
+@pytest.fixture
+def entity_manager():
+    return EntityManager()
+
+
+def flood_fill(floor, start):
+    reached = numpy.zeros(floor.shape, dtype=bool)
+    stack = [start]
+    while stack:
+        x, y = stack.pop()
+        if reached[x, y] or not floor[x, y]:
+            continue
+        reached[x, y] = True
+        stack.extend(((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)))
+    return reached
+
+
+class TestDungeonGenerator:
+
+    def test_layout_is_connected(self, entity_manager):
+        generator = DungeonGenerator(entity_manager)
+        layout = generator.generate_layout('Dungeon', 1)
+        floor = ~generator.tile_types.blocking[layout.tiles]
+        assert numpy.array_equal(floor, generator.floor)
+        for room in generator.rooms:
+            assert floor[room.x + 1:room.x + room.width + 1,
+                         room.y + 1:room.y + room.height + 1].all()
+        start = tuple(numpy.argwhere(floor)[0])
+        assert numpy.array_equal(flood_fill(floor, start), floor)
+
+    def test_layout_is_reproducible(self, entity_manager):
+        generator = DungeonGenerator(entity_manager)
+        layout = generator.generate_layout('Dungeon', 1, 42)
+        other = generator.generate_layout('Dungeon', 1, 43)
+        same = DungeonGenerator(entity_manager).generate_layout(
+            'Dungeon', 1, 42)
+        assert numpy.array_equal(layout.tiles, same.tiles)
+        assert layout.entry == same.entry
+        assert not numpy.array_equal(layout.tiles, other.tiles)
+
+    def test_layout_creates_no_entities(self, entity_manager):
+        generator = DungeonGenerator(entity_manager)
+        generator.generate_layout('Dungeon', 1)
+        assert entity_manager.generations == []
+
+
+class TestWorldspaceGenerator:
+
+    def test_generate_map(self, entity_manager):
+        generator = WorldspaceGenerator(entity_manager)
+        map_entity = generator.generate_map('World', 0)
+        map_component = entity_manager.get(map_entity, 'Map')
+        assert map_component.tiles.dtype == numpy.uint8
+        assert len(map_component.entities) == 1
+        stairs = map_component.entities[0]
+        assert entity_manager.get(stairs, 'MapTransition') is not None
+        assert not generator.is_blocked(25, 25)
+        assert generator.is_blocked(map_component.tiles.shape[0] - 1, 5)
+
+    def test_chunks_are_reproducible(self, entity_manager):
+        generator = WorldspaceGenerator(entity_manager)
+        generator.configure({'size': [300, 200], 'chunk_size': 16,
+                             'resident_chunks': 2})
+        tiles = generator.generate_layout('World', 0, 3).tiles
+        assert tiles.shape == (300, 200)
+        window = tiles[0:40, 180:200]
+        tiles[200:240, 0:40]
+        assert len(tiles.chunks) == 2
+        assert numpy.array_equal(tiles[0:40, 180:200], window)
+        assert generator.tile_types.blocking[window[10, 19]]
+        assert not generator.tile_types.blocking[window[10, 18]]
+
+
+class TestMapManager:
+
+    def test_get_map_is_stored(self, entity_manager):
+        map_manager = MapManager(entity_manager)
+        world = map_manager.get_map('world', 0, 'world')
+        assert map_manager.get_map('world', 0, 'world') == world
+        assert map_manager.get_map(None, 0) != world
+        assert map_manager.get_map(None, 0) == map_manager.get_map(
+            map_manager.random_name(), 0)
+
+    def test_map_seed(self, entity_manager):
+        map_manager = MapManager(entity_manager, {'world_seed': 1})
+        seed = map_manager.map_seed('Dungeon', 1)
+        assert seed == map_manager.map_seed('Dungeon', 1)
+        assert seed != map_manager.map_seed('Dungeon', 2)
+        assert seed != MapManager(entity_manager, {'world_seed': 2}).map_seed(
+            'Dungeon', 1)
+
+    def test_cache(self, entity_manager, tmpdir):
+        config = {'world_seed': 1, 'cache_dir': str(tmpdir)}
+        map_manager = MapManager(entity_manager, config)
+        dungeon = entity_manager.get(map_manager.get_map('Dungeon', 1), 'Map')
+        assert map_manager.map_seed('Dungeon', 1) in map_manager.cache
+
+        other_manager = MapManager(entity_manager, config)
+        # Register the tile types in another order than the cached map
+        other_manager.tile_types.get_ids('stone_wall')
+        other_manager.generators['dungeon'].generate_layout = None
+        cached = entity_manager.get(other_manager.get_map('Dungeon', 1), 'Map')
+        assert cached.entry == dungeon.entry
+        assert [other_manager.tile_types.names[tile_id]
+                for tile_id in cached.tiles.flat] == [
+            map_manager.tile_types.names[tile_id]
+            for tile_id in dungeon.tiles.flat]
+
+    def test_cache_without_world_seed(self, entity_manager, tmpdir):
+        config = {'cache_dir': str(tmpdir)}
+        map_manager = MapManager(entity_manager, config)
+        dungeon = entity_manager.get(map_manager.get_map('Dungeon', 1), 'Map')
+
+        other_manager = MapManager(entity_manager, config)
+        assert other_manager.world_seed == map_manager.world_seed
+        other_manager.generators['dungeon'].generate_layout = None
+        cached = entity_manager.get(other_manager.get_map('Dungeon', 1), 'Map')
+        assert cached.entry == dungeon.entry
+        assert numpy.array_equal(cached.tiles, dungeon.tiles)
+
+    def test_pregenerate_adjacent(self, entity_manager):
+        map_manager = MapManager(entity_manager, {'pregenerate': True})
+        # Register the tile types in another order than the worker
+        map_manager.tile_types.get_ids('stone_wall')
+        try:
+            world = map_manager.get_map('world', 0, 'world')
+            map_manager.pregenerate_adjacent(world)
+            assert list(map_manager.pending) == [
+                (map_manager.random_name(), 0)]
+            dungeon = map_manager.get_map(None, 0)
+            assert map_manager.pending == {}
+            tiles = entity_manager.get(dungeon, 'Map').tiles
+            names = set(map_manager.tile_types.names[tile_id]
+                        for tile_id in numpy.unique(tiles))
+            assert names == set(['stone_floor_0', 'stone_floor_1',
+                                 'stone_wall'])
+            map_manager.pregenerate_adjacent(dungeon)
+            assert list(map_manager.pending) == [
+                (map_manager.random_name(), 1)]
+        finally:
+            map_manager.shutdown()
+
+
+class TestMapCache:
+
+    def test_save_and_load(self, entity_manager, tmpdir):
+        cache = MapCache(str(tmpdir.join('maps')))
+        generator = DungeonGenerator(entity_manager)
+        layout = generator.generate_layout('Dungeon', 1, 7)
+        layout.stairs.append((3, 4, 'Dungeon', 2))
+        assert cache.load(7) is None
+        cache.save(7, layout, generator.tile_types.keys())
+        assert 7 in cache
+        loaded = cache.load(7)
+        assert numpy.array_equal(loaded.tiles, layout.tiles)
+        assert loaded.entry == layout.entry
+        assert loaded.stairs == layout.stairs
+        assert loaded.tile_keys == generator.tile_types.keys()
+        assert loaded.seed == 7
@@ -0,0 +1,88 @@
+import numpy
+import pytest
+from nightcaste.tiles import ChunkedTiles
+from nightcaste.tiles import TileTypes
+
+
+class TestTileTypes:
+
+    def test_get_ids(self, tile_types):
+        floor = tile_types.get_ids('stone_floor')
+        wall = tile_types.get_ids('stone_wall')
+        assert len(floor) == 2
+        assert len(wall) == 1
+        assert tile_types.get_ids('stone_floor') == floor
+        assert [tile_types.names[i] for i in floor] == [
+            'stone_floor_0', 'stone_floor_1']
+        assert len(tile_types) == 3
+
+    def test_properties(self, tile_types):
+        floor = tile_types.get_id('stone_floor')
+        wall = tile_types.get_id('stone_wall')
+        assert not tile_types.blocking[floor]
+        assert tile_types.blocking[wall]
+        assert tile_types.offset[wall] == 32
+        assert tile_types.z_index[wall] > tile_types.z_index[floor]
+
+    def test_translate(self, tile_types):
+        other = TileTypes(tile_types.blueprint_manager)
+        other.get_ids('stone_wall')
+        other.get_ids('stone_floor')
+        floor = tile_types.get_ids('stone_floor')
+        wall = tile_types.get_id('stone_wall')
+        lookup = tile_types.translate(other.keys())
+        assert list(lookup) == [wall, floor[0], floor[1]]
+
+
+@pytest.fixture
+def grid():
+    return numpy.arange(70 * 50, dtype=numpy.uint8).reshape(70, 50)
+
+
+@pytest.fixture
+def chunked_tiles(grid):
+    def create_chunk(x, y, width, height):
+        return grid[x:x + width, y:y + height].copy()
+    return ChunkedTiles(70, 50, create_chunk, chunk_size=16,
+                        resident_chunks=4)
+
+
+class TestChunkedTiles:
+
+    def test_get_cell(self, grid, chunked_tiles):
+        assert chunked_tiles[0, 0] == grid[0, 0]
+        assert chunked_tiles[69, 49] == grid[69, 49]
+        assert chunked_tiles[17, 33] == grid[17, 33]
+        with pytest.raises(IndexError):
+            chunked_tiles[70, 0]
+
+    def test_get_window(self, grid, chunked_tiles):
+        assert numpy.array_equal(chunked_tiles[10:40, 5:20], grid[10:40, 5:20])
+        assert numpy.array_equal(chunked_tiles[60:80, 45:], grid[60:80, 45:])
+        assert numpy.array_equal(chunked_tiles[3, 10:30], grid[3, 10:30])
+        assert chunked_tiles[30:20, 0:10].shape == (0, 10)
+
+    def test_evict_least_recently_used(self, grid, chunked_tiles):
+        for chunk_x in range(4):
+            chunked_tiles.chunk(chunk_x, 0)
+        chunked_tiles.chunk(0, 0)
+        chunked_tiles.chunk(0, 1)
+        assert list(chunked_tiles.chunks) == [(2, 0), (3, 0), (0, 0), (0, 1)]
+        assert chunked_tiles[20, 0] == grid[20, 0]
+        assert (1, 0) in chunked_tiles.chunks
+        assert len(chunked_tiles.chunks) == 4
+
+    def test_set_cell_survives_eviction(self, grid, chunked_tiles):
+        chunked_tiles[20, 3] = 7
+        chunked_tiles[40, 40] = 9
+        assert chunked_tiles[20, 3] == 7
+        for chunk_x in range(5):
+            chunked_tiles.chunk(chunk_x, 2)
+        assert (1, 0) not in chunked_tiles.chunks
+        assert chunked_tiles[20, 3] == 7
+        assert chunked_tiles[40, 40] == 9
+        assert chunked_tiles[21, 3] == grid[21, 3]
+        window = chunked_tiles[16:32, 0:16]
+        assert window[4, 3] == 7
+        with pytest.raises(IndexError):
+            chunked_tiles[70, 0] = 1
@@ -0,0 +1,84 @@
+"""Tests the index of useable entities kept by the UseEntityProcessor."""
+import numpy
+import pytest
+from nightcaste.entities import EntityConfiguration
+from nightcaste.entities import EntityManager
+from nightcaste.events import EventManager
+from nightcaste.processors import UseEntityProcessor
+
+
+class UseEvent:
+
+    def __init__(self, user):
+        self.user = user
+
+
+@pytest.fixture
+def entity_manager():
+    return EntityManager()
+
+
+@pytest.fixture
+def event_manager():
+    event_manager = EventManager()
+    # Keep the payload of the thrown events
+    event_manager.thrown = []
+    event_manager.throw_new = lambda event_type, data=None: \
+        event_manager.thrown.append(data)
+    return event_manager
+
+
+def create_map(entity_manager, entities):
+    config = EntityConfiguration()
+    config.add_attribute('Map', 'tiles', numpy.zeros((20, 20), numpy.uint8))
+    config.add_attribute('Map', 'entities', entities)
+    config.add_attribute('Map', 'tilesetsize', 32)
+    entity_manager.current_map = entity_manager.new_from_config(config)
+
+
+def create_useable(entity_manager, x, y):
+    config = EntityConfiguration()
+    config.add_attribute('Position', 'x', x)
+    config.add_attribute('Position', 'y', y)
+    config.add_attribute('Useable', 'useEvent', 'MapChange')
+    return entity_manager.new_from_config(config)
+
+
+def create_user(entity_manager, x, y):
+    config = EntityConfiguration()
+    config.add_attribute('Colliding', 'w', 8)
+    config.add_attribute('Colliding', 'h', 8)
+    user = entity_manager.new_from_config(config)
+    entity_manager.get(user, 'Colliding').set_position(x, y)
+    return user
+
+
+class TestUseEntityProcessor:
+
+    def test_index_on_map_change(self, event_manager, entity_manager):
+        processor = UseEntityProcessor(event_manager, entity_manager)
+        stairs = create_useable(entity_manager, 100, 100)
+        other_stairs = create_useable(entity_manager, 300, 300)
+        create_map(entity_manager, [stairs])
+        processor.on_map_changed(None)
+        assert list(processor.rects) == [stairs]
+
+        processor.on_use_entity(UseEvent(create_user(entity_manager, 96, 96)))
+        assert event_manager.thrown == [{'usedEntity': stairs}]
+
+        create_map(entity_manager, [other_stairs])
+        processor.on_map_changed(None)
+        assert list(processor.rects) == [other_stairs]
+
+    def test_destroyed_useable(self, event_manager, entity_manager):
+        processor = UseEntityProcessor(event_manager, entity_manager)
+        stairs = create_useable(entity_manager, 100, 100)
+        user = create_user(entity_manager, 96, 96)
+        create_map(entity_manager, [stairs])
+        processor.on_map_changed(None)
+        entity_manager.destroy_entity(stairs)
+        processor.on_use_entity(UseEvent(user))
+        assert event_manager.thrown == []
+
+        processor.on_map_changed(None)
+        assert processor.rects == {}
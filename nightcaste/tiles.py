@@ -0,0 +1,213 @@
+"""Flyweight tiles. A map only stores a grid of tile type ids, the properties
+shared by all tiles of a type are stored once in the TileTypes table."""
+from collections import OrderedDict
+import logging
+import numpy
+
+# The dtype of the tile grids, limits the number of tile types
+TILE_DTYPE = numpy.uint8
+
+
+class TileTypes:
+    """Table of all tile types, created on demand from the tile blueprints.
+    Every variant of a blueprint gets its own id, so the id completely
+    describes how a tile is rendered.
+
+    Args:
+        blueprint_manager (BlueprintManager): Provides the tile blueprints.
+        tilesetsize (int): The size of a tile in pixels.
+
+    """
+    logger = logging.getLogger('tiles.TileTypes')
+
+    def __init__(self, blueprint_manager, tilesetsize=32):
+        self.blueprint_manager = blueprint_manager
+        self.tilesetsize = tilesetsize
+        # The tile ids of every registered blueprint {blueprint: (id, ...)}
+        self.ids = {}
+        # Properties indexed by tile id
+        self.names = []
+        self.blueprints = []
+        self.z_index = numpy.zeros(0, dtype=numpy.int32)
+        self.offset = numpy.zeros(0, dtype=numpy.int32)
+        self.blocking = numpy.zeros(0, dtype=bool)
+
+    def get_ids(self, blueprint):
+        """Get the ids of all variants of the specified tile blueprint.
+
+        Args:
+            blueprint (str): The blueprint name without the 'tiles.' prefix.
+
+        Returns:
+            A tuple of tile ids.
+
+        """
+        ids = self.ids.get(blueprint)
+        if ids is None:
+            ids = self._register(blueprint)
+        return ids
+
+    def get_id(self, blueprint):
+        """Get the id of the first variant of the tile blueprint."""
+        return self.get_ids(blueprint)[0]
+
+    def keys(self):
+        """Get the key (blueprint, variant index) of every tile id. The keys
+        identify the tile types independently of the registration order."""
+        return [(blueprint, tile_id - self.ids[blueprint][0])
+                for tile_id, blueprint in enumerate(self.blueprints)]
+
+    def translate(self, keys):
+        """Creates a lookup table which translates the tile ids of another
+        TileTypes table, described by its keys, into the ids of this table.
+
+        Args:
+            keys ([(str, int)]): The keys of the other table.
+
+        Returns:
+            A numpy array, which can be indexed with a grid of foreign ids.
+
+        """
+        return numpy.array([self.get_ids(blueprint)[variant]
+                            for blueprint, variant in keys], dtype=TILE_DTYPE)
+
+    def _register(self, blueprint):
+        config = self.blueprint_manager.get_entity_configuration(
+            'tiles.' + blueprint)
+        tile = config.get_attributes('Tile')
+        name = tile.get('name', blueprint)
+        variants = tile.get('variant')
+        names = [name + '_' + str(variant) for variant in variants] \
+            if variants else [name]
+        offset = tile.get('offset', 0)
+        if offset is not None and offset < 0:
+            offset = abs(offset * self.tilesetsize)
+        blocking = 'Colliding' in config.components and \
+            config.get_attributes('Colliding').get('blocking', True)
+
+        first = len(self.names)
+        ids = tuple(range(first, first + len(names)))
+        if ids[-1] > numpy.iinfo(TILE_DTYPE).max:
+            raise ValueError('Too many tile types for %s' % TILE_DTYPE)
+        self.names.extend(names)
+        self.blueprints.extend([blueprint] * len(names))
+        self.z_index = numpy.append(
+            self.z_index, [tile.get('z_index', 0)] * len(names))
+        self.offset = numpy.append(self.offset, [offset or 0] * len(names))
+        self.blocking = numpy.append(self.blocking, [blocking] * len(names))
+        self.ids[blueprint] = ids
+        self.logger.debug('Registered tile %s with ids %s', blueprint, ids)
+        return ids
+
+    def __len__(self):
+        return len(self.names)
+
+
+class ChunkedTiles:
+    """A tile grid which is split into square chunks. The chunks are created
+    on first access and only a limited number of them is kept in memory, the
+    least recently used chunks are dropped and recreated when they are needed
+    again. Therefore the chunk creation has to be deterministic. Cells which
+    are set after the creation are kept in an overlay, which is applied again
+    when their chunk is recreated.
+
+    The grid can be indexed like a two-dimensional numpy array with a cell
+    [x, y] or a window [x0:x1, y0:y1], which returns a numpy array.
+
+    Args:
+        width (int): The number of cells in horizontal direction.
+        height (int): The number of cells in vertical direction.
+        create_chunk (function): Creates the chunk of the given cells
+            create_chunk(x, y, width, height) -> numpy.ndarray
+        chunk_size (int): The number of cells in each direction of a chunk.
+        resident_chunks (int): The number of chunks kept in memory.
+
+    """
+    logger = logging.getLogger('tiles.ChunkedTiles')
+
+    def __init__(self, width, height, create_chunk, chunk_size=32,
+                 resident_chunks=64):
+        self.shape = (width, height)
+        self.dtype = numpy.dtype(TILE_DTYPE)
+        self.create_chunk = create_chunk
+        self.chunk_size = chunk_size
+        self.resident_chunks = resident_chunks
+        # The resident chunks in order of use {(chunk_x, chunk_y): grid}
+        self.chunks = OrderedDict()
+        # The set cells {(chunk_x, chunk_y): {(x, y): tile}}, with x, y
+        # relative to the chunk
+        self.writes = {}
+
+    def chunk(self, chunk_x, chunk_y):
+        """Get the grid of the specified chunk, creating it if it is not
+        resident."""
+        key = (chunk_x, chunk_y)
+        grid = self.chunks.get(key)
+        if grid is not None:
+            self.chunks.move_to_end(key)
+            return grid
+        x = chunk_x * self.chunk_size
+        y = chunk_y * self.chunk_size
+        grid = self.create_chunk(x, y,
+                                 min(self.chunk_size, self.shape[0] - x),
+                                 min(self.chunk_size, self.shape[1] - y))
+        for cell, tile in self.writes.get(key, {}).items():
+            grid[cell] = tile
+        self.chunks[key] = grid
+        if len(self.chunks) > self.resident_chunks:
+            evicted, _ = self.chunks.popitem(last=False)
+            self.logger.debug('Evicted chunk %s', evicted)
+        return grid
+
+    def window(self, x0, y0, x1, y1):
+        """Get the cells of the window [x0:x1, y0:y1] as numpy array. The
+        window is clipped to the grid."""
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.shape[0]), min(y1, self.shape[1])
+        result = numpy.empty((max(x1 - x0, 0), max(y1 - y0, 0)),
+                             dtype=self.dtype)
+        size = self.chunk_size
+        for chunk_x in range(x0 // size, (x1 - 1) // size + 1):
+            for chunk_y in range(y0 // size, (y1 - 1) // size + 1):
+                grid = self.chunk(chunk_x, chunk_y)
+                cx, cy = chunk_x * size, chunk_y * size
+                sx0, sy0 = max(x0, cx), max(y0, cy)
+                sx1 = min(x1, cx + grid.shape[0])
+                sy1 = min(y1, cy + grid.shape[1])
+                result[sx0 - x0:sx1 - x0, sy0 - y0:sy1 - y0] = \
+                    grid[sx0 - cx:sx1 - cx, sy0 - cy:sy1 - cy]
+        return result
+
+    def __getitem__(self, key):
+        x, y = key
+        if isinstance(x, slice) or isinstance(y, slice):
+            x_range = x if isinstance(x, slice) else slice(x, x + 1)
+            y_range = y if isinstance(y, slice) else slice(y, y + 1)
+            window = self.window(
+                x_range.start or 0, y_range.start or 0,
+                self.shape[0] if x_range.stop is None else x_range.stop,
+                self.shape[1] if y_range.stop is None else y_range.stop)
+            # Single cells drop the dimension like numpy does
+            if not isinstance(x, slice):
+                return window[0]
+            if not isinstance(y, slice):
+                return window[:, 0]
+            return window
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            raise IndexError('Cell %s,%s is outside of the map' % (x, y))
+        size = self.chunk_size
+        return self.chunk(x // size, y // size)[x % size, y % size]
+
+    def __setitem__(self, key, tile):
+        """Sets a single cell [x, y]. The value survives the eviction of its
+        chunk."""
+        x, y = key
+        if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+            raise IndexError('Cell %s,%s is outside of the map' % (x, y))
+        size = self.chunk_size
+        chunk_key = (x // size, y // size)
+        cell = (x % size, y % size)
+        self.writes.setdefault(chunk_key, {})[cell] = tile
+        grid = self.chunks.get(chunk_key)
+        if grid is not None:
+            grid[cell] = tile